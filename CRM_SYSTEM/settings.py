@@ -109,6 +109,110 @@ if not EMAIL_HOST_USER or not EMAIL_HOST_PASSWORD:
 
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 
+# Bulk sending (crm/mailer.py): long-lived SMTP connections kept open and
+# how many messages each connection takes per checkout.
+EMAIL_POOL_SIZE = int(os.getenv("EMAIL_POOL_SIZE", "4"))
+EMAIL_BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", "25"))
+EMAIL_TIMEOUT = 30
+
+# Provider quotas (Gmail: ~500/day for personal, 2000/day for Workspace) and
+# retry policy for failed EmailLog rows.
+EMAIL_RATE_PER_MINUTE = int(os.getenv("EMAIL_RATE_PER_MINUTE", "60"))
+EMAIL_RATE_PER_DAY = int(os.getenv("EMAIL_RATE_PER_DAY", "2000"))
+EMAIL_MAX_ATTEMPTS = 5
+EMAIL_RETRY_BASE_DELAY = 60
+EMAIL_RETRY_MAX_DELAY = 6 * 60 * 60
+
+# Longest a web request (student_send_email) waits for the rate limiter;
+# past it the email is left to the run_broadcasts worker's retries.
+EMAIL_INTERACTIVE_MAX_WAIT = 5
+
+# Student document attachments (crm/attachments.py). Gmail rejects messages
+# over 25 MB after base64 (+33%), so the raw budget stays below that.
+EMAIL_ATTACHMENT_MAX_BYTES = 18 * 1024 * 1024
+EMAIL_ATTACHMENT_CACHE_DIR = BASE_DIR / "cache" / "attachments"
+EMAIL_ATTACHMENT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+
+# Largest JSON array webhook_lead accepts in one request.
+WEBHOOK_MAX_BATCH = 1000
+
+# Acknowledge-first mode (crm/inbox.py): webhook_lead stores payloads and
+# answers 202; the run_webhook_inbox worker ingests them.
+WEBHOOK_ASYNC = os.getenv("WEBHOOK_ASYNC", "0") == "1"
+WEBHOOK_INBOX_MAX_ATTEMPTS = 5
+WEBHOOK_INBOX_RETRY_BASE_DELAY = 30
+WEBHOOK_INBOX_RETRY_MAX_DELAY = 60 * 60
+
+# Recently ingested idempotency keys kept in memory per process
+# (crm/idempotency.py); older replays are answered from the Lead table.
+IDEMPOTENCY_CACHE_SIZE = 10000
+IDEMPOTENCY_CACHE_TTL = 24 * 60 * 60
+
+# How webhook leads are shared out among active staff (crm/assignment.py):
+# "round_robin" or "least_open" (fewest unprocessed leads). least_open
+# re-reads the open-lead counts at most this often, in seconds. The cached
+# list of counselors is re-read at least every LEAD_ASSIGNMENT_ROSTER_TTL
+# seconds. round_robin reserves positions in the shared sequence
+# LEAD_ASSIGNMENT_BLOCK_SIZE at a time per process.
+LEAD_ASSIGNMENT_STRATEGY = os.getenv("LEAD_ASSIGNMENT_STRATEGY", "round_robin")
+LEAD_ASSIGNMENT_SYNC_INTERVAL = 60
+LEAD_ASSIGNMENT_ROSTER_TTL = 300
+LEAD_ASSIGNMENT_BLOCK_SIZE = 100
+
+
+# ==============================
+# CACHE
+# ==============================
+# Must be shared by every worker: the dashboard (crm/caching.py), reference
+# data (crm/refdata.py) and lead assignment roster (crm/assignment.py) keep
+# version keys there that all processes have to see. The default file cache
+# is shared by the workers of one host, like the SQLite database; with
+# several hosts point this at Redis/Memcached, e.g.
+# CACHE_BACKEND=django.core.cache.backends.redis.RedisCache
+# CACHE_LOCATION=redis://127.0.0.1:6379/1
+# (LocMemCache is per process: only for a single worker.)
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv("CACHE_BACKEND", "django.core.cache.backends.filebased.FileBasedCache"),
+        "LOCATION": os.getenv("CACHE_LOCATION", str(BASE_DIR / "cache" / "django")),
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    }
+}
+
+DASHBOARD_CACHE_TIMEOUT = 300
+
+# Longest a process keeps its copy of Country/Tag/SiteConfig (crm/refdata.py)
+# without re-reading it, in seconds.
+REFDATA_MAX_AGE = 60
+
+# List pages (crm/pagination.py) show an approximate total from a cached
+# COUNT(*) instead of counting on every request.
+PAGINATION_COUNT_TTL = 300
+
+# Resized copies of uploaded images (crm/images.py): size name -> bounding
+# box in pixels. Written as "webp" or "jpeg" at this quality.
+IMAGE_DERIVATIVE_SIZES = {"thumb": (160, 160), "preview": (960, 960)}
+IMAGE_DERIVATIVE_FORMAT = "webp"
+IMAGE_DERIVATIVE_QUALITY = 80
+
+# Rows read per query (and sent per write) by the CSV/XLSX exports
+# (crm/exports.py).
+EXPORT_CHUNK_SIZE = 2000
+
+# Chunked, resumable document uploads (crm/uploads.py). Browsers send
+# UPLOAD_CHUNK_SIZE bytes per request; the server takes up to
+# UPLOAD_CHUNK_MAX_BYTES. Unfinished uploads are dropped after the TTL.
+# Each user may have UPLOAD_MAX_SESSIONS_PER_USER uploads not yet attached,
+# of UPLOAD_MAX_PENDING_BYTES_PER_USER bytes in all.
+UPLOAD_SESSION_DIR = BASE_DIR / "cache" / "uploads"
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+UPLOAD_CHUNK_MAX_BYTES = 8 * 1024 * 1024
+UPLOAD_MAX_BYTES = 200 * 1024 * 1024
+UPLOAD_SESSION_TTL = 24 * 60 * 60
+UPLOAD_MAX_SESSIONS_PER_USER = 20
+UPLOAD_MAX_PENDING_BYTES_PER_USER = 1024 * 1024 * 1024
+
 
 # ==============================
 # DATABASE
@@ -116,8 +220,13 @@ DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        # sqlite3 with BEGIN IMMEDIATE transactions, so concurrent writers
+        # wait up to "timeout" seconds for each other instead of failing.
+        'ENGINE': 'CRM_SYSTEM.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {'timeout': 20},
+        # A file (not in-memory) test database, so threaded tests can share it.
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -149,6 +258,14 @@ AUTH_PASSWORD_VALIDATORS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Uploaded files are served by crm.views.protected_media after a permission
+# check (crm/media.py). Set MEDIA_SENDFILE_HEADER to let the front server
+# send them: "X-Accel-Redirect" (nginx; MEDIA_SENDFILE_URL must be an
+# internal location aliased to MEDIA_ROOT) or "X-Sendfile" (Apache
+# mod_xsendfile, lighttpd). Empty: Django streams them itself.
+MEDIA_SENDFILE_HEADER = os.getenv("MEDIA_SENDFILE_HEADER", "")
+MEDIA_SENDFILE_URL = os.getenv("MEDIA_SENDFILE_URL", "/protected-media/")
+
 STATIC_URL = 'static/'
 
 
@@ -0,0 +1,19 @@
+"""
+SQLite backend whose transactions start with ``BEGIN IMMEDIATE``.
+
+With the default deferred ``BEGIN``, a transaction that reads and then
+writes (every upsert does) only asks for the write lock at its first
+write; if another connection is writing by then, SQLite fails at once
+with "database is locked" instead of waiting for the busy timeout.
+Taking the write lock up front makes concurrent workers queue on
+``OPTIONS["timeout"]`` instead. (Django 5.1 offers this as the
+``transaction_mode`` option.)
+"""
+
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute("BEGIN IMMEDIATE")
@@ -1,14 +1,21 @@
+import re
+
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 
 from django.conf import settings
-from django.conf.urls.static import static
+
+from crm.views import protected_media
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('crm.urls')),  # your app urls
-]
 
-# Serve media files during development only
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    # Uploaded files, checked against the user's access to their student
+    # (crm/media.py); never served as plain static files.
+    re_path(
+        r"^%s(?P<name>.+)$" % re.escape(settings.MEDIA_URL.lstrip("/")),
+        protected_media,
+        name="protected_media",
+    ),
+]
@@ -1,10 +1,16 @@
 from django.contrib import admin
-from .models import Student, Lead, StudentDocument, ActivityLog, Country, Tag, SiteConfig
+from .exports import export_response
+from .inbox import requeue_dead
+from .search import search_students
+from .models import (
+    Student, Lead, StudentDocument, ActivityLog, Country, Tag, SiteConfig, BroadcastJob,
+    EmailLog, WebhookInbox, Blob,
+)
 
 class StudentDocumentInline(admin.TabularInline):
     model = StudentDocument
     extra = 0
-    readonly_fields = ('uploaded_at',)
+    readonly_fields = ('uploaded_at','original_name')
 
 class ActivityInline(admin.StackedInline):
     model = ActivityLog
@@ -19,7 +25,11 @@ class StudentAdmin(admin.ModelAdmin):
     search_fields = ('first_name','last_name','email','phone','passport_number')
     inlines = [StudentDocumentInline, ActivityInline]
     readonly_fields = ('created_at','updated_at','consent_timestamp')
-    actions = ['mark_archived','export_selected']
+    actions = ['mark_archived','export_selected','export_selected_xlsx']
+
+    def get_search_results(self, request, queryset, search_term):
+        # search_fields only enables the search box; matching uses the FTS index
+        return search_students(queryset, search_term), False
 
     def mark_archived(self, request, queryset):
         updated = queryset.update(archived=True)
@@ -27,19 +37,13 @@ class StudentAdmin(admin.ModelAdmin):
     mark_archived.short_description = "Mark selected students as archived"
 
     def export_selected(self, request, queryset):
-        # simple CSV export action
-        import csv
-        from django.http import HttpResponse
-        fieldnames = ['id','first_name','last_name','email','phone','country','passport_number','visa_type','visa_expiry']
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename=students_export.csv'
-        writer = csv.writer(response)
-        writer.writerow(fieldnames)
-        for s in queryset:
-            writer.writerow([getattr(s,f) if not callable(getattr(s,f,'')) else '' for f in fieldnames])
-        return response
+        return export_response(queryset, 'csv', 'students_export')
     export_selected.short_description = "Export selected students to CSV"
 
+    def export_selected_xlsx(self, request, queryset):
+        return export_response(queryset, 'xlsx', 'students_export')
+    export_selected_xlsx.short_description = "Export selected students to Excel"
+
 @admin.register(Lead)
 class LeadAdmin(admin.ModelAdmin):
     list_display = ('id','source','phone','email','student','processed','created_at','assigned_to')
@@ -49,14 +53,49 @@ class LeadAdmin(admin.ModelAdmin):
 
 @admin.register(StudentDocument)
 class StudentDocumentAdmin(admin.ModelAdmin):
-    list_display = ('id','title','student','uploaded_at')
-    search_fields = ('title','student__first_name','student__last_name')
+    list_display = ('id','title','original_name','student','uploaded_at')
+    search_fields = ('title','original_name','student__first_name','student__last_name')
+    readonly_fields = ('original_name',)
+
+@admin.register(Blob)
+class BlobAdmin(admin.ModelAdmin):
+    list_display = ('id','name','size','ref_count','created_at')
+    search_fields = ('sha256',)
+    readonly_fields = ('name','sha256','size','ref_count','created_at')
 
 @admin.register(ActivityLog)
 class ActivityAdmin(admin.ModelAdmin):
     list_display = ('id','action','user','student','created_at')
     readonly_fields = ('data',)
 
+@admin.register(BroadcastJob)
+class BroadcastJobAdmin(admin.ModelAdmin):
+    list_display = ('id','subject','status','cursor','total','sent_count','failed_count','created_at')
+    list_filter = ('status',)
+    exclude = ('recipient_ids',)
+    readonly_fields = ('cursor','total','sent_count','failed_count','started_at','heartbeat_at','finished_at','last_error')
+
+@admin.register(EmailLog)
+class EmailLogAdmin(admin.ModelAdmin):
+    list_display = ('id','to_email','rendered_subject','status','sent_at')
+    list_filter = ('status',)
+    search_fields = ('to_email',)
+    list_select_related = ('template',)
+    fields = ('student','lead','broadcast','to_email','from_email','rendered_subject','rendered_body','status','error_message','sent_at')
+    readonly_fields = fields
+
+@admin.register(WebhookInbox)
+class WebhookInboxAdmin(admin.ModelAdmin):
+    list_display = ('id','status','attempts','next_attempt_at','received_at','processed_at','last_error')
+    list_filter = ('status',)
+    readonly_fields = ('payload','status','attempts','next_attempt_at','last_error','claimed_by','claimed_at','result','received_at','processed_at')
+    actions = ['requeue']
+
+    def requeue(self, request, queryset):
+        count = requeue_dead(list(queryset.values_list('id', flat=True)))
+        self.message_user(request, f"Requeued {count} dead-lettered payload(s).")
+    requeue.short_description = "Requeue dead-lettered payloads"
+
 admin.site.register(Country)
 admin.site.register(Tag)
 admin.site.register(SiteConfig)
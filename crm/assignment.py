@@ -0,0 +1,192 @@
+# crm/assignment.py
+"""
+Counselor assignment for incoming leads.
+
+The roster of eligible counselors (active staff users, by id) is kept in
+the shared cache for ``LEAD_ASSIGNMENT_ROSTER_TTL`` seconds and dropped
+early by the ``User`` signals in ``crm/signals.py``, so assigning a batch
+of leads normally costs no query on the users table.
+
+Two strategies, chosen with ``LEAD_ASSIGNMENT_STRATEGY``:
+
+``round_robin``
+    Every worker draws positions from the same ``Counter`` sequence, so the
+    rotation stays even however the leads are spread over processes. Each
+    process reserves ``LEAD_ASSIGNMENT_BLOCK_SIZE`` positions at a time with
+    one atomic ``UPDATE`` and hands them out from memory, so assigning a
+    lead normally writes nothing; positions left in a block when a process
+    exits are skipped.
+
+``least_open``
+    Each lead goes to the counselor with the fewest open (unprocessed)
+    leads, ties in turn. The loads live in process memory in count buckets,
+    so picking one is O(1). They are re-read from the ``Lead`` table, which
+    is where assignments persist, when the roster changes and at most every
+    ``LEAD_ASSIGNMENT_SYNC_INTERVAL`` seconds, which folds in other
+    workers' assignments and leads closed since.
+"""
+
+import threading
+import time
+from collections import defaultdict, deque
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+
+ROSTER_KEY = "crm:assignment:roster"
+COUNTER_NAME = "assignment:round-robin"
+
+STRATEGIES = ("round_robin", "least_open")
+
+
+# -------------------------------------------------------
+# ROSTER
+# -------------------------------------------------------
+
+def roster():
+    """``(version, [user ids])`` of the counselors leads can be assigned to."""
+    entry = cache.get(ROSTER_KEY)
+    if entry is None:
+        User = get_user_model()
+        ids = list(
+            User.objects.filter(is_active=True, is_staff=True)
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+        entry = (time.time_ns(), ids)
+        cache.set(ROSTER_KEY, entry, settings.LEAD_ASSIGNMENT_ROSTER_TTL)
+    return entry
+
+
+def invalidate_roster():
+    """Drop the cached roster once the current transaction commits."""
+    transaction.on_commit(lambda: cache.delete(ROSTER_KEY))
+
+
+# -------------------------------------------------------
+# STRATEGIES
+# -------------------------------------------------------
+
+_block = None  # [next position, end] of this process's reserved positions
+_block_lock = threading.Lock()
+
+
+def _positions(count):
+    """The next ``count`` round-robin positions, reserving a block when needed."""
+    from .models import Counter
+
+    global _block
+
+    positions = []
+    with _block_lock:
+        while len(positions) < count:
+            if _block is None or _block[0] == _block[1]:
+                size = max(settings.LEAD_ASSIGNMENT_BLOCK_SIZE, count - len(positions))
+                end = Counter.advance(COUNTER_NAME, size)
+                _block = [end - size, end]
+            take = min(count - len(positions), _block[1] - _block[0])
+            positions.extend(range(_block[0], _block[0] + take))
+            _block[0] += take
+    return positions
+
+
+def _round_robin(counselors, count):
+    return [counselors[position % len(counselors)] for position in _positions(count)]
+
+
+class LeastLoaded:
+    """
+    Open-lead counts per counselor, bucketed by count so the least loaded
+    counselor is found in O(1). Counselors with equal loads take turns.
+    """
+
+    def __init__(self, loads):
+        self._load = dict(loads)
+        self._buckets = defaultdict(deque)
+        for user_id, load in sorted(self._load.items()):
+            self._buckets[load].append(user_id)
+        self._min = min(self._load.values(), default=0)
+
+    def load(self, user_id):
+        return self._load[user_id]
+
+    def take(self):
+        # Loads only grow between syncs, so the minimum only moves up.
+        while not self._buckets[self._min]:
+            del self._buckets[self._min]
+            self._min += 1
+        user_id = self._buckets[self._min].popleft()
+        self._load[user_id] += 1
+        self._buckets[self._min + 1].append(user_id)
+        return user_id
+
+
+def open_leads(counselors):
+    """Number of unprocessed leads assigned to each of ``counselors``."""
+    from .models import Lead
+
+    loads = dict.fromkeys(counselors, 0)
+    rows = (
+        Lead.objects.filter(assigned_to__in=counselors, processed=False)
+        .values("assigned_to")
+        .annotate(n=Count("id"))
+        .values_list("assigned_to", "n")
+    )
+    loads.update(rows)
+    return loads
+
+
+_balancer = None  # (roster version, synced at, LeastLoaded)
+_balancer_lock = threading.Lock()
+
+
+def _least_open(version, counselors, count):
+    global _balancer
+
+    with _balancer_lock:
+        now = time.monotonic()
+        if (
+            _balancer is None
+            or _balancer[0] != version
+            or now - _balancer[1] >= settings.LEAD_ASSIGNMENT_SYNC_INTERVAL
+        ):
+            _balancer = (version, now, LeastLoaded(open_leads(counselors)))
+        balancer = _balancer[2]
+        return [balancer.take() for _ in range(count)]
+
+
+def reset():
+    """
+    Forget the in-process loads (they are re-read on the next assignment)
+    and the reserved round-robin positions.
+    """
+    global _balancer, _block
+
+    with _balancer_lock:
+        _balancer = None
+    with _block_lock:
+        _block = None
+
+
+# -------------------------------------------------------
+# ASSIGNMENT
+# -------------------------------------------------------
+
+def assign_counselors(count, strategy=None):
+    """
+    User ids to assign the next ``count`` leads to, in order; None for each
+    when there are no eligible counselors.
+    """
+    strategy = strategy or settings.LEAD_ASSIGNMENT_STRATEGY
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown lead assignment strategy: {strategy!r}")
+
+    version, counselors = roster()
+    if not count or not counselors:
+        return [None] * count
+    if strategy == "round_robin":
+        return _round_robin(counselors, count)
+    return _least_open(version, counselors, count)
@@ -0,0 +1,217 @@
+# crm/attachments.py
+"""
+Attachment building for ``student_send_email``.
+
+Each ``StudentDocument`` is base64-encoded once, streaming from disk in
+small chunks, into ``EMAIL_ATTACHMENT_CACHE_DIR/parts/<sha256>.b64``. A
+small index keyed by the file's path, size and mtime remembers that hash,
+so re-sending to the same student reuses the encoded part without reading
+the original again. The parts are kept under
+``EMAIL_ATTACHMENT_CACHE_MAX_BYTES``, least recently used first out.
+
+Attached parts (``CachedPart``) hold only the cache file's path: the
+encoded text is read when the message is serialised for sending, so an
+``EmailMessage`` waiting for a connection does not keep it in memory.
+smtplib takes the serialised message in one piece, so the budget below
+(``EMAIL_ATTACHMENT_MAX_BYTES``) is what bounds memory while sending. A
+part evicted meanwhile is encoded again on that read.
+
+Anything skipped is returned so the caller can log it.
+"""
+
+import base64
+import hashlib
+import json
+import mimetypes
+import os
+import tempfile
+from email.mime.base import MIMEBase
+
+from django.conf import settings
+
+# 57 raw bytes encode to one 76-character base64 line (RFC 2045).
+LINE_BYTES = 57
+CHUNK_BYTES = LINE_BYTES * 1024
+
+
+def _cache_dir(*parts):
+    path = os.path.join(settings.EMAIL_ATTACHMENT_CACHE_DIR, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _atomic_write(path, write):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            write(fh)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def _evict(keep):
+    """Delete the least recently used parts until the cache fits its budget."""
+    parts_dir = _cache_dir("parts")
+    parts = []
+    for entry in os.scandir(parts_dir):
+        if entry.name.endswith(".b64") and entry.path != keep:
+            stat = entry.stat()
+            parts.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in parts)
+    if os.path.exists(keep):
+        total += os.path.getsize(keep)
+    for _, size, path in sorted(parts):
+        if total <= settings.EMAIL_ATTACHMENT_CACHE_MAX_BYTES:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def _encode_to_cache(path):
+    """Stream ``path`` through sha256 + base64 into the cache; return the hash."""
+    digest = hashlib.sha256()
+    parts_dir = _cache_dir("parts")
+    fd, tmp = tempfile.mkstemp(dir=parts_dir)
+
+    try:
+        with open(path, "rb") as src, os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = src.read(CHUNK_BYTES)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(base64.encodebytes(chunk))
+        content_hash = digest.hexdigest()
+        part_path = os.path.join(parts_dir, f"{content_hash}.b64")
+        os.replace(tmp, part_path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+    _evict(keep=part_path)
+    return content_hash
+
+
+def encoded_part_path(path):
+    """
+    Return the cached base64 file for ``path``, encoding it on a miss.
+
+    Cache entries are keyed by content hash; the per-path index only records
+    which hash a given (size, mtime) of the file had.
+    """
+    stat = os.stat(path)
+    key = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()
+    index_path = os.path.join(_cache_dir("index"), f"{key}.json")
+
+    try:
+        with open(index_path) as fh:
+            entry = json.load(fh)
+    except (OSError, ValueError):
+        entry = {}
+
+    if entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime_ns:
+        part_path = os.path.join(_cache_dir("parts"), f"{entry['sha256']}.b64")
+        try:
+            os.utime(part_path)  # recently used: evicted last
+            return part_path
+        except FileNotFoundError:
+            pass
+
+    content_hash = _encode_to_cache(path)
+    entry = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "sha256": content_hash}
+    _atomic_write(index_path, lambda fh: fh.write(json.dumps(entry).encode("utf-8")))
+
+    return os.path.join(_cache_dir("parts"), f"{content_hash}.b64")
+
+
+class CachedPart(MIMEBase):
+    """A base64 MIME part whose body stays in the cache until it is serialised."""
+
+    def __init__(self, maintype, subtype, source_path):
+        self.source_path = source_path
+        super().__init__(maintype, subtype)
+
+    # The email generators read ``_payload`` directly.
+    @property
+    def _payload(self):
+        with open(encoded_part_path(self.source_path), "r", encoding="ascii") as fh:
+            return fh.read()
+
+    @_payload.setter
+    def _payload(self, value):
+        if value is not None:  # Message.__init__ sets None
+            raise TypeError("The payload of a cached part comes from its file.")
+
+
+def mime_part(path, filename):
+    """Build a MIME part backed by the cached base64 encoding of ``path``."""
+    mimetype, _ = mimetypes.guess_type(filename)
+    maintype, subtype = (mimetype or "application/octet-stream").split("/", 1)
+
+    encoded_part_path(path)  # encode now, so errors surface while attaching
+    part = CachedPart(maintype, subtype, path)
+    part["Content-Transfer-Encoding"] = "base64"
+    part.add_header("Content-Disposition", "attachment", filename=filename)
+    return part
+
+
+def attach_documents(email, documents, budget=None):
+    """
+    Attach ``documents`` to ``email`` within a total size budget.
+
+    Returns a list of skipped documents as dicts with ``document_id``,
+    ``title``, ``reason`` (missing, too_large, over_budget, error) and
+    ``detail``.
+    """
+    budget = settings.EMAIL_ATTACHMENT_MAX_BYTES if budget is None else budget
+    remaining = budget
+    skipped = []
+
+    for doc in documents:
+        if not doc.file:
+            continue
+
+        def skip(reason, detail=""):
+            skipped.append(
+                {
+                    "document_id": doc.id,
+                    "title": doc.title or doc.filename,
+                    "reason": reason,
+                    "detail": detail,
+                }
+            )
+
+        try:
+            path = doc.file.path
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            skip("missing", doc.file.name)
+            continue
+        except Exception as e:
+            skip("error", str(e))
+            continue
+
+        if size > budget:
+            skip("too_large", f"{size} bytes, limit {budget}")
+            continue
+        if size > remaining:
+            skip("over_budget", f"{size} bytes, {remaining} left of {budget}")
+            continue
+
+        try:
+            email.attach(mime_part(path, doc.filename))
+        except Exception as e:
+            skip("error", str(e))
+            continue
+
+        remaining -= size
+
+    return skipped
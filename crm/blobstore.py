@@ -0,0 +1,326 @@
+# crm/blobstore.py
+"""
+Content-addressed storage for ``StudentDocument`` files.
+
+The same passport scan or transcript is often uploaded many times (on
+create, on edit, from the detail page). ``BlobStorage`` hashes each upload
+with SHA-256 while it streams the upload to a temporary file. It then
+keeps the file under ``blobs/<aa>/<bb>/<sha256><ext>``, or drops it when
+that blob is already stored. Identical uploads therefore share one file;
+the name the user uploaded is kept on the document (``original_name``).
+
+Each blob has a ``Blob`` row counting the documents that point at it. The
+``StudentDocument`` signals in ``crm/signals.py`` call ``retain`` and
+``release``, and a blob is deleted once its last document is.
+
+An upload that finds its blob already stored is only counted by ``retain``
+once the document is saved. Until then the blob is pinned
+(``blobs/tmp/pins/<sha256>``) so that ``collect`` cannot delete it from
+under the upload: both take the same file lock, and ``collect`` leaves a
+pinned blob alone for ``PIN_TTL``. ``retain`` removes the pin.
+
+Files stored before this (``student_documents/...``) are moved into the
+store by ``manage.py dedupe_documents``; until then they are left alone.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.core.files import locks
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+
+BLOB_DIR = "blobs"
+PIN_DIR = f"{BLOB_DIR}/tmp/pins"
+HASH_CHUNK_BYTES = 1024 * 1024
+
+# An upload normally retains its blob within a second of pinning it; a pin
+# this old belongs to a save that failed.
+PIN_TTL = 60 * 60
+
+# Extensions kept on blob names (so the file is served with its type);
+# longer or odd ones are dropped.
+MAX_EXTENSION_LENGTH = 10
+
+
+def blob_name(content_hash, filename=""):
+    ext = os.path.splitext(filename)[1].lower()
+    if len(ext) > MAX_EXTENSION_LENGTH or not ext[1:].isalnum():
+        ext = ""
+    return f"{BLOB_DIR}/{content_hash[:2]}/{content_hash[2:4]}/{content_hash}{ext}"
+
+
+def is_blob(name):
+    return bool(name) and name.startswith(BLOB_DIR + "/")
+
+
+def blob_hash(name):
+    return os.path.splitext(os.path.basename(name))[0]
+
+
+def hash_file(handle):
+    """SHA-256 hex digest and size of an open binary file, read in chunks."""
+    digest = hashlib.sha256()
+    size = 0
+    while chunk := handle.read(HASH_CHUNK_BYTES):
+        digest.update(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
+
+# -------------------------------------------------------
+# STORAGE
+# -------------------------------------------------------
+
+class BlobStorage(FileSystemStorage):
+    """``FileSystemStorage`` (under MEDIA_ROOT) that stores each content once."""
+
+    @contextmanager
+    def lock(self):
+        """Exclusive lock between reusing a stored blob and collecting it."""
+        path = self.path(os.path.join(BLOB_DIR, "tmp", ".lock"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "ab") as handle:
+            locks.lock(handle, locks.LOCK_EX)
+            try:
+                yield
+            finally:
+                locks.unlock(handle)
+
+    def pin_path(self, name):
+        return self.path(f"{PIN_DIR}/{blob_hash(name)}")
+
+    def get_available_name(self, name, max_length=None):
+        # The stored name is only known once the content is hashed (_save);
+        # a name that exists already is the point, not a clash.
+        return name
+
+    def _save(self, name, content):
+        staging = self.path(os.path.join(BLOB_DIR, "tmp"))
+        os.makedirs(staging, exist_ok=True)
+
+        if hasattr(content, "temporary_file_path"):
+            # Large uploads are already on disk: hash them where they are.
+            source = content.temporary_file_path()
+            with open(source, "rb") as handle:
+                content_hash, _ = hash_file(handle)
+            moved = False
+        else:
+            digest = hashlib.sha256()
+            fd, source = tempfile.mkstemp(dir=staging)
+            try:
+                with os.fdopen(fd, "wb") as out:
+                    for chunk in content.chunks():
+                        digest.update(chunk)
+                        out.write(chunk)
+            except BaseException:
+                os.unlink(source)
+                raise
+            content_hash = digest.hexdigest()
+            moved = True
+
+        name = blob_name(content_hash, name)
+        path = self.path(name)
+        with self.lock():
+            if os.path.exists(path):
+                pin = self.pin_path(name)
+                os.makedirs(os.path.dirname(pin), exist_ok=True)
+                with open(pin, "ab"):
+                    os.utime(pin)
+                if moved:
+                    os.unlink(source)
+                return name
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if moved:
+                os.replace(source, path)
+            else:
+                file_move_safe(source, path, allow_overwrite=True)
+        if self.file_permissions_mode is not None:
+            os.chmod(path, self.file_permissions_mode)
+        return name
+
+
+_storage = BlobStorage()
+
+
+def document_storage():
+    """The storage of ``StudentDocument.file`` (a callable, for migrations)."""
+    return _storage
+
+
+# -------------------------------------------------------
+# REFERENCE COUNTS
+# -------------------------------------------------------
+
+def retain(name, count=1):
+    """Count ``count`` more documents pointing at blob ``name``, and unpin it."""
+    from .models import Blob
+
+    if not is_blob(name):
+        return
+    if not Blob.objects.filter(name=name).update(ref_count=F("ref_count") + count):
+        try:
+            with transaction.atomic():
+                Blob.objects.create(
+                    name=name,
+                    sha256=blob_hash(name),
+                    size=_storage.size(name),
+                    ref_count=count,
+                )
+        except IntegrityError:  # created meanwhile
+            Blob.objects.filter(name=name).update(ref_count=F("ref_count") + count)
+    # Unpinned before commit, but collect() deletes under a write lock and
+    # so waits for this transaction (or for the row lock the update took).
+    _unpin(name)
+
+
+def _unpin(name):
+    try:
+        os.unlink(_storage.pin_path(name))
+    except FileNotFoundError:
+        pass
+
+
+def release(name):
+    """One document less points at ``name``; delete the blob after commit if none do."""
+    from .models import Blob
+
+    if not is_blob(name):
+        return
+    Blob.objects.filter(name=name, ref_count__gt=0).update(ref_count=F("ref_count") - 1)
+    transaction.on_commit(lambda: collect(name))
+
+
+def collect(name):
+    """Delete blob ``name`` if no document points at it (or is being saved with it)."""
+    from .models import Blob
+
+    # The database first: _save may take the file lock inside a transaction.
+    with transaction.atomic(), _storage.lock():
+        try:
+            if time.time() - os.path.getmtime(_storage.pin_path(name)) < PIN_TTL:
+                return False
+        except FileNotFoundError:
+            pass
+        deleted, _ = Blob.objects.filter(name=name, ref_count__lte=0).delete()
+        if deleted:
+            _storage.delete(name)
+            _unpin(name)
+    return bool(deleted)
+
+
+# -------------------------------------------------------
+# DEDUPLICATING OLD FILES
+# -------------------------------------------------------
+
+def _place(path, name):
+    """Put a copy of ``path`` at blob ``name`` (a hard link when possible)."""
+    target = _storage.path(name)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target))
+    os.close(fd)
+    os.unlink(tmp)
+    try:
+        os.link(path, tmp)
+    except OSError:
+        shutil.copyfile(path, tmp)
+    os.replace(tmp, target)
+
+
+def dedupe_documents(dry_run=False, on_file=None):
+    """
+    Move every document file stored outside the blob store into it.
+
+    Each distinct file is hashed once; the documents pointing at it are
+    repointed to the blob in one transaction, and the old file is removed
+    after that commits. Returns a report dict; ``bytes_reclaimed`` is the
+    size of the old files minus the blobs that had to be written for them.
+    """
+    from .models import StudentDocument
+
+    report = {
+        "documents": 0, "files": 0, "missing": 0, "blobs_created": 0,
+        "bytes_before": 0, "bytes_written": 0, "bytes_reclaimed": 0,
+    }
+    # Read up front: the loop rewrites the rows it would be reading.
+    names = list(
+        StudentDocument.objects.exclude(file="")
+        .exclude(file__startswith=BLOB_DIR + "/")
+        .values_list("file", flat=True)
+        .distinct()
+        .order_by("file")
+    )
+    new_blobs = set()
+
+    for old in names:
+        documents = StudentDocument.objects.filter(file=old)
+        try:
+            path = _storage.path(old)
+            with open(path, "rb") as handle:
+                content_hash, size = hash_file(handle)
+        except (FileNotFoundError, ValueError):
+            report["missing"] += 1
+            if on_file:
+                on_file(old, None)
+            continue
+
+        name = blob_name(content_hash, old)
+        count = documents.count()
+        report["files"] += 1
+        report["documents"] += count
+        report["bytes_before"] += size
+        if name not in new_blobs and not _storage.exists(name):
+            new_blobs.add(name)
+            report["blobs_created"] += 1
+            report["bytes_written"] += size
+        if on_file:
+            on_file(old, name)
+        if dry_run:
+            continue
+
+        if not _storage.exists(name):
+            _place(path, name)
+        with transaction.atomic():
+            documents.filter(original_name="").update(original_name=os.path.basename(old))
+            documents.update(file=name)
+            retain(name, count)
+            transaction.on_commit(lambda old=old: _storage.delete(old))
+
+    report["bytes_reclaimed"] = report["bytes_before"] - report["bytes_written"]
+    return report
+
+
+def recount():
+    """
+    Reset every ``Blob.ref_count`` from the documents pointing at it, and
+    delete blobs none do. Returns the number of counts corrected.
+    """
+    from .models import Blob, StudentDocument
+
+    actual = dict(
+        StudentDocument.objects.filter(file__startswith=BLOB_DIR + "/")
+        .values_list("file")
+        .annotate(n=Count("id"))
+    )
+    corrected = 0
+    for name in actual.keys() - set(Blob.objects.values_list("name", flat=True)):
+        try:
+            retain(name, actual[name])
+        except FileNotFoundError:
+            continue
+        corrected += 1
+    for blob in Blob.objects.only("name", "ref_count").iterator(chunk_size=500):
+        count = actual.get(blob.name, 0)
+        if blob.ref_count != count:
+            Blob.objects.filter(pk=blob.pk).update(ref_count=count)
+            corrected += 1
+        if not count:
+            transaction.on_commit(lambda name=blob.name: collect(name))
+    return corrected
@@ -0,0 +1,286 @@
+# crm/broadcast.py
+"""
+Background email broadcasts.
+
+``email_broadcast`` only snapshots the audience into a ``BroadcastJob``;
+the ``run_broadcasts`` management command picks queued jobs up and sends
+them chunk by chunk, checkpointing ``BroadcastJob.cursor`` after each chunk.
+The same worker re-sends failed ``EmailLog`` rows whose ``next_retry_at``
+has come due.
+
+While a job is processed a ``Heartbeat`` thread keeps ``heartbeat_at``
+fresh, so a chunk held up by the rate limiter or a slow server is not
+taken for a crashed worker and claimed a second time.
+"""
+
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .mailer import apply_results, get_sender
+from .models import BroadcastJob, EmailLog, EmailTemplate, Student
+from .templating import compile_message
+
+DEFAULT_CHUNK_SIZE = 100
+RETRY_BATCH_SIZE = 200
+
+# A running job whose worker has not checked in for this long is considered
+# crashed and may be claimed by another worker.
+STALE_AFTER = timedelta(minutes=5)
+HEARTBEAT_INTERVAL = STALE_AFTER / 5
+
+
+# -------------------------------------------------------
+# AUDIENCE
+# -------------------------------------------------------
+
+def audience_queryset(audience, course=None, country=None, status=None):
+    qs = Student.objects.filter(archived=False).exclude(email="")
+
+    if audience == "course" and course:
+        qs = qs.filter(course__icontains=course)
+    elif audience == "country" and country:
+        qs = qs.filter(country=country)
+    elif audience == "status" and status:
+        qs = qs.filter(application_status=status)
+
+    return qs
+
+
+def create_job(subject, body, queryset, filters=None, user=None):
+    """Snapshot the recipients of ``queryset`` into a new queued job."""
+    recipient_ids = list(queryset.order_by("id").values_list("id", flat=True))
+
+    return BroadcastJob.objects.create(
+        created_by=user,
+        subject=subject,
+        body=body,
+        filters=filters,
+        recipient_ids=recipient_ids,
+        total=len(recipient_ids),
+    )
+
+
+# -------------------------------------------------------
+# WORKER
+# -------------------------------------------------------
+
+def claim_next_job():
+    """
+    Atomically claim the oldest queued job (or a running job whose worker
+    went away). Returns None when there is nothing to do.
+    """
+    stale_before = timezone.now() - STALE_AFTER
+    candidates = (
+        BroadcastJob.objects.filter(
+            Q(status="queued")
+            | Q(status="running", heartbeat_at__lt=stale_before)
+        )
+        .order_by("created_at")
+        .values_list("id", "status", "heartbeat_at")
+    )
+
+    for job_id, status, heartbeat_at in candidates[:10]:
+        now = timezone.now()
+        claimed = BroadcastJob.objects.filter(
+            pk=job_id, status=status, heartbeat_at=heartbeat_at
+        ).update(status="running", heartbeat_at=now)
+
+        if claimed:
+            job = BroadcastJob.objects.get(pk=job_id)
+            if job.started_at is None:
+                job.started_at = now
+                job.save(update_fields=["started_at"])
+            return job
+
+    return None
+
+
+class Heartbeat:
+    """Touch a running job's ``heartbeat_at`` every ``interval`` from a thread."""
+
+    def __init__(self, job_id, interval=HEARTBEAT_INTERVAL):
+        self.job_id = job_id
+        self.interval = interval.total_seconds()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name=f"broadcast-{job_id}-heartbeat", daemon=True
+        )
+
+    def _run(self):
+        try:
+            while not self._stop.wait(self.interval):
+                BroadcastJob.objects.filter(pk=self.job_id, status="running").update(
+                    heartbeat_at=timezone.now()
+                )
+        finally:
+            connection.close()  # this thread's own connection
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def send_chunk(job, template, student_ids, sender):
+    """
+    Send one chunk and write its ``EmailLog`` rows. Returns (sent, failed).
+    Students deleted or emptied since the snapshot are skipped.
+
+    Logs reference the job's shared ``EmailTemplate`` and store only the
+    merge variables, not the rendered text. Recipients are fetched with
+    ``values()`` and rendered with the compiled subject/body.
+    """
+    subject_tpl, body_tpl = compile_message(template.subject, template.body)
+    lookups = set(subject_tpl.lookups) | set(body_tpl.lookups)
+
+    rows = Student.objects.filter(pk__in=student_ids).exclude(email="").values(
+        "id", "email", *lookups
+    )
+    by_id = {row["id"]: row for row in rows}
+
+    from_email = settings.DEFAULT_FROM_EMAIL
+    emails = []
+    logs = []
+
+    for student_id in student_ids:
+        student = by_id.get(student_id)
+        if student is None:
+            continue
+
+        merge_data = {**subject_tpl.context(student), **body_tpl.context(student)}
+        emails.append(
+            EmailMessage(
+                subject=subject_tpl.render(merge_data),
+                body=body_tpl.render(merge_data),
+                from_email=from_email,
+                to=[student["email"]],
+            )
+        )
+        logs.append(
+            EmailLog(
+                student_id=student_id,
+                broadcast=job,
+                template=template,
+                merge_data=merge_data,
+                to_email=student["email"],
+                from_email=from_email,
+            )
+        )
+
+    sent, failed = apply_results(logs, sender.send_messages(emails))
+
+    with transaction.atomic():
+        EmailLog.objects.bulk_create(logs)
+        BroadcastJob.objects.filter(pk=job.pk).update(
+            cursor=F("cursor") + len(student_ids),
+            sent_count=F("sent_count") + sent,
+            failed_count=F("failed_count") + failed,
+            heartbeat_at=timezone.now(),
+        )
+
+    return sent, failed
+
+
+def process_job(job, chunk_size=DEFAULT_CHUNK_SIZE, sender=None):
+    """
+    Send the remaining recipients of a claimed job, starting at its cursor.
+
+    A chunk is checkpointed only after its logs are written, so a crash can
+    re-send at most one chunk when the job is resumed.
+    """
+    sender = sender or get_sender()
+    template = EmailTemplate.intern(job.subject, job.body)
+
+    try:
+        with Heartbeat(job.pk):
+            while job.cursor < job.total:
+                ids = job.recipient_ids[job.cursor:job.cursor + chunk_size]
+                send_chunk(job, template, ids, sender)
+                job.refresh_from_db(fields=["cursor", "sent_count", "failed_count"])
+    except Exception as e:
+        # Connection-level failure: keep the cursor so the job can be requeued.
+        job.status = "failed"
+        job.last_error = str(e)
+        job.finished_at = timezone.now()
+        job.save(update_fields=["status", "last_error", "finished_at"])
+        return job
+
+    job.status = "completed"
+    job.finished_at = timezone.now()
+    job.save(update_fields=["status", "finished_at"])
+    return job
+
+
+def requeue_job(job):
+    """Put a failed job back in the queue; it resumes from its cursor."""
+    job.status = "queued"
+    job.heartbeat_at = None
+    job.finished_at = None
+    job.last_error = ""
+    job.save(update_fields=["status", "heartbeat_at", "finished_at", "last_error"])
+    return job
+
+
+# -------------------------------------------------------
+# RETRIES
+# -------------------------------------------------------
+
+def retry_due_emails(sender=None, limit=RETRY_BATCH_SIZE):
+    """
+    Re-send failed logs whose backoff has expired. Returns (sent, failed).
+
+    Logs are rebuilt from their stored text or template, so only emails
+    without attachments are ever scheduled for a retry.
+    """
+    sender = sender or get_sender()
+    now = timezone.now()
+
+    logs = list(
+        EmailLog.objects.filter(status="failed", next_retry_at__lte=now)
+        .select_related("template")
+        .order_by("next_retry_at")[:limit]
+    )
+    if not logs:
+        return 0, 0
+
+    emails = [
+        EmailMessage(
+            subject=log.rendered_subject,
+            body=log.rendered_body,
+            from_email=log.from_email,
+            to=[log.to_email],
+        )
+        for log in logs
+    ]
+
+    results = sender.send_messages(emails)
+    for log in logs:
+        log.attempts += 1  # given back by apply_results if held back unsent
+    sent, failed = apply_results(logs, results, now=now)
+
+    recovered = {}
+    for log, result in zip(logs, results):
+        if result.ok and log.broadcast_id:
+            recovered[log.broadcast_id] = recovered.get(log.broadcast_id, 0) + 1
+
+    with transaction.atomic():
+        EmailLog.objects.bulk_update(
+            logs, ["status", "error_message", "attempts", "next_retry_at"]
+        )
+        for job_id, count in recovered.items():
+            BroadcastJob.objects.filter(pk=job_id).update(
+                sent_count=F("sent_count") + count,
+                failed_count=F("failed_count") - count,
+            )
+
+    return sent, failed
+
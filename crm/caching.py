@@ -0,0 +1,61 @@
+# crm/caching.py
+"""
+Versioned caching for the dashboard.
+
+Everything the dashboard shows is derived from ``Student``, ``Lead`` and
+``Country``. Instead of deleting individual keys, the signals in
+``crm/signals.py`` bump one data version when any of those rows change;
+cache keys and ETags include the version, so old entries are simply never
+read again and expire on their own.
+
+The version is the time of the last change in nanoseconds, which also
+serves as the ``Last-Modified`` of the dashboard responses.
+"""
+
+import datetime
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+VERSION_KEY = "crm:dashboard:version"
+
+
+def data_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Cold cache (restart, eviction): start a new version so ETags handed
+        # out before cannot match data that may have changed meanwhile.
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_data_version():
+    cache.set(VERSION_KEY, time.time_ns(), None)
+
+
+def bump_data_version_on_commit():
+    """Bump after the current transaction commits (immediately outside one)."""
+    transaction.on_commit(bump_data_version)
+
+
+def data_modified():
+    """Last change, but no earlier than today's start (daily series roll over)."""
+    changed = datetime.datetime.fromtimestamp(data_version() / 1e9, tz=datetime.timezone.utc)
+    today = timezone.make_aware(
+        datetime.datetime.combine(timezone.localdate(), datetime.time.min)
+    )
+    return max(changed, today)
+
+
+def dashboard_key(name):
+    """Cache key / ETag for ``name``, tied to the data version and today's date."""
+    return f"crm:dashboard:{name}:{data_version()}:{timezone.localdate().isoformat()}"
+
+
+def cached_dashboard(name, build):
+    """Return the cached value of ``build()`` for the current data version."""
+    return cache.get_or_set(dashboard_key(name), build, settings.DASHBOARD_CACHE_TIMEOUT)
@@ -0,0 +1,74 @@
+# crm/contacts.py
+"""
+Normalised contact keys and the race-free ``Student`` upsert.
+
+``Student.phone_key`` / ``email_key`` hold the normalised phone and email
+and are unique, so two workers handling the same person at the same time
+cannot both create a student: the loser's insert fails and it picks up the
+winner's row instead. ``Student.save()`` keeps the keys current; code that
+uses ``bulk_create`` must fill them with ``contact_keys``.
+"""
+
+import re
+
+from django.db import IntegrityError, transaction
+
+MIN_PHONE_DIGITS = 6
+MAX_ATTEMPTS = 3
+
+
+def normalise_phone(value):
+    """Digits only, without an ``00`` international prefix; None if too short."""
+    digits = re.sub(r"\D", "", str(value or ""))
+    if digits.startswith("00"):
+        digits = digits[2:]
+    return digits if len(digits) >= MIN_PHONE_DIGITS else None
+
+
+def normalise_email(value):
+    email = str(value or "").strip().lower()
+    return email if "@" in email else None
+
+
+def contact_keys(phone, email):
+    return normalise_phone(phone), normalise_email(email)
+
+
+def find_student(phone=None, email=None):
+    """The student matching ``phone`` (preferred) or ``email``, or None."""
+    from .models import Student
+
+    phone_key, email_key = contact_keys(phone, email)
+    student = None
+    if phone_key:
+        student = Student.objects.filter(phone_key=phone_key).first()
+    if student is None and email_key:
+        student = Student.objects.filter(email_key=email_key).first()
+    return student
+
+
+def upsert_student(phone=None, email=None, **fields):
+    """
+    Return ``(student, created)`` for the student with this phone or email,
+    creating it from ``fields`` if there is none.
+
+    Safe under concurrency: the lookup runs outside the insert, and an insert
+    rejected by the unique contact keys is retried as a lookup.
+    """
+    from .models import Student
+
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        student = find_student(phone, email)
+        if student is not None:
+            return student, False
+
+        try:
+            with transaction.atomic():
+                student = Student.objects.create(
+                    phone=str(phone or "").strip(), email=str(email or "").strip(), **fields
+                )
+            return student, True
+        except IntegrityError:
+            # Another worker created this contact between our lookup and insert.
+            if attempt == MAX_ATTEMPTS:
+                raise
@@ -0,0 +1,151 @@
+# crm/email_storage.py
+"""
+Compaction of ``EmailLog`` rows written before broadcasts used shared
+``EmailTemplate`` rows.
+
+Used by ``manage.py compact_email_logs``; migration 0010 carries its own
+frozen copy. Both functions take the model classes as arguments.
+"""
+
+import json
+
+from .templating import TemplateError, render_merge, template_hash
+
+FIRST_NAME = "{{ first_name }}"
+
+
+def _text_bytes(*values):
+    return sum(len((v or "").encode("utf-8")) for v in values)
+
+
+def _renders_as(template_body, merge_data, body):
+    try:
+        return render_merge(template_body, merge_data) == body
+    except TemplateError:
+        return False
+
+
+def _split_row(row):
+    """
+    Return (template_body, merge_data) for a stored log row, recovering the
+    ``{{ first_name }}`` placeholder only when re-rendering gives the exact
+    stored body back. Returns (None, None) for text that cannot be stored
+    as a template without changing it.
+    """
+    body = row["body"]
+    first_name = row["student__first_name"]
+
+    if first_name and first_name in body and FIRST_NAME not in body:
+        candidate = body.replace(first_name, FIRST_NAME)
+        merge_data = {"first_name": first_name}
+        if _renders_as(candidate, merge_data, body):
+            return candidate, merge_data
+
+    if _renders_as(body, None, body):
+        return body, None
+    return None, None
+
+
+def compact_email_logs(EmailLog, EmailTemplate, dry_run=False, batch_size=1000):
+    """
+    Move repeated subject/body text out of ``EmailLog`` into shared templates.
+
+    Only messages stored at least twice (or already known as a template) are
+    compacted; one-off emails keep their literal text. Returns a report dict.
+    """
+    groups = {}
+    rows = (
+        EmailLog.objects.filter(template__isnull=True)
+        .values("id", "subject", "body", "student__first_name")
+        .order_by("id")
+    )
+
+    scanned = 0
+    for row in rows.iterator(chunk_size=batch_size):
+        scanned += 1
+        body, merge_data = _split_row(row)
+        if body is None or not _renders_as(row["subject"], None, row["subject"]):
+            continue
+        key = template_hash(row["subject"], body)
+
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {
+                "subject": row["subject"],
+                "body": body,
+                "rows": [],
+                "bytes": 0,
+            }
+        group["rows"].append((row["id"], merge_data))
+        group["bytes"] += _text_bytes(row["subject"], row["body"])
+
+    existing = set(
+        EmailTemplate.objects.filter(content_hash__in=list(groups)).values_list(
+            "content_hash", flat=True
+        )
+    )
+
+    report = {
+        "rows_scanned": scanned,
+        "rows_compacted": 0,
+        "templates_created": 0,
+        "bytes_before": 0,
+        "bytes_after": 0,
+    }
+
+    for key, group in groups.items():
+        if len(group["rows"]) < 2 and key not in existing:
+            continue
+
+        report["rows_compacted"] += len(group["rows"])
+        report["bytes_before"] += group["bytes"]
+        report["bytes_after"] += sum(
+            len(json.dumps(merge_data)) for _, merge_data in group["rows"] if merge_data
+        )
+
+        if key not in existing:
+            report["templates_created"] += 1
+            report["bytes_after"] += _text_bytes(group["subject"], group["body"])
+
+        if dry_run:
+            continue
+
+        template, _ = EmailTemplate.objects.get_or_create(
+            content_hash=key,
+            defaults={"subject": group["subject"], "body": group["body"]},
+        )
+
+        updates = [
+            EmailLog(
+                id=log_id,
+                template=template,
+                merge_data=merge_data,
+                subject="",
+                body="",
+            )
+            for log_id, merge_data in group["rows"]
+        ]
+        EmailLog.objects.bulk_update(
+            updates, ["template", "merge_data", "subject", "body"], batch_size=batch_size
+        )
+
+    report["bytes_saved"] = report["bytes_before"] - report["bytes_after"]
+    return report
+
+
+def expand_email_logs(EmailLog, batch_size=1000):
+    """Inverse of ``compact_email_logs``: write the rendered text back."""
+    rows = EmailLog.objects.filter(template__isnull=False).select_related("template")
+    updates = []
+
+    for log in rows.iterator(chunk_size=batch_size):
+        log.subject = render_merge(log.template.subject, log.merge_data)
+        log.body = render_merge(log.template.body, log.merge_data)
+        log.template = None
+        log.merge_data = None
+        updates.append(log)
+
+    EmailLog.objects.bulk_update(
+        updates, ["template", "merge_data", "subject", "body"], batch_size=batch_size
+    )
+    return len(updates)
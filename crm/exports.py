@@ -0,0 +1,171 @@
+# crm/exports.py
+"""
+Streaming student exports as CSV or XLSX (the admin export actions and the
+"Export" buttons of the students and applications lists).
+
+Rows are read as plain tuples with ``values_list().iterator()``, a chunk of
+``EXPORT_CHUNK_SIZE`` at a time, so no model instances are built and the
+country name comes from the same query. Memory stays flat however many rows
+are exported:
+
+- CSV is sent as it is read, one chunk of rows per write to the client.
+- XLSX goes row by row into an openpyxl write-only workbook, which keeps
+  the sheets in temporary files. The saved workbook is spooled to a
+  temporary file too (in memory up to ``XLSX_SPOOL_BYTES``) and sent from
+  there with a ``FileResponse``.
+
+The column headers are the ones ``manage.py import_students`` reads, so an
+export can be imported again.
+"""
+
+import csv
+import io
+import tempfile
+from datetime import datetime
+
+from django.conf import settings
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+from openpyxl import Workbook
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+from .pagination import CURSOR_PARAM
+
+# (Student lookup, column header)
+STUDENT_COLUMNS = [
+    ("id", "id"),
+    ("first_name", "first_name"),
+    ("last_name", "last_name"),
+    ("email", "email"),
+    ("phone", "phone"),
+    ("country__name", "country"),
+    ("age", "age"),
+    ("course", "course"),
+    ("enrollment_date", "enrollment_date"),
+    ("passport_number", "passport_number"),
+    ("visa_type", "visa_type"),
+    ("visa_expiry", "visa_expiry"),
+    ("application_status", "application_status"),
+    ("archived", "archived"),
+    ("created_at", "created_at"),
+]
+
+CONTENT_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+FORMATS = tuple(CONTENT_TYPES)
+
+# Rows per worksheet allowed by Excel, header included.
+XLSX_MAX_ROWS = 1_048_576
+
+# A saved workbook up to this size is kept in memory, larger ones on disk.
+XLSX_SPOOL_BYTES = 8 * 1024 * 1024
+
+
+def export_rows(queryset, columns=STUDENT_COLUMNS):
+    """The ``columns`` of ``queryset`` as tuples, read in chunks, in id order."""
+    return (
+        queryset.select_related(None)
+        .prefetch_related(None)
+        .order_by("id")
+        .values_list(*[lookup for lookup, _ in columns])
+        .iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+    )
+
+
+def _local(value):
+    if isinstance(value, datetime) and timezone.is_aware(value):
+        return timezone.make_naive(value)
+    return value
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# -------------------------------------------------------
+# WRITERS
+# -------------------------------------------------------
+
+def stream_csv(rows, headers):
+    """CSV as UTF-8 byte strings, one per chunk of rows."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # The BOM makes Excel read the file as UTF-8.
+    buffer.write("\ufeff")
+    writer.writerow(headers)
+    for chunk in _chunks(rows, settings.EXPORT_CHUNK_SIZE):
+        writer.writerows([_local(value) for value in row] for row in chunk)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def _xlsx_value(value):
+    if isinstance(value, str):
+        return ILLEGAL_CHARACTERS_RE.sub("", value)  # control characters XML cannot carry
+    return _local(value)
+
+
+def write_xlsx(rows, headers, title="Students"):
+    """
+    An .xlsx workbook of ``rows`` in a rewound temporary file. Rows past
+    Excel's sheet limit go on to further sheets ("Students 2", ...), each
+    with the header row.
+    """
+    workbook = Workbook(write_only=True)
+    sheet = None
+    used = XLSX_MAX_ROWS
+    for row in rows:
+        if used == XLSX_MAX_ROWS:
+            count = len(workbook.worksheets)
+            sheet = workbook.create_sheet(f"{title} {count + 1}" if count else title)
+            sheet.append(headers)
+            used = 1
+        sheet.append([_xlsx_value(value) for value in row])
+        used += 1
+    if sheet is None:
+        workbook.create_sheet(title).append(headers)
+
+    output = tempfile.SpooledTemporaryFile(max_size=XLSX_SPOOL_BYTES)
+    workbook.save(output)
+    output.seek(0)
+    return output
+
+
+# -------------------------------------------------------
+# RESPONSES
+# -------------------------------------------------------
+
+def export_response(queryset, fmt, filename="students", columns=STUDENT_COLUMNS):
+    """A streaming response downloading ``queryset`` as ``fmt`` (csv or xlsx)."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt!r}")
+    headers = [header for _, header in columns]
+    rows = export_rows(queryset, columns)
+
+    stamp = timezone.localtime().strftime("%Y%m%d-%H%M")
+    if fmt == "csv":
+        response = StreamingHttpResponse(stream_csv(rows, headers), content_type=CONTENT_TYPES[fmt])
+    else:
+        response = FileResponse(write_xlsx(rows, headers), content_type=CONTENT_TYPES[fmt])
+    response["Content-Disposition"] = f'attachment; filename="{filename}-{stamp}.{fmt}"'
+    return response
+
+
+def export_query(request):
+    """The request's filters as a query string, without pagination or ``export``."""
+    query = request.GET.copy()
+    for param in (CURSOR_PARAM, "page", "export"):
+        query.pop(param, None)
+    return query.urlencode()
@@ -0,0 +1,157 @@
+# crm/fake_smtp.py
+"""
+A tiny in-process SMTP server for tests and the ``bench_mailer`` command.
+
+It speaks just enough SMTP for ``smtplib`` (EHLO/HELO, MAIL, RCPT, DATA,
+RSET, NOOP, QUIT), keeps every accepted message in ``messages`` and can
+simulate a slow handshake (the cost TLS + AUTH adds on a real provider),
+per-message latency, refused recipients and dropped connections.
+
+    with FakeSMTPServer(handshake_delay=0.05) as server:
+        connection = get_connection(
+            "django.core.mail.backends.smtp.EmailBackend",
+            host=server.host, port=server.port,
+            use_tls=False, username="", password="",
+        )
+"""
+
+import socketserver
+import threading
+import time
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        server = self.server.fake
+        server._count_connection()
+
+        if server.handshake_delay:
+            time.sleep(server.handshake_delay)
+        self.reply("220 fake-smtp ready")
+
+        sender = None
+        recipients = []
+
+        while True:
+            raw = self.rfile.readline()
+            if not raw:
+                return
+
+            line = raw.decode("utf-8", "replace").rstrip("\r\n")
+            verb = line.split(" ", 1)[0].upper()
+
+            if verb in ("EHLO", "HELO"):
+                self.reply("250 fake-smtp")
+            elif verb == "MAIL":
+                sender = line.split(":", 1)[1].strip().strip("<>").split(">")[0]
+                recipients = []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                address = line.split(":", 1)[1].strip().strip("<>").split(">")[0]
+                if address in server.refuse:
+                    self.reply("550 5.1.1 Mailbox unavailable")
+                else:
+                    recipients.append(address)
+                    self.reply("250 OK")
+            elif verb == "DATA":
+                if server._should_drop(recipients):
+                    # Simulate the server hanging up mid-session.
+                    return
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = self._read_data()
+                if server.message_delay:
+                    time.sleep(server.message_delay)
+                server._store(sender, recipients, data)
+                self.reply("250 OK queued")
+            elif verb == "RSET":
+                sender = None
+                recipients = []
+                self.reply("250 OK")
+            elif verb == "NOOP":
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+    def _read_data(self):
+        lines = []
+        while True:
+            raw = self.rfile.readline()
+            if not raw or raw in (b".\r\n", b".\n"):
+                break
+            if raw.startswith(b".."):
+                raw = raw[1:]
+            lines.append(raw)
+        return b"".join(lines)
+
+
+class _ThreadingServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeSMTPServer:
+
+    def __init__(self, host="127.0.0.1", port=0, handshake_delay=0.0, message_delay=0.0):
+        self.handshake_delay = handshake_delay
+        self.message_delay = message_delay
+
+        # Recipients answered with 550, and recipients whose first delivery
+        # attempt makes the server drop the connection.
+        self.refuse = set()
+        self.drop_once = set()
+
+        self.messages = []
+        self.connections = 0
+
+        self._lock = threading.Lock()
+        self._server = _ThreadingServer((host, port), _SMTPHandler)
+        self._server.fake = self
+        self._thread = None
+
+    @property
+    def host(self):
+        return self._server.server_address[0]
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def _count_connection(self):
+        with self._lock:
+            self.connections += 1
+
+    def _store(self, sender, recipients, data):
+        with self._lock:
+            self.messages.append(
+                {"from": sender, "to": list(recipients), "data": data}
+            )
+
+    def _should_drop(self, recipients):
+        with self._lock:
+            for address in recipients:
+                if address in self.drop_once:
+                    self.drop_once.discard(address)
+                    return True
+        return False
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
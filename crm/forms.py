@@ -2,12 +2,45 @@ from django import forms
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Submit
 from django.contrib.auth import get_user_model
+from django.forms.models import ModelChoiceIterator
 
+from . import refdata
+from .contacts import normalise_email, normalise_phone
 from .models import Student, StudentDocument, Country, Tag, Lead
+from .templating import TemplateError, compile_template
 
 User = get_user_model()
 
 
+# ------------------------
+# Reference data choices (Country, Tag) served from crm/refdata.py
+# ------------------------
+class ReferenceChoiceIterator(ModelChoiceIterator):
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ("", self.field.empty_label)
+        for obj in refdata.rows(self.queryset.model):
+            yield self.choice(obj)
+
+    def __len__(self):
+        return len(refdata.rows(self.queryset.model)) + (self.field.empty_label is not None)
+
+
+class ReferenceChoiceField(forms.ModelChoiceField):
+    """A ModelChoiceField that renders and validates without a query."""
+    iterator = ReferenceChoiceIterator
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            obj = refdata.get(self.queryset.model, int(value))
+        except (TypeError, ValueError):
+            obj = None
+        # Unknown ids fall back to the database (and its invalid_choice error).
+        return obj if obj is not None else super().to_python(value)
+
+
 # ------------------------
 # Single Email Form (per student)
 # ------------------------
@@ -60,7 +93,7 @@ class EmailBroadcastForm(forms.Form):
         widget=forms.TextInput(attrs={"class": "form-control"})
     )
 
-    country = forms.ModelChoiceField(
+    country = ReferenceChoiceField(
         queryset=Country.objects.all(),
         required=False,
         label="Country (for 'By country')",
@@ -75,6 +108,20 @@ class EmailBroadcastForm(forms.Form):
         widget=forms.Select(attrs={"class": "form-select"})
     )
 
+    def _clean_template(self, field):
+        text = self.cleaned_data[field]
+        try:
+            compile_template(text)
+        except TemplateError as e:
+            raise forms.ValidationError(str(e))
+        return text
+
+    def clean_subject(self):
+        return self._clean_template("subject")
+
+    def clean_body(self):
+        return self._clean_template("body")
+
 
 
 # ------------------------
@@ -99,6 +146,7 @@ class StudentForm(forms.ModelForm):
             'course', 'application_status', 'enrollment_date',
             'tags', 'consent_given', 'notes', 'archived'
         ]
+        field_classes = {'country': ReferenceChoiceField}
         widgets = {
             'notes': forms.Textarea(attrs={'rows': 4, 'class': 'form-control'}),
             'tags': forms.SelectMultiple(attrs={'size': 6, 'class': 'form-select'}),
@@ -124,6 +172,31 @@ class StudentForm(forms.ModelForm):
             Submit('submit', 'Save Student', css_class='btn-primary')
         )
 
+    def _contact_taken(self, **lookup):
+        others = Student.objects.filter(**lookup)
+        if self.instance.pk:
+            others = others.exclude(pk=self.instance.pk)
+        return others.exists()
+
+    # Unchanged contacts are not checked, so students sharing one from
+    # before the unique keys (migration 0017) can still be edited. The
+    # messages name no one: the form is also the public application form.
+    def clean_phone(self):
+        phone = self.cleaned_data.get('phone')
+        phone_key = normalise_phone(phone)
+        if phone_key and phone_key != normalise_phone(self.instance.phone):
+            if self._contact_taken(phone_key=phone_key):
+                raise forms.ValidationError("This phone number is already registered.")
+        return phone
+
+    def clean_email(self):
+        email = self.cleaned_data.get('email')
+        email_key = normalise_email(email)
+        if email_key and email_key != normalise_email(self.instance.email):
+            if self._contact_taken(email_key=email_key):
+                raise forms.ValidationError("This email is already registered.")
+        return email
+
 
 # ------------------------
 # WhatsApp Broadcast Form (NEW)
@@ -193,12 +266,12 @@ class StudentFilterForm(forms.Form):
             'class': 'form-control'
         })
     )
-    country = forms.ModelChoiceField(
+    country = ReferenceChoiceField(
         queryset=Country.objects.all(),
         required=False,
         widget=forms.Select(attrs={'class': 'form-select'})
     )
-    tag = forms.ModelChoiceField(
+    tag = ReferenceChoiceField(
         queryset=Tag.objects.all(),
         required=False,
         widget=forms.Select(attrs={'class': 'form-select'})
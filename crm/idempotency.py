@@ -0,0 +1,93 @@
+# crm/idempotency.py
+"""
+Idempotency keys for ``webhook_lead``.
+
+A lead's key is ``fb:<facebook.lead_id>`` when Facebook supplies one,
+otherwise ``key:<Idempotency-Key header>`` (``:<index>`` appended for each
+item of a JSON array). ``Lead.idempotency_key`` is unique, so a redelivery
+can never create a second lead; ``recent_leads()`` is a small in-process
+LRU/TTL cache in front of it that answers most replays without a query.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+MAX_KEY_LENGTH = 255
+
+
+class TTLCache:
+    """A thread-safe LRU mapping whose entries also expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize, ttl, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires <= self._clock():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, self._clock() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_recent = None
+_recent_lock = threading.Lock()
+
+
+def recent_leads():
+    """Process-wide cache of idempotency key -> (lead_id, student_id)."""
+    global _recent
+
+    with _recent_lock:
+        if _recent is None:
+            _recent = TTLCache(settings.IDEMPOTENCY_CACHE_SIZE, settings.IDEMPOTENCY_CACHE_TTL)
+        return _recent
+
+
+def request_keys(header, count, batch):
+    """Per-item keys from an ``Idempotency-Key`` header (None when absent)."""
+    if not header:
+        return [None] * count
+    if not batch:
+        return [header]
+    return [f"{header}:{index}" for index in range(count)]
+
+
+def lead_key(fb_lead_id, request_key=None):
+    if fb_lead_id:
+        key = f"fb:{fb_lead_id}"
+    elif request_key:
+        key = f"key:{request_key}"
+    else:
+        return None
+
+    if len(key) > MAX_KEY_LENGTH:
+        prefix = key.split(":", 1)[0]
+        key = f"{prefix}:sha256:" + hashlib.sha256(key.encode("utf-8")).hexdigest()
+    return key
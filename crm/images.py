@@ -0,0 +1,176 @@
+# crm/images.py
+"""
+Resized copies ("derivatives") of uploaded images: passport scans
+(``Student.passport_image``) and image documents.
+
+Phone-camera scans run to several megabytes; pages show a thumbnail or a
+preview instead, re-encoded as ``IMAGE_DERIVATIVE_FORMAT`` with the EXIF
+data (GPS position, camera details) dropped after applying its rotation.
+
+Derivatives live under ``MEDIA_ROOT/derivatives/`` with a deterministic
+name: a hash of the source name, size and modification time plus the
+size's settings. Replacing a file or changing a size therefore gives new
+names, and nothing needs invalidating. They are made:
+
+- after an upload commits (the ``crm/signals.py`` receivers),
+- on first request otherwise: ``derivative_url`` links to the
+  ``image_derivative`` view, which checks that the user may see the image,
+  makes the derivative if missing and serves it (``crm/media.py``),
+- for existing files, by ``manage.py build_image_derivatives``.
+
+JPEGs are decoded at reduced scale (``Image.draft``), so a large scan
+costs a fraction of a full decode.
+"""
+
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.core import signing
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.urls import reverse
+
+DERIVATIVE_DIR = "derivatives"
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp", ".tif", ".tiff"}
+SIGNING_SALT = "crm.images"
+
+# Part of every derivative name: bump it to regenerate them all after
+# changing how they are made.
+VERSION = 1
+
+PIL_FORMATS = {"webp": "WEBP", "jpeg": "JPEG"}
+
+
+def is_image(name):
+    return bool(name) and os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+
+def derivative_name(name, size):
+    """
+    Storage name of the ``size`` derivative of image ``name``, or None if
+    the source file is missing.
+    """
+    box = settings.IMAGE_DERIVATIVE_SIZES[size]
+    fmt = settings.IMAGE_DERIVATIVE_FORMAT
+    try:
+        stat = os.stat(default_storage.path(name))
+    except (FileNotFoundError, ValueError):
+        return None
+    source = f"{VERSION}|{name}|{stat.st_size}|{stat.st_mtime_ns}"
+    spec = f"{size}|{box[0]}x{box[1]}|{fmt}|{settings.IMAGE_DERIVATIVE_QUALITY}"
+    key = hashlib.sha1(f"{source}|{spec}".encode("utf-8")).hexdigest()
+    return f"{DERIVATIVE_DIR}/{key[:2]}/{key}.{fmt}"
+
+
+# -------------------------------------------------------
+# RENDERING
+# -------------------------------------------------------
+
+def render(source, target, box, fmt, quality):
+    """
+    Write ``source`` (a path) scaled to fit ``box`` to ``target`` as ``fmt``
+    ("webp" or "jpeg"). Needs no Django setup, so pool workers can call it.
+    Returns False when ``source`` is not a readable image.
+    """
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    try:
+        with Image.open(source) as image:
+            image.draft("RGB", box)
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail(box, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+            has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+            if fmt == "jpeg" and has_alpha:
+                rgba = image.convert("RGBA")
+                image = Image.new("RGB", image.size, "white")
+                image.paste(rgba, mask=rgba)
+            elif fmt == "jpeg" and image.mode != "RGB":
+                image = image.convert("RGB")
+            elif image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if has_alpha else "RGB")
+
+            options = {"quality": quality}
+            if fmt == "jpeg":
+                options.update(optimize=True, progressive=True)
+            else:
+                options.update(method=4)
+
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target))
+            try:
+                with os.fdopen(fd, "wb") as out:
+                    # No exif= or icc_profile= given: neither is written.
+                    image.save(out, PIL_FORMATS[fmt], **options)
+                os.replace(tmp, target)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, ValueError):
+        return False
+    return True
+
+
+def make_derivative(name, size):
+    """Storage name of the ``size`` derivative of ``name``, made if missing; None if impossible."""
+    if not is_image(name):
+        return None
+    derivative = derivative_name(name, size)
+    if derivative is None:
+        return None
+    if not default_storage.exists(derivative):
+        made = render(
+            default_storage.path(name),
+            default_storage.path(derivative),
+            settings.IMAGE_DERIVATIVE_SIZES[size],
+            settings.IMAGE_DERIVATIVE_FORMAT,
+            settings.IMAGE_DERIVATIVE_QUALITY,
+        )
+        if not made:
+            return None
+    return derivative
+
+
+def make_all_on_commit(name):
+    """Make every size of ``name`` once the current transaction commits."""
+    if not is_image(name):
+        return
+
+    def make():
+        for size in settings.IMAGE_DERIVATIVE_SIZES:
+            make_derivative(name, size)
+
+    transaction.on_commit(make)
+
+
+# -------------------------------------------------------
+# URLS
+# -------------------------------------------------------
+
+def derivative_url(name, size):
+    """
+    URL of the ``size`` derivative of image ``name``: the view that checks
+    access to the image and serves it, made if missing. "" when ``name`` is
+    not an image.
+    """
+    if not is_image(name):
+        return ""
+    if size not in settings.IMAGE_DERIVATIVE_SIZES:
+        raise ValueError(f"Unknown image size: {size!r}")
+    # Derivative names do not lead back to their image (and its student),
+    # so they are never linked under MEDIA_URL (crm/media.py).
+    token = signing.dumps([name, size], salt=SIGNING_SALT, compress=True)
+    return reverse("image_derivative", args=[token])
+
+
+def read_token(token):
+    """``(name, size)`` from a ``derivative_url`` token, or None if it was tampered with."""
+    try:
+        name, size = signing.loads(token, salt=SIGNING_SALT)
+    except (signing.BadSignature, ValueError, TypeError):
+        return None
+    if size not in settings.IMAGE_DERIVATIVE_SIZES:
+        return None
+    return name, size
@@ -0,0 +1,214 @@
+# crm/import_pipeline.py
+"""
+Parallel import of many spreadsheets at once (``manage.py import_students``
+with several files, a directory or a glob).
+
+Files are read and normalised (``importer.parse_file``) in a process pool,
+one file per worker. The normalised batches come back over a bounded queue
+to this process, which is the only one that writes: SQLite allows one
+writer at a time, so parallel writers would only queue on its lock. The
+queue bound keeps memory flat when the workers parse faster than the
+database takes the batches.
+
+Each file succeeds or fails on its own. A file that cannot be read, or a
+batch of it that cannot be written, marks that file failed (its batches
+already committed stay) and the other files carry on.
+"""
+
+import glob
+import multiprocessing
+import os
+import queue
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+
+# crm.importer (and with it the models) is imported inside the functions:
+# spawned workers import this module before Django is set up.
+
+EXTENSIONS = (".xlsx", ".xlsm", ".csv")
+
+# Batches waiting for the writer, per worker.
+QUEUED_BATCHES_PER_WORKER = 2
+
+
+class FileResult:
+    def __init__(self, path):
+        from .importer import ImportStats
+
+        self.path = path
+        self.header = None
+        self.mapping = None
+        self.stats = ImportStats()
+        self.error = None
+        self.finished = False
+        self.started = None  # time.perf_counter() when its header was read
+
+
+def _importable(path):
+    name = os.path.basename(path)
+    return (
+        name.lower().endswith(EXTENSIONS)
+        and not name.endswith(".rejects.csv")
+        and not name.startswith("~$")  # Excel lock files
+    )
+
+
+def expand_paths(patterns):
+    """The files named by ``patterns``: files, directories or glob patterns."""
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = [p for p in glob.glob(os.path.join(pattern, "*")) if _importable(p)]
+        elif glob.has_magic(pattern):
+            matches = [p for p in glob.glob(pattern) if _importable(p)]
+        else:
+            matches = [pattern]  # named explicitly: a missing file fails on its own
+        for path in sorted(matches):
+            if path not in paths and not os.path.isdir(path):
+                paths.append(path)
+    return paths
+
+
+# -------------------------------------------------------
+# READERS
+# -------------------------------------------------------
+
+def _read(path, chunk_size):
+    """Events for one file: header, then batches, then done (or error)."""
+    from .importer import parse_file
+
+    try:
+        header, mapping, batches = parse_file(path, chunk_size)
+        yield "header", path, (header, mapping)
+        for batch in batches:
+            yield "batch", path, batch
+    except Exception as e:
+        yield "error", path, f"{type(e).__name__}: {e}"
+    else:
+        yield "done", path, None
+
+
+def _read_in_process(paths, chunk_size):
+    for path in paths:
+        yield from _read(path, chunk_size)
+
+
+_events = None
+_stop = None
+
+
+def _init_worker(events, stop):
+    global _events, _stop
+    import django
+
+    django.setup()
+    _events, _stop = events, stop
+
+
+def _read_in_worker(path, chunk_size):
+    for event in _read(path, chunk_size):
+        while True:
+            try:
+                _events.put(event, timeout=0.5)
+                break
+            except queue.Full:
+                if _stop.is_set():  # the writer gave up
+                    return
+
+
+def _read_in_pool(paths, chunk_size, workers):
+    # Spawned, not forked: a forked worker would share this process's open
+    # database connection, possibly in the middle of a transaction.
+    context = multiprocessing.get_context("spawn")
+    events = context.Queue(maxsize=workers * QUEUED_BATCHES_PER_WORKER)
+    stop = context.Event()
+    pool = ProcessPoolExecutor(
+        workers, mp_context=context, initializer=_init_worker, initargs=(events, stop)
+    )
+    try:
+        futures = {pool.submit(_read_in_worker, path, chunk_size): path for path in paths}
+        pending = set(paths)
+        while pending:
+            try:
+                kind, path, data = events.get(timeout=1)
+            except queue.Empty:
+                # A worker that died without reporting (killed, out of memory).
+                for future, path in futures.items():
+                    if path in pending and future.done() and future.exception():
+                        pending.discard(path)
+                        yield "error", path, f"Worker failed: {future.exception()!r}"
+                continue
+            if kind in ("done", "error"):
+                pending.discard(path)
+            yield kind, path, data
+    finally:
+        stop.set()
+        pool.shutdown(cancel_futures=True)
+
+
+# -------------------------------------------------------
+# WRITER
+# -------------------------------------------------------
+
+def run(
+    paths, workers=1, chunk_size=None, update=False, dry_run=False,
+    on_reject=None, on_progress=None, on_finish=None,
+):
+    """
+    Import ``paths`` and return a FileResult per path, in order.
+
+    ``workers`` processes read the files (0: read them in this process).
+    Callbacks: ``on_reject(result, row_number, reason, row)``,
+    ``on_progress(result)`` after each batch written and ``on_finish(result)``
+    once a file is done or failed.
+    """
+    from .importer import DEFAULT_CHUNK_SIZE, DryRun, write_batch
+
+    chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+    dry_run = DryRun() if dry_run else None
+    results = {path: FileResult(path) for path in paths}
+    if workers and paths:
+        events = _read_in_pool(paths, chunk_size, min(workers, len(paths)))
+    else:
+        events = _read_in_process(paths, chunk_size)
+
+    def fail(result, error):
+        result.error = error
+        result.finished = True
+        if on_finish:
+            on_finish(result)
+
+    with closing(events):
+        for kind, path, data in events:
+            result = results[path]
+            if result.finished:
+                continue  # batches of a file that already failed
+
+            if kind == "header":
+                result.header, result.mapping = data
+                result.started = time.perf_counter()
+            elif kind == "batch":
+                first_row, rows, frame = data
+                reject = None
+                if on_reject:
+                    def reject(row_number, reason, row, result=result):
+                        on_reject(result, row_number, reason, row)
+                try:
+                    stats = write_batch(
+                        frame, rows, result.mapping, first_row, update, reject, dry_run
+                    )
+                except Exception as e:
+                    fail(result, f"row {first_row}+: {type(e).__name__}: {e}")
+                    continue
+                result.stats.add(stats)
+                if on_progress:
+                    on_progress(result)
+            elif kind == "error":
+                fail(result, data)
+            else:
+                result.finished = True
+                if on_finish:
+                    on_finish(result)
+
+    return list(results.values())
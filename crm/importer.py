@@ -0,0 +1,540 @@
+# crm/importer.py
+"""
+Streaming student import from Excel (.xlsx) or CSV, used by
+``manage.py import_students``.
+
+Rows are read lazily (openpyxl read-only mode, ``csv`` for CSV) and handled
+in chunks of ``chunk_size``: each chunk is validated and normalised as one
+pandas frame, then written with ``bulk_create`` in its own transaction, so
+memory stays flat however long the file is and an interrupted import keeps
+the chunks it committed.
+
+Rows are matched to existing students (and to earlier rows of the file)
+by normalised phone or email (see ``crm/contacts.py``) or passport number,
+all in one query per chunk. Matched rows are skipped, or with ``update``
+compared field by field and written with ``bulk_update`` only when
+something changed. Rows that fail validation or match more than one
+student are passed to ``on_reject`` with the reason.
+"""
+
+import csv
+import os
+from collections import Counter
+from itertools import islice
+
+import pandas as pd
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import refdata
+from .caching import bump_data_version_on_commit
+from .contacts import MAX_ATTEMPTS, MIN_PHONE_DIGITS
+from .metrics import bump_all, move_all, student_bucket
+from .models import Country, Student
+from .search import FTS_COLUMNS, index_students
+
+DEFAULT_CHUNK_SIZE = 1000
+
+# Student field -> accepted column headers (compared lowercased, with
+# spaces and dashes read as underscores).
+COLUMN_ALIASES = {
+    "name": ["name", "full_name"],
+    "first_name": ["first_name"],
+    "last_name": ["last_name"],
+    "phone": ["phone", "phone_number", "mobile"],
+    "email": ["email", "email_address"],
+    "country": ["country"],
+    "age": ["age"],
+    "course": ["course", "interested_course"],
+    "enrollment_date": ["enrollment_date"],
+    "passport_number": ["passport_number", "passport"],
+    "visa_type": ["visa_type", "visa_applied_for"],
+}
+
+TEXT_FIELDS = [
+    "first_name", "last_name", "phone", "email", "course", "passport_number", "visa_type",
+]
+
+EMAIL_PATTERN = r"^[^@\s]+@[^@\s]+\.[^@\s]+$"
+
+
+# -------------------------------------------------------
+# READING
+# -------------------------------------------------------
+
+def _header_key(value):
+    return str(value or "").strip().lower().replace(" ", "_").replace("-", "_")
+
+
+def _cell(value):
+    # Excel stores phone numbers as floats: 3001234567.0 -> "3001234567"
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def read_rows(path):
+    """``(header, rows)`` of an .xlsx or .csv file; ``rows`` is a lazy iterator."""
+    ext = os.path.splitext(str(path))[1].lower()
+    if ext == ".csv":
+        return _read_csv(path)
+    if ext in (".xlsx", ".xlsm"):
+        return _read_xlsx(path)
+    raise ValueError(f"Unsupported file type {ext or '(none)'!r}: use .xlsx or .csv")
+
+
+def _read_csv(path):
+    handle = open(path, newline="", encoding="utf-8-sig")
+    reader = csv.reader(handle)
+    header = next(reader, [])
+
+    def rows():
+        with handle:
+            yield from reader
+
+    return header, rows()
+
+
+def _read_xlsx(path):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    values = workbook.active.iter_rows(values_only=True)
+    header = list(next(values, ()))
+
+    def rows():
+        try:
+            for row in values:
+                yield [_cell(value) for value in row]
+        finally:
+            workbook.close()
+
+    return header, rows()
+
+
+def column_map(header):
+    """Map each Student field to the index of its column in ``header``."""
+    positions = {_header_key(name): index for index, name in enumerate(header)}
+    mapping = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in positions:
+                mapping[field] = positions[alias]
+                break
+    if "name" not in mapping and "first_name" not in mapping:
+        raise ValueError("The file needs a 'name' or 'first_name' column.")
+    return mapping
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+# -------------------------------------------------------
+# VALIDATION
+# -------------------------------------------------------
+
+def _text(series):
+    return series.astype("string").fillna("").str.strip()
+
+
+def _given(series):
+    return _text(series) != ""
+
+
+def _reject(reasons, mask, reason):
+    reasons[mask & (reasons == "")] = reason
+
+
+def normalise(rows, mapping):
+    """
+    One frame with a column per Student field plus ``phone_key``,
+    ``email_key`` and ``reason`` (empty for valid rows), computed column by
+    column rather than row by row.
+    """
+    frame = pd.DataFrame(
+        {
+            field: [row[i] if i < len(row) else None for row in rows]
+            for field, i in mapping.items()
+        },
+        index=range(len(rows)),
+    )
+    for field in list(COLUMN_ALIASES):
+        if field not in frame:
+            frame[field] = None
+
+    for field in TEXT_FIELDS + ["name", "country"]:
+        frame[field] = _text(frame[field])
+
+    # "Ali Khan" in a single name column -> first "Ali", last "Khan"
+    parts = frame["name"].str.split(" ", n=1, expand=True).reindex(columns=[0, 1]).fillna("")
+    no_first = frame["first_name"] == ""
+    frame.loc[no_first, "first_name"] = parts.loc[no_first, 0].str.strip()
+    no_last = no_first & (frame["last_name"] == "")
+    frame.loc[no_last, "last_name"] = parts.loc[no_last, 1].str.strip()
+
+    # Same rules as crm.contacts.normalise_phone / normalise_email.
+    digits = frame["phone"].str.replace(r"\D", "", regex=True).str.replace(r"^00", "", regex=True)
+    frame["phone_key"] = digits.where(digits.str.len() >= MIN_PHONE_DIGITS)
+    email = frame["email"].str.lower()
+    frame["email_key"] = email.where(email.str.contains("@", regex=False))
+
+    raw_dates = frame["enrollment_date"]
+    dates = pd.to_datetime(raw_dates, errors="coerce", format="mixed")
+    frame["enrollment_date"] = pd.Series(
+        [None if pd.isna(d) else d.date() for d in dates], index=frame.index, dtype=object
+    )
+
+    raw_ages = frame["age"]
+    ages = pd.to_numeric(raw_ages, errors="coerce")
+    frame["age"] = pd.Series(
+        [None if pd.isna(a) else int(a) for a in ages], index=frame.index, dtype=object
+    )
+
+    reasons = pd.Series("", index=frame.index, dtype=object)
+    _reject(reasons, frame["first_name"] == "", "Missing name")
+    _reject(
+        reasons,
+        (frame["email"] != "") & ~frame["email"].str.match(EMAIL_PATTERN),
+        "Invalid email",
+    )
+    _reject(reasons, _given(raw_dates) & dates.isna(), "Invalid enrollment date")
+    _reject(
+        reasons,
+        _given(raw_ages) & (ages.isna() | (ages < 0) | (ages % 1 != 0)),
+        "Invalid age",
+    )
+    for field in TEXT_FIELDS:
+        max_length = Student._meta.get_field(field).max_length
+        _reject(reasons, frame[field].str.len() > max_length, f"{field} longer than {max_length}")
+
+    frame["reason"] = reasons
+    return frame
+
+
+# -------------------------------------------------------
+# WRITING
+# -------------------------------------------------------
+
+class ImportStats:
+    """Running totals of an import, plus how often each field was changed."""
+
+    COUNTS = ("rows", "created", "updated", "unchanged", "skipped", "conflicts", "rejected")
+
+    def __init__(self, **counts):
+        for name in self.COUNTS:
+            setattr(self, name, counts.get(name, 0))
+        self.changed_fields = Counter()
+
+    def add(self, other):
+        for name in self.COUNTS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.changed_fields.update(other.changed_fields)
+
+    def summary(self):
+        text = (
+            f"{self.rows} rows: {self.created} created, {self.updated} updated, "
+            f"{self.unchanged} unchanged, {self.skipped} skipped, "
+            f"{self.conflicts} conflicts, {self.rejected} rejected"
+        )
+        if self.changed_fields:
+            fields = ", ".join(f"{f} {n}" for f, n in self.changed_fields.most_common())
+            text += f" (changed fields: {fields})"
+        return text
+
+
+# Fields an update may change; empty cells never overwrite stored values.
+UPDATE_FIELDS = [
+    "first_name", "last_name", "phone", "email", "country", "age", "course",
+    "enrollment_date", "passport_number", "visa_type",
+]
+
+# Students are matched on any of these (normalised) values.
+MATCH_KEYS = ("phone_key", "email_key", "passport_number")
+
+
+def _key(value):
+    return value if isinstance(value, str) and value else None
+
+
+def _existing(frame):
+    """Students sharing a phone, email or passport number with ``frame``, in one query."""
+    lookups = {key: set(frame[key].dropna()) - {""} for key in MATCH_KEYS}
+    condition = Q()
+    for key, values in lookups.items():
+        if values:
+            condition |= Q(**{f"{key}__in": values})
+    if not condition:
+        return []
+    return list(Student.objects.filter(condition))
+
+
+def _diff(student, row, country_id, fields):
+    """{field: (old, new)} for the fields of ``row`` that differ from ``student``."""
+    changes = {}
+    for field in fields:
+        if field == "country":
+            if country_id and country_id != student.country_id:
+                changes[field] = (student.country_id, country_id)
+            continue
+
+        new = getattr(row, field)
+        if new is None or new == "":
+            continue
+        old = getattr(student, field)
+        if field == "phone":
+            # Only a different number is a change, not different formatting.
+            if _key(row.phone_key) == student.phone_key:
+                continue
+        elif field == "email":
+            if _key(row.email_key) == student.email_key:
+                continue
+        elif old == new:
+            continue
+        changes[field] = (old, new)
+    return changes
+
+
+def _apply(student, changes, row):
+    for field, (_, new) in changes.items():
+        if field == "country":
+            student.country_id = new
+        else:
+            setattr(student, field, new)
+    if "phone" in changes:
+        student.phone_key = _key(row.phone_key)
+    if "email" in changes:
+        student.email_key = _key(row.email_key)
+
+
+class DryRun:
+    """
+    What the batches of a dry run would have written, for the batches after
+    them: the students they created or changed (by match key, and by pk for
+    stored ones) and the ids of the countries they created. A dry run
+    writes nothing, so later batches match these instead of the database
+    rows a real run would find.
+    """
+
+    def __init__(self):
+        self.index = {key: {} for key in MATCH_KEYS}
+        self.by_pk = {}
+        self.country_ids = {}
+
+    def remember(self, student):
+        if student.pk:
+            self.by_pk[student.pk] = student
+        for key in MATCH_KEYS:
+            value = getattr(student, key)
+            if value:
+                self.index[key][value] = student
+
+    def find(self, key, value):
+        student = self.index[key].get(value)
+        # Not if its key was changed by a later row.
+        return student if student is not None and getattr(student, key) == value else None
+
+
+def _write(frame, fields, update, now, dry_run=None):
+    """
+    Insert, update or skip each row of a validated frame. Returns the chunk's
+    ImportStats and the (row index, message) of each conflict.
+
+    A row matches the student sharing any of its phone, email or passport
+    number. Rows matching more than one student are conflicts and left alone.
+    Rows matching a student created or updated earlier in the chunk apply to
+    that student, so a repeated row behaves the same in any chunk.
+
+    With a ``DryRun`` nothing is written; what would have been is recorded
+    on it instead.
+    """
+    stats = ImportStats()
+    conflicts = []
+    index = {key: {} for key in MATCH_KEYS}
+
+    def remember(student):
+        for key in MATCH_KEYS:
+            value = getattr(student, key)
+            if value:
+                index[key][value] = student
+
+    originals = {}
+    for student in _existing(frame):
+        if dry_run is not None:
+            student = dry_run.by_pk.get(student.pk, student)
+        remember(student)
+        originals[student.pk] = student_bucket(
+            student.created_at, student.country_id, student.application_status
+        )
+
+    names = set(frame["country"]) - {""}
+    if dry_run is not None:
+        for key in MATCH_KEYS:
+            for value in set(frame[key].dropna()) - {""}:
+                student = dry_run.find(key, value)
+                if student is not None:
+                    remember(student)
+        country_ids = {n: dry_run.country_ids[n] for n in names if n in dry_run.country_ids}
+        country_ids.update(refdata.ids(Country, names - set(country_ids)))
+        dry_run.country_ids.update(country_ids)
+    else:
+        country_ids = refdata.ids(Country, names)
+
+    new_students = {}  # id(student) -> student
+    changed = {}  # pk -> (student, changed fields)
+    for position, row in zip(frame.index, frame.itertuples(index=False)):
+        matches = {
+            id(student): student
+            for key in MATCH_KEYS
+            if (student := index[key].get(_key(getattr(row, key)))) is not None
+        }
+        if len(matches) > 1:
+            ids = sorted(str(s.pk or "new") for s in matches.values())
+            stats.conflicts += 1
+            conflicts.append((position, "Matches more than one student: " + ", ".join(ids)))
+            continue
+
+        country_id = country_ids.get(row.country)
+        if not matches:
+            student = Student(
+                first_name=row.first_name,
+                last_name=row.last_name,
+                phone=row.phone,
+                email=row.email,
+                phone_key=_key(row.phone_key),
+                email_key=_key(row.email_key),
+                country_id=country_id,
+                age=row.age,
+                course=row.course,
+                enrollment_date=row.enrollment_date,
+                passport_number=row.passport_number or None,
+                visa_type=row.visa_type or None,
+            )
+            new_students[id(student)] = student
+            remember(student)
+            stats.created += 1
+            continue
+
+        student = next(iter(matches.values()))
+        if not update:
+            stats.skipped += 1
+            continue
+
+        changes = _diff(student, row, country_id, fields)
+        if not changes:
+            stats.unchanged += 1
+            continue
+        _apply(student, changes, row)
+        remember(student)
+        stats.updated += 1
+        stats.changed_fields.update(list(changes))
+        if id(student) in new_students:
+            continue  # inserted earlier in this chunk, with the changes
+        if dry_run is not None:
+            dry_run.remember(student)
+            continue
+        if student.pk in changed:
+            changed[student.pk][1].update(changes)
+        else:
+            changed[student.pk] = (student, set(changes))
+
+    if dry_run is not None:
+        for student in new_students.values():
+            dry_run.remember(student)
+        return stats, conflicts
+
+    students = list(new_students.values())
+    Student.objects.bulk_create(students)
+
+    updated = [student for student, _ in changed.values()]
+    if updated:
+        update_fields = {"updated_at"}
+        for student, fields_changed in changed.values():
+            student.updated_at = now
+            update_fields |= fields_changed
+            if "phone" in fields_changed:
+                update_fields.add("phone_key")
+            if "email" in fields_changed:
+                update_fields.add("email_key")
+        Student.objects.bulk_update(updated, sorted(update_fields))
+
+    # What the Student signals would have done row by row.
+    index_students(
+        [s.id for s in students]
+        + [s.pk for s, f in changed.values() if f & set(FTS_COLUMNS)]
+    )
+    bump_all([student_bucket(s.created_at, s.country_id, s.application_status) for s in students])
+    move_all(
+        (originals[s.pk], student_bucket(s.created_at, s.country_id, s.application_status))
+        for s in updated
+    )
+    bump_data_version_on_commit()
+    return stats, conflicts
+
+
+def write_batch(frame, rows, mapping, first_row, update=False, on_reject=None, dry_run=None):
+    """
+    Write one normalised batch in its own transaction; ``first_row`` is the
+    file row number of ``rows[0]``, for the reject report. With ``update``,
+    rows matching a student update the fields that changed; otherwise they
+    are skipped.
+
+    ``dry_run`` is the ``DryRun`` shared by every batch of a dry run: the
+    batch is only counted, and its transaction (which may have created
+    countries) rolled back, so SQLite's write lock is held for one batch at
+    a time. Counts are those of a real run, since later batches match what
+    the earlier ones would have written.
+    """
+    rejected = frame["reason"] != ""
+    valid = frame[~rejected]
+
+    fields = [f for f in UPDATE_FIELDS if f in mapping]
+    if "name" in mapping:
+        fields = sorted(set(fields) | {"first_name", "last_name"}, key=UPDATE_FIELDS.index)
+
+    # A webhook can create one of these students between our lookup and
+    # insert; the unique contact keys reject the batch and the retry sees it.
+    conflicts = []
+    stats = ImportStats()
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        if valid.empty:
+            break
+        try:
+            with transaction.atomic():
+                stats, conflicts = _write(valid, fields, update, timezone.now(), dry_run)
+                if dry_run is not None:
+                    transaction.set_rollback(True)
+            break
+        except IntegrityError:
+            if attempt == MAX_ATTEMPTS:
+                raise
+
+    stats.rows = len(rows)
+    stats.rejected = int(rejected.sum())
+    if on_reject:
+        problems = [(i, frame.at[i, "reason"]) for i in frame.index[rejected]] + conflicts
+        for index, reason in sorted(problems):
+            on_reject(first_row + index, reason, rows[index])
+    return stats
+
+
+def parse_file(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    ``(header, mapping, batches)`` for ``path``, where ``batches`` lazily
+    yields ``(first_row, rows, frame)`` with each chunk's normalised frame.
+    Reads only, so it can run in a worker process.
+    """
+    header, rows = read_rows(path)
+    mapping = column_map(header)
+
+    def batches():
+        first_row = 2  # row 1 is the header
+        for chunk in chunked(rows, chunk_size):
+            yield first_row, chunk, normalise(chunk, mapping)
+            first_row += len(chunk)
+
+    return header, mapping, batches()
+
@@ -0,0 +1,178 @@
+# crm/inbox.py
+"""
+Acknowledge-first webhook ingestion.
+
+With ``WEBHOOK_ASYNC`` on, ``webhook_lead`` only stores each payload as a
+``WebhookInbox`` row and answers 202, so Facebook/Zapier never time out
+and retry. The ``run_webhook_inbox`` worker claims due rows oldest first,
+runs them through ``ingest_leads`` in batches and records the outcome.
+
+A batch that raises is retried one payload at a time, so a single bad
+payload cannot hold back the rest. Failures back off exponentially and go
+to the ``dead`` state after ``WEBHOOK_INBOX_MAX_ATTEMPTS``; payloads that
+can never succeed (not a JSON object) go there immediately.
+"""
+
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+
+from .leads import ingest_leads
+from .models import WebhookInbox
+
+DEFAULT_BATCH_SIZE = 100
+
+# A claimed row whose worker has not finished it in this long is considered
+# abandoned (crashed worker) and becomes pending again.
+STALE_AFTER = timedelta(minutes=5)
+
+
+def enqueue(items, keys=None):
+    """Store raw payloads (and their request idempotency keys); returns inbox ids."""
+    keys = keys or [None] * len(items)
+    rows = WebhookInbox.objects.bulk_create(
+        [WebhookInbox(payload=item, request_key=key or "") for item, key in zip(items, keys)]
+    )
+    return [row.id for row in rows]
+
+
+# -------------------------------------------------------
+# WORKER
+# -------------------------------------------------------
+
+def release_stale():
+    return WebhookInbox.objects.filter(
+        status="processing", claimed_at__lt=timezone.now() - STALE_AFTER
+    ).update(status="pending", claimed_by="", claimed_at=None)
+
+
+def claim_batch(size=DEFAULT_BATCH_SIZE):
+    """Atomically claim up to ``size`` due rows, oldest first."""
+    now = timezone.now()
+    ids = list(
+        WebhookInbox.objects.filter(status="pending", next_attempt_at__lte=now)
+        .order_by("id")
+        .values_list("id", flat=True)[:size]
+    )
+    if not ids:
+        return []
+
+    # Another worker may have claimed some of them meanwhile; the token tells
+    # which rows this update actually won.
+    token = uuid.uuid4().hex
+    WebhookInbox.objects.filter(pk__in=ids, status="pending").update(
+        status="processing", claimed_by=token, claimed_at=now
+    )
+    return list(WebhookInbox.objects.filter(claimed_by=token, status="processing").order_by("id"))
+
+
+def retry_delay(attempts):
+    delay = settings.WEBHOOK_INBOX_RETRY_BASE_DELAY * 2 ** (attempts - 1)
+    return timedelta(seconds=min(delay, settings.WEBHOOK_INBOX_RETRY_MAX_DELAY))
+
+
+def _finish(row, result, now):
+    row.attempts += 1
+    row.claimed_by = ""
+    row.claimed_at = None
+    row.result = result
+    if result["status"] == "ok":
+        row.status = "done"
+        row.last_error = ""
+        row.processed_at = now
+    else:
+        row.status = "dead"
+        row.last_error = result["message"]
+
+
+def _fail(row, error, now):
+    row.attempts += 1
+    row.claimed_by = ""
+    row.claimed_at = None
+    row.last_error = error
+    if row.attempts >= settings.WEBHOOK_INBOX_MAX_ATTEMPTS:
+        row.status = "dead"
+    else:
+        row.status = "pending"
+        row.next_attempt_at = now + retry_delay(row.attempts)
+
+
+UPDATE_FIELDS = [
+    "status", "attempts", "next_attempt_at", "last_error",
+    "claimed_by", "claimed_at", "result", "processed_at",
+]
+
+
+def process_batch(rows):
+    """Ingest claimed rows; returns (done, retrying, dead) counts."""
+    if not rows:
+        return 0, 0, 0
+
+    try:
+        # The leads and the inbox bookkeeping commit together, so a crash
+        # cannot ingest a payload without marking it done.
+        with transaction.atomic():
+            results = ingest_leads(
+                [row.payload for row in rows], [row.request_key or None for row in rows]
+            )
+            now = timezone.now()
+            for row, result in zip(rows, results):
+                _finish(row, result, now)
+            WebhookInbox.objects.bulk_update(rows, UPDATE_FIELDS)
+    except Exception as e:
+        # Undo the in-memory bookkeeping of the rolled-back attempt.
+        for row in rows:
+            row.refresh_from_db(fields=UPDATE_FIELDS)
+
+        if len(rows) > 1:
+            totals = [process_batch([row]) for row in rows]
+            return tuple(sum(counts) for counts in zip(*totals))
+
+        row = rows[0]
+        _fail(row, f"{type(e).__name__}: {e}", timezone.now())
+        row.save(update_fields=UPDATE_FIELDS)
+
+    done = sum(1 for row in rows if row.status == "done")
+    dead = sum(1 for row in rows if row.status == "dead")
+    return done, len(rows) - done - dead, dead
+
+
+def requeue_dead(ids=None):
+    """Give dead-lettered rows (all, or ``ids``) a fresh set of attempts."""
+    qs = WebhookInbox.objects.filter(status="dead")
+    if ids:
+        qs = qs.filter(pk__in=ids)
+    return qs.update(
+        status="pending", attempts=0, next_attempt_at=timezone.now(), last_error=""
+    )
+
+
+def purge_done(older_than):
+    """Delete processed rows received before ``now - older_than``."""
+    deleted, _ = WebhookInbox.objects.filter(
+        status="done", received_at__lt=timezone.now() - older_than
+    ).delete()
+    return deleted
+
+
+# -------------------------------------------------------
+# METRICS
+# -------------------------------------------------------
+
+def inbox_stats():
+    """Inbox depth by state and the age of the oldest unprocessed payload."""
+    now = timezone.now()
+    stats = WebhookInbox.objects.aggregate(
+        pending=Count("id", filter=Q(status="pending")),
+        due=Count("id", filter=Q(status="pending", next_attempt_at__lte=now)),
+        processing=Count("id", filter=Q(status="processing")),
+        dead=Count("id", filter=Q(status="dead")),
+        oldest=Min("received_at", filter=Q(status__in=["pending", "processing"])),
+    )
+    oldest = stats.pop("oldest")
+    stats["oldest_pending_seconds"] = int((now - oldest).total_seconds()) if oldest else 0
+    return stats
@@ -0,0 +1,308 @@
+# crm/leads.py
+"""
+Lead ingestion for ``webhook_lead``.
+
+``ingest_leads`` takes a list of webhook payloads and writes them with a
+handful of queries instead of several per lead: one ``IN`` lookup on the
+normalised phone and email (``crm/contacts.py``) for existing students,
+then ``bulk_create`` for new students, their tags, the leads and their
+activity logs. Counselors come from ``crm/assignment.py`` and country and
+tag ids from ``crm/refdata.py``. Because ``bulk_create`` skips model
+signals, the search index, daily metrics and dashboard cache version are
+updated here explicitly.
+
+Redeliveries are recognised by their idempotency key (``crm/idempotency.py``)
+and answered with the lead they created the first time.
+"""
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+
+from . import refdata
+from .assignment import assign_counselors
+from .caching import bump_data_version_on_commit
+from .contacts import MAX_ATTEMPTS, contact_keys
+from .idempotency import lead_key, recent_leads
+from .metrics import bump_all, lead_bucket, student_bucket
+from .models import ActivityLog, Country, Lead, Student, Tag
+from .search import index_students
+
+NEW_STUDENT_TAG = "Facebook Lead"
+
+
+def _text(value):
+    return "" if value is None else str(value).strip()
+
+
+def parse_lead(data):
+    """Normalise one webhook payload into the fields the CRM stores."""
+    full_name = _text(data.get("full_name"))
+    first_name = _text(data.get("first_name"))
+    last_name = _text(data.get("last_name"))
+
+    # If only full_name provided, split it
+    if not first_name and full_name:
+        parts = full_name.split(" ", 1)
+        first_name = parts[0]
+        if len(parts) > 1:
+            last_name = parts[1]
+
+    facebook = data.get("facebook") or {}
+    if not isinstance(facebook, dict):
+        facebook = {}
+
+    return {
+        "source": data.get("source") or "facebook",
+        "phone": _text(data.get("phone") or data.get("phone_number")),
+        "email": _text(data.get("email")),
+        "first_name": first_name,
+        "last_name": last_name,
+        "course": _text(data.get("course") or data.get("interested_course")),
+        "country": _text(data.get("country")),
+        "campaign_name": _text(facebook.get("campaign_name")),
+        "adset_name": _text(facebook.get("adset_name")),
+        "ad_name": _text(facebook.get("ad_name")),
+        "fb_lead_id": _text(facebook.get("lead_id")),
+        "payload": data,
+    }
+
+
+def _existing_students(phone_keys, email_keys):
+    """Map normalised phone and email to the matching student, in one query."""
+    by_phone, by_email = {}, {}
+    if not phone_keys and not email_keys:
+        return by_phone, by_email
+
+    rows = Student.objects.filter(
+        Q(phone_key__in=phone_keys) | Q(email_key__in=email_keys)
+    ).only("id", "phone_key", "email_key")
+    for student in rows:
+        if student.phone_key:
+            by_phone[student.phone_key] = student
+        if student.email_key:
+            by_email[student.email_key] = student
+    return by_phone, by_email
+
+
+def _known_keys(keys):
+    """Map already ingested idempotency keys to (lead_id, student_id)."""
+    cache = recent_leads()
+    known = {}
+    for key in keys:
+        hit = cache.get(key)
+        if hit is not None:
+            known[key] = hit
+
+    missing = [key for key in keys if key not in known]
+    if missing:
+        rows = Lead.objects.filter(idempotency_key__in=missing).values_list(
+            "idempotency_key", "id", "student_id"
+        )
+        for key, lead_id, student_id in rows:
+            known[key] = (lead_id, student_id)
+            cache.set(key, (lead_id, student_id))
+    return known
+
+
+def _replay(lead_id, student_id):
+    return {
+        "status": "ok",
+        "lead_id": lead_id,
+        "student_id": student_id,
+        "new_student": False,
+        "duplicate": True,
+    }
+
+
+def cached_replays(items, keys=None):
+    """
+    Results for ``items`` if every one is a replay known to this process's
+    idempotency cache, else None. Touches no database.
+    """
+    keys = keys or [None] * len(items)
+    cache = recent_leads()
+    results = []
+    for data, request_key in zip(items, keys):
+        if not isinstance(data, dict):
+            return None
+        key = lead_key(parse_lead(data)["fb_lead_id"], request_key)
+        hit = cache.get(key) if key else None
+        if hit is None:
+            return None
+        results.append(_replay(*hit))
+    return results
+
+
+def ingest_leads(items, keys=None):
+    """
+    Create a ``Lead`` (and, when no student matches by phone or email, a new
+    ``Student``) for each payload in ``items``.
+
+    ``keys`` are per-item request idempotency keys (see ``crm/idempotency.py``);
+    a payload whose key was already ingested creates nothing and reports the
+    original lead and student with ``"duplicate": true``.
+
+    Returns one result dict per item, in order: ``{"status": "ok", "lead_id",
+    "student_id", "new_student", "duplicate"}`` or ``{"status": "error",
+    "message"}``.
+    """
+    keys = keys or [None] * len(items)
+    results = [None] * len(items)
+    parsed = []
+    for index, data in enumerate(items):
+        if isinstance(data, dict):
+            lead = parse_lead(data)
+            lead["idempotency_key"] = lead_key(lead["fb_lead_id"], keys[index])
+            parsed.append((index, lead))
+        else:
+            results[index] = {"status": "error", "message": "Each lead must be a JSON object"}
+
+    if not parsed:
+        return results
+
+    # A concurrent delivery of the same lead or person can commit between
+    # our lookups and inserts; the unique idempotency/contact keys reject
+    # ours and the retry matches theirs.
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            with transaction.atomic():
+                _ingest(parsed, results)
+            return results
+        except IntegrityError:
+            if attempt == MAX_ATTEMPTS:
+                raise
+
+
+def _ingest(parsed, results):
+    known = _known_keys({lead["idempotency_key"] for _, lead in parsed} - {None})
+
+    fresh = []
+    repeats = []  # (index, key) of keys repeated within this batch
+    seen = set()
+    for index, lead in parsed:
+        key = lead["idempotency_key"]
+        if key in known:
+            results[index] = _replay(*known[key])
+        elif key is not None and key in seen:
+            repeats.append((index, key))
+        else:
+            seen.add(key)
+            fresh.append((index, lead))
+
+    if fresh:
+        _create(fresh, results)
+
+    first = {lead["idempotency_key"]: results[index] for index, lead in fresh}
+    for index, key in repeats:
+        results[index] = _replay(first[key]["lead_id"], first[key]["student_id"])
+
+
+def _create(parsed, results):
+    keys = [contact_keys(lead["phone"], lead["email"]) for _, lead in parsed]
+    by_phone, by_email = _existing_students(
+        {phone for phone, _ in keys if phone}, {email for _, email in keys if email}
+    )
+
+    # Match each lead to a student; leads repeating a phone/email within
+    # the batch share the student created for the first of them.
+    new_students = []
+    new_countries = []
+    matches = []
+    for (index, lead), (phone_key, email_key) in zip(parsed, keys):
+        student = by_phone.get(phone_key) or by_email.get(email_key)
+        new_student = student is None
+        if new_student:
+            student = Student(
+                first_name=lead["first_name"] or "Facebook",
+                last_name=lead["last_name"] or "Lead",
+                phone=lead["phone"],
+                email=lead["email"],
+                course=lead["course"],
+                phone_key=phone_key,
+                email_key=email_key,
+            )
+            new_students.append(student)
+            new_countries.append(lead["country"])
+            if phone_key:
+                by_phone[phone_key] = student
+            if email_key:
+                by_email[email_key] = student
+        matches.append((index, lead, student, new_student))
+
+    if new_students:
+        country_ids = refdata.ids(Country, {name for name in new_countries if name})
+        for student, name in zip(new_students, new_countries):
+            student.country_id = country_ids.get(name)
+        Student.objects.bulk_create(new_students)
+
+        tag_id = refdata.get_or_create_id(Tag, NEW_STUDENT_TAG)
+        Student.tags.through.objects.bulk_create(
+            [Student.tags.through(student_id=s.id, tag_id=tag_id) for s in new_students],
+            ignore_conflicts=True,
+        )
+
+    counselors = assign_counselors(len(matches))
+
+    leads = Lead.objects.bulk_create(
+        [
+            Lead(
+                source=lead["source"],
+                phone=lead["phone"] or None,
+                email=lead["email"] or None,
+                student=student,
+                payload=lead["payload"],
+                assigned_to_id=counselor_id,
+                campaign_name=lead["campaign_name"],
+                adset_name=lead["adset_name"],
+                ad_name=lead["ad_name"],
+                fb_lead_id=lead["fb_lead_id"],
+                idempotency_key=lead["idempotency_key"],
+            )
+            for (_, lead, student, _), counselor_id in zip(matches, counselors)
+        ]
+    )
+
+    ActivityLog.objects.bulk_create(
+        [
+            ActivityLog(
+                user=None,
+                student=student,
+                action="lead_created",
+                data={
+                    "source": lead["source"],
+                    "lead_id": lead_obj.id,
+                    "new_student_created": new_student,
+                },
+            )
+            for (_, lead, student, new_student), lead_obj in zip(matches, leads)
+        ]
+    )
+
+    # What the Student/Lead signals would have done row by row.
+    index_students([s.id for s in new_students])
+    bump_all(
+        [student_bucket(s.created_at, s.country_id, s.application_status) for s in new_students]
+        + [lead_bucket(lead.created_at, lead.source) for lead in leads]
+    )
+    bump_data_version_on_commit()
+
+    ingested = {}
+    for (index, lead, student, new_student), lead_obj in zip(matches, leads):
+        results[index] = {
+            "status": "ok",
+            "lead_id": lead_obj.id,
+            "student_id": student.id,
+            "new_student": new_student,
+            "duplicate": False,
+        }
+        if lead["idempotency_key"]:
+            ingested[lead["idempotency_key"]] = (lead_obj.id, student.id)
+
+    if ingested:
+        transaction.on_commit(lambda: _remember(ingested))
+
+
+def _remember(ingested):
+    cache = recent_leads()
+    for key, ids in ingested.items():
+        cache.set(key, ids)
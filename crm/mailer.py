@@ -0,0 +1,240 @@
+# crm/mailer.py
+"""
+Pooled, concurrent email sending.
+
+Opening an SMTP connection to Gmail (TCP + STARTTLS + AUTH) costs more than
+sending the message itself, so instead of ``EmailMessage.send()`` per
+recipient we keep a bounded pool of long-lived backend connections and push
+messages through them from a small thread pool:
+
+    results = get_sender().send_messages(messages)
+    apply_results(logs, results)   # fills EmailLog.status / error_message
+
+``send_messages`` returns one ``SendResult(ok, error, retryable, retry_at)``
+per message, in order. The process-wide sender also goes through a
+``RateLimiter`` so a Gmail quota burst pauses sending instead of failing
+the rest of a broadcast. Messages the limiter holds back (daily quota used
+up, or a wait longer than ``max_wait``) are not attempted: their result
+carries ``retry_at`` and ``apply_results`` reschedules them for then
+without using up an attempt.
+"""
+
+import functools
+import queue
+import smtplib
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.utils import timezone
+
+from .models import EmailLog
+from .ratelimit import QuotaExceeded, RateLimited, RateLimiter, classify_error
+
+# Errors that mean the connection itself is gone; the message is retried
+# once on a fresh connection.
+RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError)
+
+SendResult = namedtuple("SendResult", ["ok", "error", "retryable", "retry_at"], defaults=[None])
+
+
+# -------------------------------------------------------
+# CONNECTION POOL
+# -------------------------------------------------------
+
+class ConnectionPool:
+    """
+    A bounded pool of email backend connections.
+
+    Connections are created lazily, reused while healthy and reopened when
+    they have been idle longer than ``max_idle`` seconds (providers drop
+    idle SMTP sessions after a few minutes).
+    """
+
+    def __init__(self, size, max_idle=60, **connection_kwargs):
+        self.size = size
+        self.max_idle = max_idle
+        self._connection_kwargs = connection_kwargs
+        self._idle = queue.LifoQueue()
+
+        for _ in range(size):
+            self._idle.put((None, 0.0))
+
+    @contextmanager
+    def connection(self):
+        conn, last_used = self._idle.get()
+
+        if conn is None:
+            conn = get_connection(**self._connection_kwargs)
+        elif time.monotonic() - last_used > self.max_idle:
+            conn.close()
+
+        try:
+            yield conn
+        finally:
+            self._idle.put((conn, time.monotonic()))
+
+    def close(self):
+        slots = []
+        while len(slots) < self.size:
+            conn, _ = self._idle.get()
+            if conn is not None:
+                conn.close()
+            slots.append((None, 0.0))
+
+        for slot in slots:
+            self._idle.put(slot)
+
+
+# -------------------------------------------------------
+# SENDER
+# -------------------------------------------------------
+
+class PooledSender:
+
+    def __init__(self, pool_size=None, batch_size=None, limiter=None, **connection_kwargs):
+        self.pool_size = pool_size or settings.EMAIL_POOL_SIZE
+        self.batch_size = batch_size or settings.EMAIL_BATCH_SIZE
+        self.limiter = limiter
+        self.pool = ConnectionPool(self.pool_size, **connection_kwargs)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.pool_size, thread_name_prefix="mailer"
+        )
+
+    def send_messages(self, messages, max_wait=None):
+        """
+        Send ``messages`` over the pool; return a ``SendResult`` per message.
+
+        ``max_wait`` bounds how long each message may wait for the rate
+        limiter; messages that would wait longer are held back for later.
+
+        Raises if a connection cannot be opened at all, so callers can stop
+        instead of recording every message as failed.
+        """
+        messages = list(messages)
+        batches = [
+            messages[i:i + self.batch_size]
+            for i in range(0, len(messages), self.batch_size)
+        ]
+        send_batch = functools.partial(self._send_batch, max_wait=max_wait)
+
+        if len(batches) <= 1:
+            return send_batch(messages) if messages else []
+
+        results = []
+        for batch_results in self._executor.map(send_batch, batches):
+            results.extend(batch_results)
+        return results
+
+    def _send_batch(self, batch, max_wait=None):
+        with self.pool.connection() as conn:
+            conn.open()
+            return [self._send_one(conn, message, max_wait) for message in batch]
+
+    def _send_one(self, conn, message, max_wait=None):
+        if self.limiter is not None:
+            try:
+                self.limiter.acquire(max_wait=max_wait)
+            except QuotaExceeded as e:
+                return SendResult(False, str(e), True, e.retry_at)
+            except RateLimited as e:
+                return SendResult(
+                    False, str(e), True, timezone.now() + timedelta(seconds=e.wait)
+                )
+
+        try:
+            sent = self._send_with_reconnect(conn, message)
+        except Exception as e:
+            retryable, throttle = classify_error(e)
+            if throttle and self.limiter is not None:
+                self.limiter.throttled()
+            return SendResult(False, str(e), retryable)
+
+        if not sent:
+            return SendResult(False, "No recipients accepted the message.", False)
+
+        if self.limiter is not None:
+            self.limiter.succeeded()
+        return SendResult(True, "", False)
+
+    def _send_with_reconnect(self, conn, message):
+        try:
+            return conn.send_messages([message])
+        except RECONNECT_ERRORS:
+            # Stale connection: reconnect and try this message once more.
+            conn.close()
+            conn.open()
+            try:
+                return conn.send_messages([message])
+            except Exception:
+                conn.close()
+                raise
+
+    def close(self):
+        self.pool.close()
+        self._executor.shutdown(wait=True)
+
+
+_sender = None
+_sender_lock = threading.Lock()
+
+
+def get_sender():
+    """The process-wide, rate-limited sender, created on first use."""
+    global _sender
+
+    with _sender_lock:
+        if _sender is None:
+            used_today = EmailLog.objects.filter(
+                status="sent", sent_at__date=timezone.localdate()
+            ).count()
+            _sender = PooledSender(
+                limiter=RateLimiter(
+                    per_minute=settings.EMAIL_RATE_PER_MINUTE,
+                    per_day=settings.EMAIL_RATE_PER_DAY,
+                    used_today=used_today,
+                )
+            )
+        return _sender
+
+
+def retry_delay(attempts):
+    """Exponential backoff before retry number ``attempts``."""
+    delay = settings.EMAIL_RETRY_BASE_DELAY * 2 ** (attempts - 1)
+    return timedelta(seconds=min(delay, settings.EMAIL_RETRY_MAX_DELAY))
+
+
+def apply_results(logs, results, now=None):
+    """
+    Copy ``SendResult``s onto ``EmailLog`` rows (saved or not).
+
+    Retryable failures get a ``next_retry_at`` until ``EMAIL_MAX_ATTEMPTS``
+    is reached. Messages held back by the rate limiter were never tried:
+    they are rescheduled for their ``retry_at`` and the attempt is given
+    back. The caller saves the rows.
+    """
+    now = now or timezone.now()
+    sent = failed = 0
+
+    for log, result in zip(logs, results):
+        log.status = "sent" if result.ok else "failed"
+        log.error_message = result.error
+        log.next_retry_at = None
+
+        if result.ok:
+            sent += 1
+            continue
+
+        failed += 1
+        if result.retry_at is not None:
+            log.attempts = max(log.attempts - 1, 0)
+            log.next_retry_at = result.retry_at
+        elif result.retryable and log.attempts < settings.EMAIL_MAX_ATTEMPTS:
+            log.next_retry_at = now + retry_delay(log.attempts)
+
+    return sent, failed
@@ -0,0 +1,106 @@
+import datetime
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from crm.caching import bump_data_version
+from crm.metrics import rebuild_daily_metrics
+from crm.models import Country, DailyMetric, Lead, Student
+
+COUNTRIES = ["Pakistan", "India", "Nepal", "Bangladesh", "Nigeria", "Vietnam", "Egypt", "Kenya"]
+SOURCES = ["facebook", "manual", "other"]
+STATUSES = ["pending", "under_review", "approved", "rejected"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the dashboard endpoints through the test client: uncached, "
+        "cached, and conditional (ETag) requests. Runs in a transaction that is "
+        "rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--students", type=int, default=50_000)
+        parser.add_argument("--leads", type=int, default=50_000)
+        parser.add_argument("--seconds", type=float, default=3.0)
+
+    def handle(self, *args, **options):
+        client = Client(SERVER_NAME="localhost")
+        url = reverse("dashboard_stats")
+
+        with transaction.atomic():
+            self._populate(options["students"], options["leads"])
+
+            uncached = self._run(client, url, options["seconds"], before=bump_data_version)
+            bump_data_version()
+            cached = self._run(client, url, options["seconds"])
+            etag = client.get(url)["ETag"]
+            conditional = self._run(
+                client, url, options["seconds"], headers={"if-none-match": etag}
+            )
+
+            self.stdout.write(f"GET {url} for {options['seconds']:.0f}s each")
+            for label, (rate, status) in (
+                ("uncached", uncached),
+                ("cached", cached),
+                ("If-None-Match", conditional),
+            ):
+                self.stdout.write(f"  {label:14s} {rate:8.0f} req/s  (HTTP {status})")
+            self.stdout.write(f"  cached / uncached: {cached[0] / uncached[0]:.1f}x")
+
+            transaction.set_rollback(True)
+
+        bump_data_version()
+
+    def _run(self, client, url, seconds, before=None, headers=None):
+        count = 0
+        status = None
+        start = time.perf_counter()
+        deadline = start + seconds
+        while time.perf_counter() < deadline:
+            if before:
+                before()
+            status = client.get(url, headers=headers).status_code
+            count += 1
+        return count / (time.perf_counter() - start), status
+
+    def _populate(self, students, leads):
+        rng = random.Random(11)
+        start = time.perf_counter()
+        countries = [Country.objects.get_or_create(name=name)[0] for name in COUNTRIES]
+
+        Student.objects.bulk_create(
+            (
+                Student(
+                    first_name=f"Student{i}",
+                    country=rng.choice(countries),
+                    application_status=rng.choice(STATUSES),
+                )
+                for i in range(students)
+            ),
+            batch_size=5000,
+        )
+        Lead.objects.bulk_create(
+            (Lead(source=rng.choice(SOURCES), payload={}) for _ in range(leads)),
+            batch_size=5000,
+        )
+        # auto_now_add gives every row the same created_at; spread them over 90 days.
+        now = timezone.now()
+        for model in (Student, Lead):
+            ids = list(model.objects.values_list("id", flat=True))
+            for day in range(90):
+                model.objects.filter(pk__in=ids[day::90]).update(
+                    created_at=now - datetime.timedelta(days=day)
+                )
+
+        rows = rebuild_daily_metrics(Student, Lead, DailyMetric)
+        self.stdout.write(
+            f"Created {students} students and {leads} leads ({rows} rollup rows) "
+            f"in {time.perf_counter() - start:.1f}s"
+        )
+
@@ -0,0 +1,108 @@
+import csv
+import random
+import resource
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.http import HttpResponse
+
+from crm.exports import STUDENT_COLUMNS, export_response
+from crm.models import Country, Student
+
+FIRST = ["Ali", "Sara", "Omar", "Fatima", "Hassan", "Ayesha", "John", "Mei", "Carlos", "Priya"]
+LAST = ["Khan", "Ahmed", "Smith", "Li", "Garcia", "Patel", "Hameed", "Brown", "Chen", "Iqbal"]
+COURSES = ["Computer Science", "MBA", "Nursing", "Law", "Data Science", "Architecture"]
+COUNTRIES = ["Australia", "Canada", "Germany", "UK", "USA"]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the streaming student export (crm/exports.py) over synthetic "
+        "students: time, throughput and peak memory per format, optionally "
+        "against the old build-it-all-in-memory CSV. Runs in a transaction "
+        "that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--students", type=int, default=1_000_000)
+        parser.add_argument(
+            "--formats", nargs="+", default=["csv", "xlsx"], choices=["csv", "xlsx"]
+        )
+        parser.add_argument(
+            "--legacy",
+            action="store_true",
+            help="Also time the previous export (model instances into one HttpResponse).",
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self._populate(options["students"])
+            baseline = peak_rss_mb()
+            self.stdout.write(f"Peak RSS before exporting: {baseline:.0f} MB")
+
+            for fmt in options["formats"]:
+                self._report(fmt, lambda fmt=fmt: export_response(Student.objects.all(), fmt))
+            if options["legacy"]:
+                self._report("legacy csv", lambda: self._legacy(Student.objects.all()))
+
+            transaction.set_rollback(True)
+
+    def _report(self, label, build):
+        before = peak_rss_mb()
+        start = time.perf_counter()
+        response = build()
+        first_byte = None
+        size = 0
+        for block in response:
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+            size += len(block)
+        elapsed = time.perf_counter() - start
+        count = Student.objects.count()
+        self.stdout.write(
+            f"  {label:10s} {elapsed:7.1f}s  first byte {first_byte:6.2f}s  "
+            f"{count / elapsed:9.0f} rows/s  {size / 2**20:7.1f} MB  "
+            f"peak RSS +{max(peak_rss_mb() - before, 0):.0f} MB"
+        )
+
+    def _legacy(self, queryset):
+        # The StudentAdmin.export_selected this engine replaced.
+        fieldnames = [header for _, header in STUDENT_COLUMNS]
+        response = HttpResponse(content_type="text/csv")
+        writer = csv.writer(response)
+        writer.writerow(fieldnames)
+        for s in queryset:
+            writer.writerow([getattr(s, f) for f in fieldnames])
+        return response
+
+    def _populate(self, count):
+        rng = random.Random(7)
+        start = time.perf_counter()
+        countries = [Country.objects.get_or_create(name=name)[0] for name in COUNTRIES]
+        batch = []
+        for i in range(count):
+            first, last = rng.choice(FIRST), rng.choice(LAST)
+            batch.append(
+                Student(
+                    first_name=first,
+                    last_name=last,
+                    email=f"{first}.{last}{i}@example.com".lower(),
+                    phone=f"03{rng.randrange(10**9):09d}",
+                    passport_number=f"P{rng.randrange(10**7):07d}",
+                    course=rng.choice(COURSES),
+                    country=rng.choice(countries),
+                    age=rng.randrange(18, 40),
+                )
+            )
+            if len(batch) == 5000:
+                Student.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            Student.objects.bulk_create(batch)
+        self.stdout.write(f"Created {count} students in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,100 @@
+import time
+
+from django.core.mail import EmailMessage, get_connection
+from django.core.management.base import BaseCommand
+
+from crm.fake_smtp import FakeSMTPServer
+from crm.mailer import PooledSender
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the pooled sender against a local fake SMTP server and "
+        "report messages/second per connection count."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=400)
+        parser.add_argument(
+            "--connections",
+            type=int,
+            nargs="+",
+            default=[1, 4, 16],
+            help="Pool sizes to compare.",
+        )
+        parser.add_argument(
+            "--handshake-delay",
+            type=float,
+            default=0.05,
+            help="Seconds the server takes to greet a new connection (TLS/AUTH stand-in).",
+        )
+        parser.add_argument(
+            "--message-delay",
+            type=float,
+            default=0.005,
+            help="Seconds the server takes to accept each message.",
+        )
+        parser.add_argument("--batch-size", type=int, default=25)
+
+    def handle(self, *args, **options):
+        total = options["messages"]
+
+        with FakeSMTPServer(
+            handshake_delay=options["handshake_delay"],
+            message_delay=options["message_delay"],
+        ) as server:
+            self.stdout.write(
+                f"{total} messages, handshake {options['handshake_delay']}s, "
+                f"per message {options['message_delay']}s"
+            )
+
+            baseline = self._per_message_connection(server, min(total, 50))
+            self.stdout.write(f"  connection per message: {baseline:8.1f} msg/s")
+
+            for size in options["connections"]:
+                sender = PooledSender(
+                    pool_size=size,
+                    batch_size=options["batch_size"],
+                    **self._connection_kwargs(server),
+                )
+                messages = self._messages(total)
+
+                start = time.perf_counter()
+                results = sender.send_messages(messages)
+                elapsed = time.perf_counter() - start
+                sender.close()
+
+                ok = sum(1 for sent, _ in results if sent)
+                self.stdout.write(
+                    f"  {size:3d} connection(s):     {ok / elapsed:8.1f} msg/s "
+                    f"({ok}/{total} sent in {elapsed:.2f}s)"
+                )
+
+    def _per_message_connection(self, server, count):
+        start = time.perf_counter()
+        for message in self._messages(count):
+            message.connection = get_connection(**self._connection_kwargs(server))
+            message.send()
+        return count / (time.perf_counter() - start)
+
+    def _connection_kwargs(self, server):
+        return {
+            "backend": "django.core.mail.backends.smtp.EmailBackend",
+            "host": server.host,
+            "port": server.port,
+            "use_tls": False,
+            "use_ssl": False,
+            "username": "",
+            "password": "",
+        }
+
+    def _messages(self, count):
+        return [
+            EmailMessage(
+                subject=f"Benchmark {i}",
+                body="Hello from the CRM benchmark.",
+                from_email="crm@example.com",
+                to=[f"student{i}@example.com"],
+            )
+            for i in range(count)
+        ]
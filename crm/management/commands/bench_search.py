@@ -0,0 +1,96 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q
+
+from crm.models import Student
+from crm.search import STUDENT_SEARCH_COLUMNS, rebuild_index, search_students
+
+FIRST = ["Ali", "Sara", "Omar", "Fatima", "Hassan", "Ayesha", "John", "Mei", "Carlos", "Priya"]
+LAST = ["Khan", "Ahmed", "Smith", "Li", "Garcia", "Patel", "Hameed", "Brown", "Chen", "Iqbal"]
+COURSES = ["Computer Science", "MBA", "Nursing", "Law", "Data Science", "Architecture"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark student search: icontains OR-filters against the FTS5 trigram "
+        "index over synthetic students. Runs in a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--students", type=int, default=200_000)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("The search index is only used on SQLite.")
+
+        queries = ["hameed", "khan ali", "0300123", "P1234", "@example.org", "zzzz"]
+
+        with transaction.atomic():
+            self._populate(options["students"])
+            self.stdout.write(f"{Student.objects.count()} students, {options['repeat']} runs per query")
+
+            for q in queries:
+                like = self._time(lambda: self._like(q), options["repeat"])
+                fts = self._time(
+                    lambda: search_students(Student.objects.all(), q, STUDENT_SEARCH_COLUMNS),
+                    options["repeat"],
+                )
+                self.stdout.write(
+                    f"  {q!r:16s} LIKE {like[0] * 1000:8.1f} ms ({like[1]:6d} rows)   "
+                    f"FTS {fts[0] * 1000:8.1f} ms ({fts[1]:6d} rows)   "
+                    f"{like[0] / fts[0]:6.1f}x"
+                )
+
+            transaction.set_rollback(True)
+
+    def _like(self, q):
+        # The previous students_list filter, applied per term like search_students.
+        qs = Student.objects.all()
+        for term in q.split():
+            condition = Q()
+            for column in STUDENT_SEARCH_COLUMNS:
+                condition |= Q(**{f"{column}__icontains": term})
+            qs = qs.filter(condition)
+        return qs
+
+    def _time(self, build, repeat):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            qs = build().order_by("-created_at")
+            count = qs.count()
+            list(qs[:12])
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, count
+
+    def _populate(self, count):
+        rng = random.Random(7)
+        start = time.perf_counter()
+        batch = []
+        for i in range(count):
+            first, last = rng.choice(FIRST), rng.choice(LAST)
+            batch.append(
+                Student(
+                    first_name=first,
+                    last_name=last,
+                    email=f"{first}.{last}{i}@example.{'org' if i % 50 == 0 else 'com'}".lower(),
+                    phone=f"03{rng.randrange(10**9):09d}",
+                    passport_number=f"P{rng.randrange(10**7):07d}",
+                    course=rng.choice(COURSES),
+                )
+            )
+            if len(batch) == 5000:
+                Student.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            Student.objects.bulk_create(batch)
+
+        indexed = rebuild_index()
+        self.stdout.write(
+            f"Created and indexed {indexed} students in {time.perf_counter() - start:.1f}s"
+        )
@@ -0,0 +1,101 @@
+import datetime
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.template import Context, Engine
+
+from crm.models import Student
+from crm.templating import compile_message
+
+SUBJECT = "{{ first_name }}, an update on your {{ course|default:\"application\" }}"
+BODY = """Hi {{ first_name }},
+
+Thank you for applying from {{ country }}.
+{% if application_status == "approved" %}Congratulations, your application has been approved!
+{% else %}Your application is currently: {{ application_status }}.
+{% endif %}{% if visa_expiry %}Please note your visa expires on {{ visa_expiry }}.
+{% endif %}
+Kind regards,
+Admissions Team
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark broadcast personalisation: the compiled merge engine over "
+        "values() rows against per-row Django Template rendering."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=50_000)
+
+    def handle(self, *args, **options):
+        subject_tpl, body_tpl = compile_message(SUBJECT, BODY)
+        rows = self._rows(options["rows"], set(subject_tpl.lookups) | set(body_tpl.lookups))
+        self.stdout.write(f"Rendering {len(rows)} recipients")
+
+        start = time.perf_counter()
+        for row in rows:
+            context = {**subject_tpl.context(row), **body_tpl.context(row)}
+            subject_tpl.render(context)
+            body_tpl.render(context)
+        compiled = time.perf_counter() - start
+        self._report("compiled merge engine", len(rows), compiled)
+
+        # The Django baseline gets the same formatted context, so only the
+        # rendering strategy differs.
+        engine = Engine(autoescape=False)
+        django_subject = engine.from_string(SUBJECT)
+        django_body = engine.from_string(BODY)
+        start = time.perf_counter()
+        for row in rows:
+            context = Context({**subject_tpl.context(row), **body_tpl.context(row)})
+            django_subject.render(context)
+            django_body.render(context)
+        cached = time.perf_counter() - start
+        self._report("Django Template, parsed once", len(rows), cached)
+
+        start = time.perf_counter()
+        for row in rows:
+            context = Context({**subject_tpl.context(row), **body_tpl.context(row)})
+            engine.from_string(SUBJECT).render(context)
+            engine.from_string(BODY).render(context)
+        naive = time.perf_counter() - start
+        self._report("Django Template per row", len(rows), naive)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"compiled engine is {cached / compiled:.1f}x faster than a parsed-once "
+                f"Django Template and {naive / compiled:.1f}x faster than per-row parsing"
+            )
+        )
+
+    def _report(self, label, count, elapsed):
+        self.stdout.write(f"  {label:32s} {elapsed:7.2f}s  {count / elapsed:10.0f} rows/s")
+
+    def _rows(self, count, lookups):
+        """Synthetic rows shaped like ``Student.objects.values(*lookups)``."""
+        rng = random.Random(42)
+        statuses = [key for key, _ in Student.APPLICATION_STATUS_CHOICES]
+        sample = {
+            "first_name": ["Ali", "Sara", "Omar", "Fatima", "John", "Mei"],
+            "last_name": ["Khan", "Ahmed", "Smith", "Li", ""],
+            "course": ["Computer Science", "MBA", "Nursing", "", None],
+            "country__name": ["Pakistan", "UK", "Canada", None],
+            "application_status": statuses,
+        }
+        rows = []
+        for i in range(count):
+            row = {"id": i, "email": f"student{i}@example.com"}
+            for lookup in lookups:
+                if lookup in sample:
+                    row[lookup] = rng.choice(sample[lookup])
+                elif lookup == "visa_expiry":
+                    row[lookup] = rng.choice(
+                        [None, datetime.date(2026, 1, 1) + datetime.timedelta(days=i % 700)]
+                    )
+                else:
+                    row[lookup] = None
+            rows.append(row)
+        return rows
@@ -0,0 +1,100 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.images import DERIVATIVE_DIR, derivative_name, is_image, render
+from crm.models import Student, StudentDocument
+
+
+class Command(BaseCommand):
+    help = (
+        "Make the missing thumbnails/previews (crm/images.py) of every passport "
+        "image and image document, in a pool of worker processes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Worker processes (default: the CPU count).",
+        )
+        parser.add_argument(
+            "--prune",
+            action="store_true",
+            help="Also delete derivatives no current image uses.",
+        )
+
+    def handle(self, *args, **options):
+        if options["workers"] < 1:
+            raise CommandError("--workers must be at least 1.")
+
+        names = set(
+            Student.objects.exclude(passport_image="")
+            .exclude(passport_image__isnull=True)
+            .values_list("passport_image", flat=True)
+        )
+        names.update(StudentDocument.objects.exclude(file="").values_list("file", flat=True))
+        images = sorted(name for name in names if is_image(name))
+
+        jobs, expected = [], set()
+        missing = present = 0
+        for name in images:
+            for size, box in settings.IMAGE_DERIVATIVE_SIZES.items():
+                derivative = derivative_name(name, size)
+                if derivative is None:
+                    missing += 1
+                    break
+                expected.add(derivative)
+                if default_storage.exists(derivative):
+                    present += 1
+                    continue
+                jobs.append((
+                    default_storage.path(name),
+                    default_storage.path(derivative),
+                    box,
+                    settings.IMAGE_DERIVATIVE_FORMAT,
+                    settings.IMAGE_DERIVATIVE_QUALITY,
+                ))
+
+        self.stdout.write(
+            f"{len(images)} images: {len(jobs)} derivatives to make, {present} present, "
+            f"{missing} source files missing."
+        )
+        made = failed = 0
+        if jobs:
+            # Workers only run PIL on file paths; spawned, so they share nothing
+            # (no database connection) with this process.
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(options["workers"], mp_context=context) as pool:
+                results = pool.map(render, *zip(*jobs), chunksize=8)
+                for done, (job, ok) in enumerate(zip(jobs, results), 1):
+                    if ok:
+                        made += 1
+                    else:
+                        failed += 1
+                        self.stderr.write(f"  not a readable image: {job[0]}")
+                    if done % 500 == 0:
+                        self.stdout.write(f"  {done}/{len(jobs)}")
+
+        if options["prune"]:
+            pruned = self._prune(expected)
+            self.stdout.write(f"Deleted {pruned} unused derivatives.")
+
+        self.stdout.write(self.style.SUCCESS(f"Made {made} derivatives; {failed} failed."))
+
+    def _prune(self, expected):
+        root = default_storage.path(DERIVATIVE_DIR)
+        pruned = 0
+        for directory, _, files in os.walk(root):
+            for filename in files:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, default_storage.path("")).replace(os.sep, "/")
+                if name not in expected:
+                    os.unlink(path)
+                    pruned += 1
+        return pruned
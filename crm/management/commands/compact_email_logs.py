@@ -0,0 +1,49 @@
+import os
+
+from django.db import connection, transaction
+from django.core.management.base import BaseCommand
+
+from crm.email_storage import compact_email_logs
+from crm.models import EmailLog, EmailTemplate
+
+
+class Command(BaseCommand):
+    help = "Move repeated EmailLog subjects/bodies into shared templates and report the space saved."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report what would be compacted.",
+        )
+        parser.add_argument(
+            "--vacuum",
+            action="store_true",
+            help="Run VACUUM afterwards and report the SQLite file size (SQLite only).",
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            report = compact_email_logs(EmailLog, EmailTemplate, dry_run=options["dry_run"])
+
+        prefix = "Would compact" if options["dry_run"] else "Compacted"
+        self.stdout.write(
+            f"{prefix} {report['rows_compacted']} of {report['rows_scanned']} email logs "
+            f"into {report['templates_created']} new templates."
+        )
+        self.stdout.write(
+            f"Text stored: {report['bytes_before']} -> {report['bytes_after']} bytes "
+            f"({report['bytes_saved']} bytes saved)."
+        )
+
+        if options["vacuum"] and not options["dry_run"] and connection.vendor == "sqlite":
+            path = connection.settings_dict["NAME"]
+            before = os.path.getsize(path)
+            with connection.cursor() as cursor:
+                cursor.execute("VACUUM")
+            after = os.path.getsize(path)
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Database file: {before} -> {after} bytes ({before - after} bytes reclaimed)."
+                )
+            )
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from crm.blobstore import dedupe_documents, recount
+
+
+class Command(BaseCommand):
+    help = (
+        "Move student document files stored before content-addressed storage "
+        "into the blob store, sharing one file per distinct content, and "
+        "report the bytes reclaimed. Also corrects blob reference counts."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only hash the files and report what would be reclaimed.",
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options["dry_run"]
+
+        def on_file(old, name):
+            if name is None:
+                self.stderr.write(f"  missing: {old}")
+            elif options["verbosity"] > 1:
+                self.stdout.write(f"  {old} -> {name}")
+
+        report = dedupe_documents(dry_run=dry_run, on_file=on_file)
+        if not dry_run:
+            with transaction.atomic():
+                corrected = recount()
+            if corrected:
+                self.stdout.write(f"Corrected {corrected} blob reference counts.")
+
+        prefix = "Would move" if dry_run else "Moved"
+        self.stdout.write(
+            f"{prefix} {report['files']} files ({report['documents']} documents) into "
+            f"{report['blobs_created']} new blobs; {report['missing']} files missing."
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Stored: {report['bytes_before']} -> {report['bytes_written']} bytes "
+                f"({report['bytes_reclaimed']} bytes reclaimed)."
+            )
+        )
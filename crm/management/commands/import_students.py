@@ -0,0 +1,129 @@
+import csv
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from crm import import_pipeline
+from crm.importer import DEFAULT_CHUNK_SIZE, ImportStats
+
+DEFAULT_FILE = os.path.join(settings.BASE_DIR, "data", "students_with_course.xlsx")
+
+# Seconds between progress lines of a file.
+PROGRESS_EVERY = 2.0
+
+
+class Command(BaseCommand):
+    help = (
+        "Import students from .xlsx or .csv files (paths, directories or globs). "
+        "Files are parsed in parallel worker processes and written by this one, "
+        "in chunks that are each validated and committed on their own. Rows "
+        "matching a student by phone, email or passport number are skipped, or "
+        "merged with --update; invalid and conflicting rows are written to "
+        "<file>.rejects.csv. A file that fails does not stop the others."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="*", default=[DEFAULT_FILE], metavar="path")
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=DEFAULT_CHUNK_SIZE,
+            help="Rows validated and committed together.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            help="Processes parsing files (default: one per file, up to the CPU "
+            "count; 0 parses in this process).",
+        )
+        parser.add_argument(
+            "--update",
+            action="store_true",
+            help="Write changed fields to matched students instead of skipping them.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report what the import would do, then roll everything back.",
+        )
+        parser.add_argument(
+            "--rejects-dir",
+            help="Directory for the rejects files (default: next to each file).",
+        )
+
+    def handle(self, *args, **options):
+        paths = import_pipeline.expand_paths(options["paths"])
+        if not paths:
+            raise CommandError("No .xlsx or .csv files found.")
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be at least 1.")
+        workers = options["workers"]
+        if workers is None:
+            workers = min(len(paths), os.cpu_count() or 1)
+
+        self.rejects_dir = options["rejects_dir"]
+        self.rejects = {}  # path -> (file, csv writer, rejects path)
+        self.start = time.perf_counter()
+        self.last_report = {}
+        try:
+            results = import_pipeline.run(
+                paths,
+                workers=workers,
+                chunk_size=options["chunk_size"],
+                update=options["update"],
+                dry_run=options["dry_run"],
+                on_reject=self.reject,
+                on_progress=self.progress,
+                on_finish=self.finish,
+            )
+        finally:
+            for handle, _, _ in self.rejects.values():
+                handle.close()
+
+        totals = ImportStats()
+        for result in results:
+            totals.add(result.stats)
+        failed = [result for result in results if result.error]
+
+        summary = f"{len(results)} files, {self._summary(totals)}"
+        if options["dry_run"]:
+            self.stdout.write(self.style.WARNING(f"Dry run, nothing saved. {summary}"))
+        else:
+            self.stdout.write(self.style.SUCCESS(summary))
+        if failed:
+            raise CommandError(f"{len(failed)} of {len(results)} files failed.")
+
+    def _summary(self, stats, start=None):
+        elapsed = time.perf_counter() - (start or self.start)
+        rate = stats.rows / max(elapsed, 1e-9)
+        return f"{stats.summary()} in {elapsed:.1f}s ({rate:.0f} rows/s)"
+
+    def reject(self, result, row_number, reason, row):
+        if result.path not in self.rejects:
+            directory = self.rejects_dir or os.path.dirname(result.path)
+            name = os.path.splitext(os.path.basename(result.path))[0] + ".rejects.csv"
+            rejects_path = os.path.join(directory, name)
+            handle = open(rejects_path, "w", newline="", encoding="utf-8")
+            writer = csv.writer(handle)
+            writer.writerow(["row", "reason", *result.header])
+            self.rejects[result.path] = (handle, writer, rejects_path)
+        self.rejects[result.path][1].writerow([row_number, reason, *row])
+
+    def progress(self, result):
+        now = time.perf_counter()
+        if now - self.last_report.get(result.path, self.start) >= PROGRESS_EVERY:
+            self.last_report[result.path] = now
+            self.stdout.write(
+                f"{os.path.basename(result.path)}: {self._summary(result.stats, result.started)}"
+            )
+
+    def finish(self, result):
+        name = os.path.basename(result.path)
+        if result.error:
+            self.stderr.write(f"FAILED {name} after {result.stats.rows} rows: {result.error}")
+        else:
+            self.stdout.write(f"Done {name}: {self._summary(result.stats, result.started)}")
+        if result.path in self.rejects:
+            self.stdout.write(f"  rejected rows written to {self.rejects[result.path][2]}")
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from crm.caching import bump_data_version
+from crm.metrics import rebuild_daily_metrics
+from crm.models import DailyMetric, Lead, Student
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the DailyMetric rollup from the Student and Lead tables "
+        "(needed after bulk_create/update() imports, which skip signals)."
+    )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        count = rebuild_daily_metrics(Student, Lead, DailyMetric)
+        bump_data_version()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Wrote {count} rollup rows in {time.perf_counter() - start:.1f}s."
+            )
+        )
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from crm.search import rebuild_index, trigram_supported
+
+
+class Command(BaseCommand):
+    help = "Rebuild the SQLite FTS5 student search index from the Student table."
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("The search index is only used on SQLite.")
+        if not trigram_supported():
+            raise CommandError(
+                "The search index needs SQLite 3.34 or newer (FTS5 trigram tokenizer); "
+                "searches use LIKE queries instead."
+            )
+
+        start = time.perf_counter()
+        with transaction.atomic():
+            count = rebuild_index()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Indexed {count} students in {time.perf_counter() - start:.1f}s."
+            )
+        )
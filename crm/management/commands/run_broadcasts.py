@@ -0,0 +1,90 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.broadcast import (
+    DEFAULT_CHUNK_SIZE,
+    claim_next_job,
+    process_job,
+    requeue_job,
+    retry_due_emails,
+)
+from crm.models import BroadcastJob
+
+
+class Command(BaseCommand):
+    help = (
+        "Send queued email broadcasts in chunks, resuming interrupted jobs, "
+        "and re-send failed emails whose retry is due."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=DEFAULT_CHUNK_SIZE,
+            help="Recipients sent (and checkpointed) per chunk.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Process every available job, then exit instead of polling.",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=5.0,
+            help="Seconds to wait between polls when the queue is empty.",
+        )
+        parser.add_argument(
+            "--requeue",
+            type=int,
+            metavar="JOB_ID",
+            help="Put a failed job back in the queue and exit.",
+        )
+
+    def handle(self, *args, **options):
+        if options["requeue"]:
+            try:
+                job = BroadcastJob.objects.get(pk=options["requeue"])
+            except BroadcastJob.DoesNotExist:
+                raise CommandError(f"Broadcast job {options['requeue']} does not exist.")
+            requeue_job(job)
+            self.stdout.write(f"Requeued {job} at {job.cursor}/{job.total}.")
+            return
+
+        while True:
+            retried = self._retry_due()
+            job = claim_next_job()
+
+            if job is None:
+                if retried:
+                    continue
+                if options["once"]:
+                    return
+                time.sleep(options["sleep"])
+                continue
+
+            self.stdout.write(f"Processing {job} from {job.cursor}/{job.total}")
+            job = process_job(job, chunk_size=options["chunk_size"])
+
+            if job.status == "failed":
+                self.stderr.write(f"{job} stopped: {job.last_error}")
+            else:
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"{job}: sent {job.sent_count}, failed {job.failed_count}"
+                    )
+                )
+
+    def _retry_due(self):
+        try:
+            sent, failed = retry_due_emails()
+        except Exception as e:
+            # Connection-level failure: the logs stay due and are retried next poll.
+            self.stderr.write(f"Retry pass stopped: {e}")
+            return 0
+
+        if sent or failed:
+            self.stdout.write(f"Retried {sent + failed} emails: {sent} sent, {failed} failed")
+        return sent + failed
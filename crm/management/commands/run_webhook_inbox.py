@@ -0,0 +1,89 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from crm.inbox import (
+    DEFAULT_BATCH_SIZE,
+    claim_batch,
+    inbox_stats,
+    process_batch,
+    purge_done,
+    release_stale,
+    requeue_dead,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Ingest webhook payloads stored by webhook_lead in async mode, oldest "
+        "first and in batches, retrying failures and dead-lettering them after "
+        "WEBHOOK_INBOX_MAX_ATTEMPTS."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help="Payloads ingested per transaction.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Process every due payload, then exit instead of polling.",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=1.0,
+            help="Seconds to wait between polls when nothing is due.",
+        )
+        parser.add_argument(
+            "--requeue-dead",
+            action="store_true",
+            help="Give every dead-lettered payload a fresh set of attempts and exit.",
+        )
+        parser.add_argument(
+            "--purge-done-days",
+            type=int,
+            metavar="DAYS",
+            help="Delete processed payloads older than DAYS and exit.",
+        )
+        parser.add_argument(
+            "--stats",
+            action="store_true",
+            help="Print the inbox depth and exit.",
+        )
+
+    def handle(self, *args, **options):
+        if options["stats"]:
+            for key, value in inbox_stats().items():
+                self.stdout.write(f"{key}: {value}")
+            return
+        if options["requeue_dead"]:
+            self.stdout.write(f"Requeued {requeue_dead()} dead-lettered payloads.")
+            return
+        if options["purge_done_days"] is not None:
+            deleted = purge_done(timedelta(days=options["purge_done_days"]))
+            self.stdout.write(f"Deleted {deleted} processed payloads.")
+            return
+
+        while True:
+            released = release_stale()
+            if released:
+                self.stderr.write(f"Released {released} payloads from a stalled worker.")
+
+            rows = claim_batch(options["batch_size"])
+            if not rows:
+                if options["once"]:
+                    return
+                time.sleep(options["sleep"])
+                continue
+
+            done, retrying, dead = process_batch(rows)
+            message = f"Batch of {len(rows)}: {done} ingested, {retrying} retrying, {dead} dead"
+            if retrying or dead:
+                self.stderr.write(message)
+            else:
+                self.stdout.write(self.style.SUCCESS(message))
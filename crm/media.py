@@ -0,0 +1,145 @@
+# crm/media.py
+"""
+Access-controlled delivery of uploaded files (``MEDIA_ROOT``).
+
+Passport scans and documents are personal data, so ``MEDIA_URL`` is routed
+to the ``protected_media`` view instead of being served as static files.
+The view checks that the file belongs to a student (a passport scan or a
+document) and that the user may see it (``find``): like the student pages,
+any logged-in active user may. Other stored files, such as upload blobs
+not yet attached, are never served. The transfer is then handed over:
+
+- to the front web server when ``MEDIA_SENDFILE_HEADER`` is set, so no
+  worker is tied up streaming the file. ``X-Accel-Redirect`` (nginx) gets
+  ``MEDIA_SENDFILE_URL`` + the name, an ``internal`` location aliased to
+  MEDIA_ROOT; ``X-Sendfile`` (Apache mod_xsendfile, lighttpd) gets the
+  absolute path.
+- otherwise to a ``FileResponse``, with ``Range`` requests (206) and
+  ``If-None-Match``/``If-Modified-Since`` (304) answered here.
+
+Either way the response carries an ETag from the file's size and
+modification time, and ``Cache-Control: private, no-cache``: browsers
+keep a copy but revalidate it, and shared caches keep none.
+"""
+
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import content_disposition_header, http_date
+
+from .models import Student, StudentDocument
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+READ_BLOCK_BYTES = 64 * 1024
+
+
+# -------------------------------------------------------
+# PERMISSIONS
+# -------------------------------------------------------
+
+def find(user, name):
+    """
+    The download name of stored file ``name`` if it is a student's passport
+    scan or document and ``user`` may see students, else None.
+    """
+    if not (user.is_authenticated and user.is_active) or not name:
+        return None
+
+    if Student.objects.filter(passport_image=name).exists():
+        return os.path.basename(name)
+    document = StudentDocument.objects.filter(file=name).order_by("id").first()
+    if document is None:
+        return None
+    return document.original_name or os.path.basename(name)
+
+
+# -------------------------------------------------------
+# RESPONSES
+# -------------------------------------------------------
+
+def _byte_range(header, size):
+    """
+    ``(first, last)`` byte of a single-range ``Range`` header, None to send
+    the whole file (no header, several ranges or a malformed one), or False
+    when the range lies outside the file.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match or not size or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if not first:  # "bytes=-500": the last 500 bytes
+        return (max(size - int(last), 0), size - 1) if int(last) else False
+    first = int(first)
+    if first >= size:
+        return False
+    last = min(int(last), size - 1) if last else size - 1
+    return (first, last) if first <= last else None
+
+
+def _read(path, first, length):
+    with open(path, "rb") as handle:
+        handle.seek(first)
+        while length > 0:
+            block = handle.read(min(READ_BLOCK_BYTES, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+
+
+def serve(request, name, filename=None):
+    """
+    Stored file ``name`` as the response to ``request``, shown inline as
+    ``filename``. Permissions are the caller's business.
+    """
+    try:
+        path = default_storage.path(name)
+        stat = os.stat(path)
+    except (SuspiciousFileOperation, FileNotFoundError, NotADirectoryError):
+        raise Http404("No such file.")
+
+    filename = filename or os.path.basename(name)
+    etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        header = settings.MEDIA_SENDFILE_HEADER
+        byte_range = _byte_range(request.headers.get("Range"), stat.st_size)
+        if request.headers.get("If-Range", etag) != etag:
+            byte_range = None
+
+        if header:
+            # The front server sends the file (and answers Range) itself.
+            response = HttpResponse(content_type=content_type)
+            if header.lower() == "x-accel-redirect":
+                response[header] = settings.MEDIA_SENDFILE_URL + quote(name)
+            else:
+                response[header] = path
+        elif byte_range is False:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{stat.st_size}"
+        elif byte_range:
+            first, last = byte_range
+            response = StreamingHttpResponse(
+                _read(path, first, last - first + 1), status=206, content_type=content_type
+            )
+            response["Content-Length"] = last - first + 1
+            response["Content-Range"] = f"bytes {first}-{last}/{stat.st_size}"
+        else:
+            response = FileResponse(open(path, "rb"), content_type=content_type)
+
+        response["Content-Disposition"] = content_disposition_header(False, filename)
+        response["Accept-Ranges"] = "bytes"
+        response["Last-Modified"] = http_date(stat.st_mtime)
+        response["X-Content-Type-Options"] = "nosniff"
+
+    response["ETag"] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
@@ -0,0 +1,189 @@
+# crm/metrics.py
+"""
+Daily rollup of new students and leads for the dashboard.
+
+``DailyMetric`` holds counts per (date, kind, country, source, status).
+Students count in the bucket of the day they were created with their
+current country and application status; leads by day and source. The
+signals in ``crm/signals.py`` apply +1/-1 as rows are created, changed or
+deleted, so the dashboard sums a few hundred rollup rows instead of
+scanning ``Student`` and ``Lead``.
+
+``bulk_create`` and ``QuerySet.update()`` skip signals; run
+``rebuild_daily_metrics`` after bulk imports.
+"""
+
+import datetime
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DailyMetric
+
+STUDENT_FIELDS = ("created_at", "country_id", "application_status")
+LEAD_FIELDS = ("created_at", "source")
+
+
+# -------------------------------------------------------
+# BUCKETS
+# -------------------------------------------------------
+
+def student_bucket(created_at, country_id, application_status):
+    return {
+        "date": timezone.localdate(created_at),
+        "kind": "student",
+        "country_id": country_id,
+        "source": "",
+        "status": application_status or "",
+    }
+
+
+def lead_bucket(created_at, source):
+    return {
+        "date": timezone.localdate(created_at),
+        "kind": "lead",
+        "country_id": None,
+        "source": source or "",
+        "status": "",
+    }
+
+
+def bump(bucket, delta):
+    """Add ``delta`` to one row of ``bucket``, creating it if needed."""
+    if not delta:
+        return
+    pk = DailyMetric.objects.filter(**bucket).values_list("pk", flat=True).first()
+    if pk is None:
+        DailyMetric.objects.create(count=delta, **bucket)
+    else:
+        DailyMetric.objects.filter(pk=pk).update(count=F("count") + delta)
+
+
+def bump_all(buckets):
+    """Count rows written without signals (``bulk_create``), one +1 per bucket."""
+    counts = Counter(tuple(sorted(bucket.items())) for bucket in buckets)
+    for key, delta in counts.items():
+        bump(dict(key), delta)
+
+
+def move(old_bucket, new_bucket):
+    if old_bucket != new_bucket:
+        bump(old_bucket, -1)
+        bump(new_bucket, 1)
+
+
+def move_all(moves):
+    """``move`` for rows updated without signals (``bulk_update``): (old, new) pairs."""
+    counts = Counter()
+    for old_bucket, new_bucket in moves:
+        if old_bucket != new_bucket:
+            counts[tuple(sorted(old_bucket.items()))] -= 1
+            counts[tuple(sorted(new_bucket.items()))] += 1
+    for key, delta in counts.items():
+        if delta:
+            bump(dict(key), delta)
+
+
+# -------------------------------------------------------
+# BACKFILL
+# -------------------------------------------------------
+
+def rebuild_daily_metrics(Student, Lead, DailyMetric, batch_size=1000):
+    """
+    Recompute every rollup row from the raw tables. Returns the number of
+    rows written.
+    """
+    students = (
+        Student.objects.annotate(day=TruncDate("created_at"))
+        .values("day", "country_id", "application_status")
+        .annotate(n=Count("id"))
+        .order_by()
+    )
+    leads = (
+        Lead.objects.annotate(day=TruncDate("created_at"))
+        .values("day", "source")
+        .annotate(n=Count("id"))
+        .order_by()
+    )
+
+    rows = [
+        DailyMetric(
+            date=r["day"],
+            kind="student",
+            country_id=r["country_id"],
+            status=r["application_status"] or "",
+            count=r["n"],
+        )
+        for r in students
+    ]
+    rows += [
+        DailyMetric(date=r["day"], kind="lead", source=r["source"] or "", count=r["n"])
+        for r in leads
+    ]
+
+    with transaction.atomic():
+        DailyMetric.objects.all().delete()
+        DailyMetric.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
+
+
+# -------------------------------------------------------
+# READS
+# -------------------------------------------------------
+
+def growth_rate(recent, previous):
+    """Percentage change, or None when there is nothing to compare against."""
+    if not previous:
+        return None
+    return (recent - previous) * 100.0 / previous
+
+
+def format_growth(rate):
+    return "—" if rate is None else f"{rate:+.0f}%"
+
+
+def period_summary(kind, days=30, today=None):
+    """Totals for ``kind``: all time, the last ``days`` days and the ``days`` before."""
+    today = today or timezone.localdate()
+    start = today - datetime.timedelta(days=days - 1)
+    previous_start = start - datetime.timedelta(days=days)
+
+    totals = DailyMetric.objects.filter(kind=kind).aggregate(
+        total=Sum("count"),
+        recent=Sum("count", filter=Q(date__gte=start)),
+        previous=Sum("count", filter=Q(date__gte=previous_start, date__lt=start)),
+    )
+    totals = {key: value or 0 for key, value in totals.items()}
+    totals["growth_rate"] = growth_rate(totals["recent"], totals["previous"])
+    return totals
+
+
+def daily_series(kind, days=30, today=None):
+    """(labels, counts) for each of the last ``days`` days, zero-filled."""
+    today = today or timezone.localdate()
+    start = today - datetime.timedelta(days=days - 1)
+
+    by_date = dict(
+        DailyMetric.objects.filter(kind=kind, date__gte=start)
+        .values("date")
+        .annotate(n=Sum("count"))
+        .order_by()
+        .values_list("date", "n")
+    )
+    dates = [start + datetime.timedelta(days=i) for i in range(days)]
+    return [d.isoformat() for d in dates], [by_date.get(d, 0) for d in dates]
+
+
+def breakdown(kind, field):
+    """[(value, count)] for ``kind`` grouped by ``field``, largest first."""
+    rows = (
+        DailyMetric.objects.filter(kind=kind)
+        .values(field)
+        .annotate(n=Sum("count"))
+        .filter(n__gt=0)
+        .order_by("-n")
+    )
+    return [(r[field], r["n"]) for r in rows]
@@ -0,0 +1,115 @@
+import hashlib
+import re
+
+from django.db import migrations
+
+# A frozen copy of the compaction in crm/email_storage.py as it was when
+# this migration was written, so it does not change with the app code.
+# Only text without template syntax is compacted; the single
+# "{{ first_name }}" placeholder it may get renders the same way under any
+# later version of crm/templating.py.
+
+FIRST_NAME = "{{ first_name }}"
+TEMPLATE_SYNTAX = ("{{", "}}", "{%", "%}", "{#", "#}")
+PLACEHOLDER_RE = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+BATCH_SIZE = 1000
+
+
+def _is_plain(*values):
+    return not any(marker in (value or "") for value in values for marker in TEMPLATE_SYNTAX)
+
+
+def _render(text, merge_data):
+    return PLACEHOLDER_RE.sub(lambda m: str((merge_data or {}).get(m.group(1)) or ""), text)
+
+
+def _template_hash(subject, body):
+    return hashlib.sha256(f"{subject}\0{body}".encode("utf-8")).hexdigest()
+
+
+def _split_row(row):
+    """(template_body, merge_data) of a stored row, or (None, None) to keep it literal."""
+    subject, body, first_name = row["subject"], row["body"], row["student__first_name"]
+    if not _is_plain(subject, body, first_name):
+        return None, None
+
+    if first_name and first_name in body:
+        candidate = body.replace(first_name, FIRST_NAME)
+        merge_data = {"first_name": first_name}
+        if _render(candidate, merge_data) == body:
+            return candidate, merge_data
+    return body, None
+
+
+def compact(apps, schema_editor):
+    EmailLog = apps.get_model("crm", "EmailLog")
+    EmailTemplate = apps.get_model("crm", "EmailTemplate")
+
+    groups = {}
+    rows = (
+        EmailLog.objects.filter(template__isnull=True)
+        .values("id", "subject", "body", "student__first_name")
+        .order_by("id")
+    )
+    for row in rows.iterator(chunk_size=BATCH_SIZE):
+        body, merge_data = _split_row(row)
+        if body is None:
+            continue
+        key = _template_hash(row["subject"], body)
+        group = groups.setdefault(key, {"subject": row["subject"], "body": body, "rows": []})
+        group["rows"].append((row["id"], merge_data))
+
+    existing = set(
+        EmailTemplate.objects.filter(content_hash__in=list(groups)).values_list(
+            "content_hash", flat=True
+        )
+    )
+
+    # Messages stored only once keep their literal text.
+    for key, group in groups.items():
+        if len(group["rows"]) < 2 and key not in existing:
+            continue
+
+        template, _ = EmailTemplate.objects.get_or_create(
+            content_hash=key,
+            defaults={"subject": group["subject"], "body": group["body"]},
+        )
+        updates = [
+            EmailLog(id=log_id, template=template, merge_data=merge_data, subject="", body="")
+            for log_id, merge_data in group["rows"]
+        ]
+        EmailLog.objects.bulk_update(
+            updates, ["template", "merge_data", "subject", "body"], batch_size=BATCH_SIZE
+        )
+
+
+def expand(apps, schema_editor):
+    EmailLog = apps.get_model("crm", "EmailLog")
+
+    updates = []
+    rows = EmailLog.objects.filter(template__isnull=False).select_related("template")
+    for log in rows.iterator(chunk_size=BATCH_SIZE):
+        subject, body = log.template.subject, log.template.body
+        if "{%" in subject or "{%" in body:
+            # Written by a later version's merge templates: not expandable here.
+            continue
+        log.subject = _render(subject, log.merge_data)
+        log.body = _render(body, log.merge_data)
+        log.template = None
+        log.merge_data = None
+        updates.append(log)
+
+    EmailLog.objects.bulk_update(
+        updates, ["template", "merge_data", "subject", "body"], batch_size=BATCH_SIZE
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0009_emailtemplate'),
+    ]
+
+    operations = [
+        migrations.RunPython(compact, expand),
+    ]
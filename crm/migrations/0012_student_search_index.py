@@ -0,0 +1,40 @@
+from django.db import migrations
+
+FTS_TABLE = "crm_student_fts"
+FTS_COLUMNS = "first_name, last_name, email, phone, passport_number, course"
+
+# FTS5's trigram tokenizer arrived in SQLite 3.34. Without it no table is
+# created and crm/search.py falls back to LIKE queries.
+TRIGRAM_MIN_SQLITE = (3, 34, 0)
+
+
+def create_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != "sqlite" or connection.Database.sqlite_version_info < TRIGRAM_MIN_SQLITE:
+        return
+
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+        f"USING fts5({FTS_COLUMNS}, tokenize='trigram')"
+    )
+    schema_editor.execute(
+        f"INSERT INTO {FTS_TABLE} (rowid, {FTS_COLUMNS}) "
+        "SELECT id, first_name, last_name, email, phone, "
+        "COALESCE(passport_number, ''), COALESCE(course, '') FROM crm_student"
+    )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0011_emaillog_retries'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.11 on 2026-10-17 04:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0012_student_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(fields=['created_at', 'id'], name='crm_lead_created_645e3c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(fields=['source', 'created_at', 'id'], name='crm_lead_source_bf3a48_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(fields=['created_at', 'id'], name='crm_student_created_8136a8_idx'),
+        ),
+    ]
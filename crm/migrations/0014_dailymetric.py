@@ -0,0 +1,73 @@
+# Generated by Django 4.2.11 on 2026-10-17 04:30
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+import django.db.models.deletion
+
+# A frozen copy of crm.metrics.rebuild_daily_metrics as it was when this
+# migration was written, so it does not change with the app code.
+
+BATCH_SIZE = 1000
+
+
+def backfill(apps, schema_editor):
+    Student = apps.get_model("crm", "Student")
+    Lead = apps.get_model("crm", "Lead")
+    DailyMetric = apps.get_model("crm", "DailyMetric")
+
+    students = (
+        Student.objects.annotate(day=TruncDate("created_at"))
+        .values("day", "country_id", "application_status")
+        .annotate(n=Count("id"))
+        .order_by()
+    )
+    leads = (
+        Lead.objects.annotate(day=TruncDate("created_at"))
+        .values("day", "source")
+        .annotate(n=Count("id"))
+        .order_by()
+    )
+
+    rows = [
+        DailyMetric(
+            date=r["day"],
+            kind="student",
+            country_id=r["country_id"],
+            status=r["application_status"] or "",
+            count=r["n"],
+        )
+        for r in students
+    ]
+    rows += [
+        DailyMetric(date=r["day"], kind="lead", source=r["source"] or "", count=r["n"])
+        for r in leads
+    ]
+    DailyMetric.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0013_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyMetric',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('kind', models.CharField(choices=[('student', 'Student'), ('lead', 'Lead')], max_length=10)),
+                ('source', models.CharField(blank=True, max_length=50)),
+                ('status', models.CharField(blank=True, max_length=20)),
+                ('count', models.IntegerField(default=0)),
+                ('country', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='crm.country')),
+            ],
+            options={
+                'ordering': ['-date'],
+                'indexes': [models.Index(fields=['kind', 'date', 'country', 'source', 'status'], name='crm_dailyme_kind_b21e30_idx')],
+            },
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.11 on 2026-10-17 04:36
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def backfill_keys(apps, schema_editor):
+    """Key the first lead of each Facebook lead id; later copies stay unkeyed."""
+    Lead = apps.get_model("crm", "Lead")
+    first_ids = (
+        Lead.objects.exclude(fb_lead_id="")
+        .values("fb_lead_id")
+        .annotate(first_id=Min("id"))
+        .order_by()
+    )
+    updates = [
+        Lead(id=row["first_id"], idempotency_key=f"fb:{row['fb_lead_id']}")
+        for row in first_ids
+    ]
+    Lead.objects.bulk_update(updates, ["idempotency_key"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0015_webhookinbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lead',
+            name='idempotency_key',
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='webhookinbox',
+            name='request_key',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='lead',
+            name='fb_lead_id',
+            field=models.CharField(blank=True, db_index=True, max_length=100),
+        ),
+        migrations.RunPython(backfill_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 4.2.11 on 2026-10-17 04:37
+
+import re
+
+from django.db import migrations, models
+
+# A frozen copy of the normalisers in crm/contacts.py as they were when
+# this migration was written, so it does not change with the app code.
+
+MIN_PHONE_DIGITS = 6
+
+
+def normalise_phone(value):
+    digits = re.sub(r"\D", "", str(value or ""))
+    if digits.startswith("00"):
+        digits = digits[2:]
+    return digits if len(digits) >= MIN_PHONE_DIGITS else None
+
+
+def normalise_email(value):
+    email = str(value or "").strip().lower()
+    return email if "@" in email else None
+
+
+def backfill_keys(apps, schema_editor):
+    """
+    Key every student by normalised phone/email. Where existing students
+    already share a contact, only the oldest one is keyed, so the unique
+    constraint can be added; the later copies stay as they are.
+    """
+    Student = apps.get_model("crm", "Student")
+    seen_phones, seen_emails = set(), set()
+    updates = []
+
+    for student in Student.objects.order_by("id").only("id", "phone", "email").iterator():
+        phone_key, email_key = normalise_phone(student.phone), normalise_email(student.email)
+        if phone_key in seen_phones:
+            phone_key = None
+        if email_key in seen_emails:
+            email_key = None
+        seen_phones.add(phone_key)
+        seen_emails.add(email_key)
+
+        if phone_key or email_key:
+            student.phone_key, student.email_key = phone_key, email_key
+            updates.append(student)
+
+    Student.objects.bulk_update(updates, ["phone_key", "email_key"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0016_lead_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='student',
+            name='email_key',
+            field=models.CharField(blank=True, editable=False, max_length=254, null=True),
+        ),
+        migrations.AddField(
+            model_name='student',
+            name='phone_key',
+            field=models.CharField(blank=True, editable=False, max_length=30, null=True),
+        ),
+        migrations.RunPython(backfill_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='student',
+            name='email_key',
+            field=models.CharField(blank=True, editable=False, max_length=254, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='student',
+            name='phone_key',
+            field=models.CharField(blank=True, editable=False, max_length=30, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-17 04:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0017_student_contact_keys'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='student',
+            name='passport_number',
+            field=models.CharField(blank=True, db_index=True, max_length=60, null=True),
+        ),
+    ]
@@ -1,7 +1,16 @@
-from django.db import models
+import json
+import os
+import uuid
+
+from django.db import models, transaction
+from django.db.models import F
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 
+from .blobstore import document_storage
+from .contacts import contact_keys
+from .templating import render_merge, template_hash
+
 User = get_user_model()
 
 
@@ -61,8 +70,12 @@ class Student(models.Model):
     phone = models.CharField(max_length=30, blank=True)
     email = models.EmailField(blank=True)
 
+    # Normalised phone/email (crm/contacts.py); unique so one person is one student
+    phone_key = models.CharField(max_length=30, null=True, blank=True, unique=True, editable=False)
+    email_key = models.CharField(max_length=254, null=True, blank=True, unique=True, editable=False)
+
     # PASSPORT
-    passport_number = models.CharField(max_length=60, blank=True, null=True)
+    passport_number = models.CharField(max_length=60, blank=True, null=True, db_index=True)
     passport_image = models.FileField(upload_to="passports/%Y/%m/", blank=True, null=True)
 
     # VISA
@@ -105,11 +118,39 @@ class Student(models.Model):
         indexes = [
             models.Index(fields=["email"]),
             models.Index(fields=["phone"]),
+            models.Index(fields=["created_at", "id"]),
         ]
 
     def __str__(self):
         return f"{self.first_name} {self.last_name} ({self.country or '—'})"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if "phone" in field_names and "email" in field_names:
+            instance._loaded_keys = contact_keys(instance.phone, instance.email)
+        return instance
+
+    def save(self, *args, **kwargs):
+        phone_key, email_key = contact_keys(self.phone, self.email)
+
+        # Keys are only recomputed for a contact that changed: migration 0017
+        # left later duplicates of a phone/email unkeyed, and keying them on
+        # an unrelated save would break the unique constraint.
+        loaded = getattr(self, "_loaded_keys", None)
+        if loaded is not None:
+            if phone_key == loaded[0]:
+                phone_key = self.phone_key
+            if email_key == loaded[1]:
+                email_key = self.email_key
+        self.phone_key, self.email_key = phone_key, email_key
+
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"phone", "email"} & set(update_fields):
+            kwargs["update_fields"] = set(update_fields) | {"phone_key", "email_key"}
+        super().save(*args, **kwargs)
+        self._loaded_keys = contact_keys(self.phone, self.email)
+
 
 # ----------------------------------------------------
 # STUDENT DOCUMENTS
@@ -117,13 +158,68 @@ class Student(models.Model):
 class StudentDocument(models.Model):
     student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name="documents")
     title = models.CharField(max_length=128, blank=True)
-    file = models.FileField(upload_to="student_documents/%Y/%m/")
+    # Stored once per content (crm/blobstore.py): identical uploads share a
+    # file, so the name the user uploaded is kept in original_name.
+    file = models.FileField(
+        upload_to="student_documents/%Y/%m/", storage=document_storage, max_length=255
+    )
+    original_name = models.CharField(max_length=255, blank=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
     note = models.TextField(blank=True)
 
     def __str__(self):
         return f"{self.title or 'Document'} — {self.student}"
 
+    @property
+    def filename(self):
+        return self.original_name or os.path.basename(self.file.name)
+
+
+class Blob(models.Model):
+    """A stored document file and how many documents point at it."""
+
+    name = models.CharField(max_length=255, unique=True)
+    sha256 = models.CharField(max_length=64, db_index=True)
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} refs)"
+
+
+class UploadSession(models.Model):
+    """
+    A document uploaded in chunks (crm/uploads.py). ``received`` is the
+    acknowledged offset: the bytes of the part file synced to disk.
+    """
+
+    STATUS_CHOICES = (
+        ("open", "Uploading"),
+        ("complete", "Complete"),
+        ("attached", "Attached"),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    # Optional SHA-256 of the whole file, checked when the last chunk arrives
+    sha256 = models.CharField(max_length=64, blank=True)
+    received = models.BigIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="open")
+
+    created_by = models.ForeignKey(
+        User, null=True, blank=True, on_delete=models.SET_NULL, related_name="+"
+    )
+    document = models.OneToOneField(
+        StudentDocument, null=True, blank=True, on_delete=models.SET_NULL, related_name="+"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.received}/{self.size} bytes, {self.status})"
+
 
 # ----------------------------------------------------
 # LEADS
@@ -147,7 +243,10 @@ class Lead(models.Model):
     campaign_name = models.CharField(max_length=255, blank=True)
     adset_name = models.CharField(max_length=255, blank=True)
     ad_name = models.CharField(max_length=255, blank=True)
-    fb_lead_id = models.CharField(max_length=100, blank=True)
+    fb_lead_id = models.CharField(max_length=100, blank=True, db_index=True)
+
+    # "fb:<lead id>" or "key:<Idempotency-Key header>", see crm/idempotency.py
+    idempotency_key = models.CharField(max_length=255, blank=True, null=True, unique=True)
 
     processed = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -160,6 +259,8 @@ class Lead(models.Model):
         ordering = ["-created_at"]
         indexes = [
             models.Index(fields=["source", "processed"]),
+            models.Index(fields=["created_at", "id"]),
+            models.Index(fields=["source", "created_at", "id"]),
         ]
 
 
@@ -167,6 +268,27 @@ class Lead(models.Model):
         return f"Lead {self.id} ({self.source})"
 
 
+# ----------------------------------------------------
+# COUNTERS
+# ----------------------------------------------------
+class Counter(models.Model):
+    """A named sequence shared by every worker (lead round robin in crm/assignment.py)."""
+    name = models.CharField(max_length=100, unique=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+    @classmethod
+    def advance(cls, name, by=1):
+        """Add ``by`` to counter ``name`` (created at 0) and return the new value."""
+        with transaction.atomic():
+            if not cls.objects.filter(name=name).update(value=F("value") + by):
+                cls.objects.get_or_create(name=name)
+                cls.objects.filter(name=name).update(value=F("value") + by)
+            return cls.objects.filter(name=name).values_list("value", flat=True).get()
+
+
 # ----------------------------------------------------
 # ACTIVITY LOG
 # ----------------------------------------------------
@@ -197,9 +319,145 @@ class SiteConfig(models.Model):
     key = models.CharField(max_length=100, unique=True)
     value = models.TextField(blank=True)
 
+    TRUE_VALUES = {"1", "true", "yes", "on"}
+
     def __str__(self):
         return self.key
 
+    @classmethod
+    def get(cls, key, default=None, cast=None):
+        """
+        The value stored under ``key`` converted with ``cast`` (by default
+        the type of ``default``, else str), or ``default`` when the key is
+        missing or its value does not convert. ``bool`` accepts 1/true/yes/on;
+        ``dict`` and ``list`` parse JSON. Served from crm/refdata.py.
+        """
+        from .refdata import site_config
+
+        value = site_config().get(key)
+        if value is None:
+            return default
+
+        cast = cast or (str if default is None else type(default))
+        try:
+            if cast is bool:
+                return value.strip().lower() in cls.TRUE_VALUES
+            if cast in (dict, list):
+                parsed = json.loads(value)
+                return parsed if isinstance(parsed, cast) else default
+            return cast(value)
+        except (TypeError, ValueError):
+            return default
+
+
+# ----------------------------------------------------
+# EMAIL BROADCAST JOBS
+# ----------------------------------------------------
+class BroadcastJob(models.Model):
+    """
+    A bulk email queued from the email integration page.
+
+    The audience is snapshotted into ``recipient_ids`` when the job is created;
+    the ``run_broadcasts`` worker sends it in chunks and advances ``cursor``
+    after every chunk, so a crashed worker resumes where it stopped.
+    """
+
+    STATUS_CHOICES = (
+        ("queued", "Queued"),
+        ("running", "Running"),
+        ("completed", "Completed"),
+        ("failed", "Failed"),
+    )
+
+    created_by = models.ForeignKey(
+        User,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="broadcast_jobs",
+    )
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    filters = models.JSONField(blank=True, null=True)
+
+    # AUDIENCE SNAPSHOT + CHECKPOINT
+    recipient_ids = models.JSONField(default=list)
+    total = models.PositiveIntegerField(default=0)
+    cursor = models.PositiveIntegerField(default=0)
+
+    sent_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="queued")
+    last_error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["status", "created_at"]),
+        ]
+
+    def __str__(self):
+        return f"Broadcast {self.id}: {self.subject} ({self.status})"
+
+    @property
+    def percent(self):
+        if not self.total:
+            return 100
+        return int(self.cursor * 100 / self.total)
+
+    def progress(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "total": self.total,
+            "processed": self.cursor,
+            "sent": self.sent_count,
+            "failed": self.failed_count,
+            "percent": self.percent,
+            "last_error": self.last_error,
+        }
+
+
+# ----------------------------------------------------
+# EMAIL TEMPLATES
+# ----------------------------------------------------
+class EmailTemplate(models.Model):
+    """
+    Subject and body shared by every ``EmailLog`` of a broadcast.
+
+    Logs keep only their merge variables; the personalised text is rebuilt
+    with ``render_merge`` when someone looks at it.
+    """
+
+    content_hash = models.CharField(max_length=64, unique=True)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.subject
+
+    @classmethod
+    def intern(cls, subject, body):
+        template, _ = cls.objects.get_or_create(
+            content_hash=template_hash(subject, body),
+            defaults={"subject": subject, "body": body},
+        )
+        return template
+
+    def render_subject(self, merge_data=None):
+        return render_merge(self.subject, merge_data)
+
+    def render_body(self, merge_data=None):
+        return render_merge(self.body, merge_data)
+
 
 # ----------------------------------------------------
 # EMAIL LOGGING
@@ -224,21 +482,137 @@ class EmailLog(models.Model):
         on_delete=models.SET_NULL,
         related_name="email_logs",
     )
+    broadcast = models.ForeignKey(
+        BroadcastJob,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="email_logs",
+    )
 
     to_email = models.EmailField()
     from_email = models.EmailField()
-    subject = models.CharField(max_length=255)
-    body = models.TextField()
+
+    # Either the literal text, or a shared template + per-recipient variables.
+    subject = models.CharField(max_length=255, blank=True)
+    body = models.TextField(blank=True)
+    template = models.ForeignKey(
+        EmailTemplate,
+        null=True,
+        blank=True,
+        on_delete=models.PROTECT,
+        related_name="email_logs",
+    )
+    merge_data = models.JSONField(blank=True, null=True)
 
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="sent")
     error_message = models.TextField(blank=True)
 
+    # RETRIES: a failed log with next_retry_at set is picked up by run_broadcasts
+    attempts = models.PositiveSmallIntegerField(default=1)
+    next_retry_at = models.DateTimeField(blank=True, null=True)
+
     sent_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ["-sent_at"]
+        indexes = [
+            models.Index(fields=["status", "next_retry_at"]),
+        ]
 
     def __str__(self):
         return f"Email to {self.to_email} ({self.status})"
 
+    @property
+    def rendered_subject(self):
+        if self.template_id:
+            return self.template.render_subject(self.merge_data)
+        return self.subject
+
+    @property
+    def rendered_body(self):
+        if self.template_id:
+            return self.template.render_body(self.merge_data)
+        return self.body
 
+
+# ----------------------------------------------------
+# DAILY METRICS ROLLUP
+# ----------------------------------------------------
+class DailyMetric(models.Model):
+    """
+    Per-day counts of new students and leads, kept current by the signals
+    in ``crm/signals.py`` and rebuilt by ``rebuild_daily_metrics``.
+
+    A bucket may be split over several rows (concurrent first writes do not
+    conflict), so readers always ``Sum("count")``.
+    """
+    KIND_CHOICES = (
+        ("student", "Student"),
+        ("lead", "Lead"),
+    )
+
+    date = models.DateField()
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    country = models.ForeignKey(
+        Country, null=True, blank=True, on_delete=models.SET_NULL, related_name="+"
+    )
+    source = models.CharField(max_length=50, blank=True)
+    status = models.CharField(max_length=20, blank=True)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ["-date"]
+        indexes = [
+            models.Index(fields=["kind", "date", "country", "source", "status"]),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.kind}: {self.count}"
+
+
+# ----------------------------------------------------
+# WEBHOOK INBOX
+# ----------------------------------------------------
+class WebhookInbox(models.Model):
+    """
+    A raw ``webhook_lead`` payload accepted with 202 in async mode
+    (``WEBHOOK_ASYNC``) and processed later by ``run_webhook_inbox``.
+
+    Failed payloads go back to ``pending`` with a later ``next_attempt_at``
+    until ``WEBHOOK_INBOX_MAX_ATTEMPTS``, then to ``dead``.
+    """
+
+    STATUS_CHOICES = (
+        ("pending", "Pending"),
+        ("processing", "Processing"),
+        ("done", "Done"),
+        ("dead", "Dead letter"),
+    )
+
+    payload = models.JSONField()
+    # Idempotency-Key header of the request, per item (crm/idempotency.py)
+    request_key = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="pending")
+
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+
+    # WORKER CLAIM: rows stuck in "processing" past STALE_AFTER are released
+    claimed_by = models.CharField(max_length=32, blank=True)
+    claimed_at = models.DateTimeField(blank=True, null=True)
+
+    result = models.JSONField(blank=True, null=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ["id"]
+        verbose_name_plural = "webhook inbox"
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"]),
+        ]
+
+    def __str__(self):
+        return f"Webhook {self.id} ({self.status})"
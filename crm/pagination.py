@@ -0,0 +1,152 @@
+# crm/pagination.py
+"""
+Keyset (cursor) pagination for lists ordered newest first.
+
+Instead of ``?page=N`` (an OFFSET plus a ``COUNT(*)`` on every request),
+pages are addressed by a signed, opaque ``cursor`` token holding the
+``(created_at, id)`` of the row the page starts after. Each page costs one
+indexed range query no matter how deep it is. The total is optional and
+comes from a cached count, so it may be a little stale.
+
+    page = paginate_keyset(request, Lead.objects.all(), per_page=25, with_total=True)
+    {% include "crm/pagination.html" with page=page %}
+"""
+
+import hashlib
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+CURSOR_PARAM = "cursor"
+TOKEN_SALT = "crm.pagination"
+
+
+class KeysetPage:
+
+    def __init__(self, object_list, request, next_token=None, previous_token=None, total=None):
+        self.object_list = object_list
+        self.next_token = next_token
+        self.previous_token = previous_token
+        self.total = total
+        self._query = request.GET.copy()
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    @property
+    def has_next(self):
+        return self.next_token is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_token is not None
+
+    def _querystring(self, token):
+        query = self._query.copy()
+        query[CURSOR_PARAM] = token
+        query.pop("page", None)
+        return query.urlencode()
+
+    @property
+    def next_query(self):
+        return self._querystring(self.next_token)
+
+    @property
+    def previous_query(self):
+        return self._querystring(self.previous_token)
+
+
+def make_token(obj, direction):
+    return signing.dumps(
+        [obj.created_at.isoformat(), obj.pk, direction], salt=TOKEN_SALT, compress=True
+    )
+
+
+def read_token(token):
+    """Return (created_at, pk, direction), or None for a missing or tampered token."""
+    if not token:
+        return None
+    try:
+        created_at, pk, direction = signing.loads(token, salt=TOKEN_SALT)
+    except (signing.BadSignature, ValueError, TypeError):
+        return None
+
+    created_at = parse_datetime(created_at)
+    if created_at is None or direction not in ("next", "prev"):
+        return None
+    return created_at, pk, direction
+
+
+def estimated_count(queryset, ttl=None):
+    """``queryset.count()``, cached per query for ``PAGINATION_COUNT_TTL`` seconds."""
+    sql, params = queryset.order_by().query.sql_with_params()
+    key = "crm:count:" + hashlib.md5(repr((sql, params)).encode("utf-8")).hexdigest()
+
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, settings.PAGINATION_COUNT_TTL if ttl is None else ttl)
+    return count
+
+
+def paginate_keyset(request, queryset, per_page, with_total=False):
+    """Return the ``KeysetPage`` of ``queryset`` addressed by the request's cursor."""
+    cursor = read_token(request.GET.get(CURSOR_PARAM))
+    total = estimated_count(queryset) if with_total else None
+    newest_first = queryset.order_by("-created_at", "-id")
+
+    if cursor is not None:
+        created_at, pk, direction = cursor
+
+        if direction == "next":
+            rows = list(
+                newest_first.filter(
+                    Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+                )[:per_page + 1]
+            )
+            has_next = len(rows) > per_page
+            rows = rows[:per_page]
+            if rows:
+                return KeysetPage(
+                    rows,
+                    request,
+                    next_token=make_token(rows[-1], "next") if has_next else None,
+                    previous_token=make_token(rows[0], "prev"),
+                    total=total,
+                )
+        else:
+            rows = list(
+                queryset.order_by("created_at", "id").filter(
+                    Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+                )[:per_page + 1]
+            )
+            has_previous = len(rows) > per_page
+            rows = rows[:per_page][::-1]
+            if rows:
+                return KeysetPage(
+                    rows,
+                    request,
+                    next_token=make_token(rows[-1], "next"),
+                    previous_token=make_token(rows[0], "prev") if has_previous else None,
+                    total=total,
+                )
+
+    # First page (or a cursor that no longer points anywhere).
+    rows = list(newest_first[:per_page + 1])
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+    return KeysetPage(
+        rows,
+        request,
+        next_token=make_token(rows[-1], "next") if has_next else None,
+        total=total,
+    )
@@ -0,0 +1,173 @@
+# crm/ratelimit.py
+"""
+Provider-aware send rate limiting.
+
+``RateLimiter`` is a token bucket refilled at ``per_minute`` tokens a minute
+with a hard ``per_day`` cap. When the provider pushes back (421/454, or a
+550 that mentions a quota) the sender calls ``throttled()``: sending pauses
+with exponential backoff and the refill rate is halved, then recovers a
+little with every successful message.
+
+Past the daily cap ``acquire`` raises ``QuotaExceeded`` with the time the
+quota resets, so callers reschedule instead of spending retry attempts.
+Callers that must not block for long (web requests) pass ``max_wait`` and
+get ``RateLimited`` instead of a sleep.
+
+The limiter is per process; run a single mail worker so the daily cap holds.
+"""
+
+import smtplib
+import threading
+import time
+from datetime import datetime, timedelta
+
+from django.utils import timezone
+
+THROTTLE_CODES = {421, 454}
+QUOTA_WORDS = ("quota", "rate limit", "limit exceeded", "too many", "5.4.5", "4.7.0")
+
+
+class QuotaExceeded(Exception):
+    """The daily cap is used up; sending may resume at ``retry_at``."""
+
+    def __init__(self, message, retry_at=None):
+        super().__init__(message)
+        self.retry_at = retry_at
+
+
+class RateLimited(Exception):
+    """Sending would have to wait ``wait`` seconds, longer than the caller allows."""
+
+    def __init__(self, wait):
+        super().__init__(f"Sending is held back by the rate limit for {wait:.0f}s.")
+        self.wait = wait
+
+
+def next_quota_window():
+    """Start of the next local day, when the daily quota resets."""
+    tomorrow = timezone.localdate() + timedelta(days=1)
+    return timezone.make_aware(datetime.combine(tomorrow, datetime.min.time()))
+
+
+def smtp_error_details(exc):
+    """Return (code, message) for an SMTP exception, or (None, str(exc))."""
+    if isinstance(exc, smtplib.SMTPRecipientsRefused) and exc.recipients:
+        code, message = next(iter(exc.recipients.values()))
+    else:
+        code = getattr(exc, "smtp_code", None)
+        message = getattr(exc, "smtp_error", None) or str(exc)
+
+    if isinstance(message, bytes):
+        message = message.decode("utf-8", "replace")
+    return code, message
+
+
+def classify_error(exc):
+    """
+    Return (retryable, throttle) for a failed send.
+
+    ``throttle`` means the provider is rate limiting us; ``retryable``
+    means the same message may succeed later (4xx, quota, dropped link).
+    Other 5xx answers such as unknown mailboxes are permanent.
+    """
+    code, message = smtp_error_details(exc)
+    message = message.lower()
+
+    if code in THROTTLE_CODES or (code == 550 and any(w in message for w in QUOTA_WORDS)):
+        return True, True
+    if code is not None:
+        return 400 <= code < 500, False
+    return isinstance(exc, (smtplib.SMTPServerDisconnected, OSError)), False
+
+
+class RateLimiter:
+
+    def __init__(
+        self,
+        per_minute,
+        per_day=0,
+        used_today=0,
+        initial_backoff=30,
+        max_backoff=15 * 60,
+        clock=time.monotonic,
+        sleep=time.sleep,
+        today=timezone.localdate,
+    ):
+        self.per_minute = per_minute
+        self.per_day = per_day
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+
+        self._clock = clock
+        self._sleep = sleep
+        self._today = today
+        self._lock = threading.Lock()
+
+        self.tokens = float(per_minute)
+        self.scale = 1.0
+        self.backoff = 0
+        self.paused_until = 0.0
+        self.day = today()
+        self.used_today = used_today
+        self._last_refill = clock()
+
+    @property
+    def rate(self):
+        """Current refill rate in tokens per second."""
+        return self.per_minute * self.scale / 60.0
+
+    def acquire(self, max_wait=None):
+        """
+        Block until one message may be sent; raise ``QuotaExceeded`` past the
+        daily cap, and ``RateLimited`` if that takes over ``max_wait`` seconds.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                today = self._today()
+                if today != self.day:
+                    self.day = today
+                    self.used_today = 0
+
+                if self.per_day and self.used_today >= self.per_day:
+                    raise QuotaExceeded(
+                        f"Daily sending quota of {self.per_day} reached.",
+                        retry_at=next_quota_window(),
+                    )
+
+                # Nothing accrues while paused, so a pause does not end in a burst.
+                now = self._clock()
+                refill_from = max(self._last_refill, self.paused_until)
+                if now > refill_from:
+                    self.tokens = min(
+                        float(self.per_minute),
+                        self.tokens + (now - refill_from) * self.rate,
+                    )
+                self._last_refill = now
+
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    self.used_today += 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate
+
+            if max_wait is not None and waited + wait > max_wait:
+                raise RateLimited(wait)
+            self._sleep(wait)
+            waited += wait
+
+    def throttled(self):
+        """The provider pushed back: pause, and halve the sending rate."""
+        with self._lock:
+            self.backoff = min(self.max_backoff, self.backoff * 2 or self.initial_backoff)
+            self.paused_until = self._clock() + self.backoff
+            self.scale = max(0.1, self.scale / 2)
+            self.tokens = 0.0
+
+    def succeeded(self):
+        with self._lock:
+            self.backoff = 0
+            self.scale = min(1.0, self.scale + 0.05)
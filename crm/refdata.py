@@ -0,0 +1,129 @@
+# crm/refdata.py
+"""
+In-process cache of reference data: ``Country``, ``Tag`` and ``SiteConfig``.
+
+These tables are small and rarely change, but forms, list filters and the
+lead webhook read them on every request. Each process keeps a copy of
+every table it has read, stamped with a version kept in the shared cache;
+the signals in ``crm/signals.py`` bump the version when a row changes, and
+every process reloads the table on its next read. A copy is also reloaded
+once it is ``REFDATA_MAX_AGE`` seconds old, so a change no process
+signalled (a queryset update, a cache that is not shared after all) is
+picked up all the same.
+
+A table read inside a transaction is only kept once that transaction
+commits, so rows it created and then rolled back can never be served.
+"""
+
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from .models import SiteConfig
+
+VERSION_KEY = "crm:refdata:version"
+
+_tables = {}  # model label -> (version, loaded at, data)
+_lock = threading.Lock()
+
+
+def data_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_version():
+    cache.set(VERSION_KEY, time.time_ns(), None)
+
+
+def bump_version_on_commit():
+    transaction.on_commit(bump_version)
+
+
+def clear():
+    """Drop this process's copies (they are reloaded on the next read)."""
+    with _lock:
+        _tables.clear()
+
+
+def _table(key, load):
+    version = data_version()
+    now = time.monotonic()
+    with _lock:
+        entry = _tables.get(key)
+    if entry is not None and entry[0] == version and now - entry[1] < settings.REFDATA_MAX_AGE:
+        return entry[2]
+
+    data = load()
+
+    def keep():
+        with _lock:
+            _tables[key] = (version, now, data)
+
+    if connection.in_atomic_block:
+        transaction.on_commit(keep)
+    else:
+        keep()
+    return data
+
+
+# -------------------------------------------------------
+# COUNTRIES AND TAGS
+# -------------------------------------------------------
+
+def _named(model):
+    def load():
+        rows = list(model.objects.order_by("name"))
+        return {
+            "rows": rows,
+            "by_id": {row.pk: row for row in rows},
+            "ids": {row.name: row.pk for row in rows},
+        }
+
+    return _table(model._meta.label, load)
+
+
+def rows(model):
+    """All ``model`` rows ordered by name. Shared between requests: read only."""
+    return _named(model)["rows"]
+
+
+def get(model, pk):
+    """The cached ``model`` row with this primary key, or None."""
+    return _named(model)["by_id"].get(pk)
+
+
+def ids(model, names):
+    """Map each of ``names`` to the id of its ``model`` row, creating missing rows."""
+    if not names:
+        return {}
+    known = _named(model)["ids"]
+    found = {name: known[name] for name in names if name in known}
+    missing = [name for name in names if name not in known]
+    if missing:
+        model.objects.bulk_create([model(name=name) for name in missing], ignore_conflicts=True)
+        found.update(model.objects.filter(name__in=missing).values_list("name", "id"))
+        bump_version_on_commit()
+    return found
+
+
+def get_or_create_id(model, name):
+    return ids(model, [name])[name]
+
+
+# -------------------------------------------------------
+# SITE CONFIG
+# -------------------------------------------------------
+
+def site_config():
+    """``SiteConfig`` as a ``{key: value}`` dict."""
+    return _table(
+        SiteConfig._meta.label,
+        lambda: dict(SiteConfig.objects.values_list("key", "value")),
+    )
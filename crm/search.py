@@ -0,0 +1,173 @@
+# crm/search.py
+"""
+Student search backed by an SQLite FTS5 table with the trigram tokenizer.
+
+``crm_student_fts`` holds one row per student (rowid = student id) with the
+searchable text columns. It is kept in sync by the ``Student`` signals in
+``crm/signals.py``; code that writes students with ``bulk_create`` or
+``update()`` must call ``index_students`` itself. ``rebuild_search_index``
+repopulates it from scratch.
+
+Trigram matching needs at least three characters, so shorter terms fall
+back to ``icontains``, as does every search on databases other than SQLite
+and on SQLite builds older than 3.34 (no trigram tokenizer), where the
+table is never created.
+"""
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Student
+
+FTS_TABLE = "crm_student_fts"
+FTS_COLUMNS = ("first_name", "last_name", "email", "phone", "passport_number", "course")
+
+# Columns searched by each screen.
+STUDENT_SEARCH_COLUMNS = ("first_name", "last_name", "email", "phone", "passport_number")
+APPLICATION_SEARCH_COLUMNS = ("first_name", "last_name", "course")
+
+MIN_TRIGRAM_LENGTH = 3
+
+# The first SQLite release whose FTS5 has the trigram tokenizer.
+TRIGRAM_MIN_SQLITE = (3, 34, 0)
+
+
+# -------------------------------------------------------
+# SCHEMA
+# -------------------------------------------------------
+
+def create_index_sql():
+    columns = ", ".join(FTS_COLUMNS)
+    return f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5({columns}, tokenize='trigram')"
+
+
+def trigram_supported(using=connection):
+    return using.vendor == "sqlite" and using.Database.sqlite_version_info >= TRIGRAM_MIN_SQLITE
+
+
+_available = set()
+
+
+def index_available(using=connection):
+    """Whether the FTS table exists (positive answers are cached per alias)."""
+    if using.alias in _available:
+        return True
+    if using.vendor == "sqlite" and FTS_TABLE in using.introspection.table_names():
+        _available.add(using.alias)
+        return True
+    return False
+
+
+def _insert_sql():
+    return (
+        f"INSERT INTO {FTS_TABLE} (rowid, {', '.join(FTS_COLUMNS)}) "
+        f"VALUES ({', '.join(['%s'] * (len(FTS_COLUMNS) + 1))})"
+    )
+
+
+def _delete_sql(count):
+    return f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({', '.join(['%s'] * count)})"
+
+
+# -------------------------------------------------------
+# SYNC
+# -------------------------------------------------------
+
+def _row(values):
+    return [values["id"]] + [values.get(col) or "" for col in FTS_COLUMNS]
+
+
+def index_students(student_ids):
+    """(Re)index the given students; ids that no longer exist are removed."""
+    if not index_available():
+        return
+
+    student_ids = list(student_ids)
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(student_ids), 500):
+            chunk = student_ids[start:start + 500]
+            cursor.execute(_delete_sql(len(chunk)), chunk)
+            rows = Student.objects.filter(pk__in=chunk).values("id", *FTS_COLUMNS)
+            cursor.executemany(_insert_sql(), [_row(r) for r in rows])
+
+
+def unindex_students(student_ids):
+    if not index_available():
+        return
+
+    student_ids = list(student_ids)
+    with connection.cursor() as cursor:
+        for start in range(0, len(student_ids), 500):
+            chunk = student_ids[start:start + 500]
+            cursor.execute(_delete_sql(len(chunk)), chunk)
+
+
+def rebuild_index(chunk_size=5000):
+    """Drop every indexed row and re-index all students. Returns the row count."""
+    with connection.cursor() as cursor:
+        cursor.execute(create_index_sql())
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+
+        count = 0
+        batch = []
+        insert = _insert_sql()
+        rows = Student.objects.order_by().values("id", *FTS_COLUMNS)
+        for values in rows.iterator(chunk_size=chunk_size):
+            batch.append(_row(values))
+            if len(batch) >= chunk_size:
+                cursor.executemany(insert, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            cursor.executemany(insert, batch)
+            count += len(batch)
+
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+
+    return count
+
+
+# -------------------------------------------------------
+# QUERY
+# -------------------------------------------------------
+
+def _phrase(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+def match_expression(terms, columns):
+    column_filter = "{" + " ".join(columns) + "}"
+    return " AND ".join(f"{column_filter} : {_phrase(t)}" for t in terms)
+
+
+def search_students(queryset, q, columns=STUDENT_SEARCH_COLUMNS):
+    """
+    Filter a ``Student`` queryset to rows where every whitespace-separated
+    term of ``q`` appears (case-insensitively) in one of ``columns``.
+    """
+    terms = q.split()
+    if not terms:
+        return queryset
+
+    indexed = [t for t in terms if len(t) >= MIN_TRIGRAM_LENGTH]
+    short = [t for t in terms if len(t) < MIN_TRIGRAM_LENGTH]
+
+    if indexed and index_available():
+        queryset = queryset.filter(
+            id__in=RawSQL(
+                f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s",
+                [match_expression(indexed, columns)],
+            )
+        )
+    else:
+        short = terms
+
+    for term in short:
+        condition = Q()
+        for column in columns:
+            condition |= Q(**{f"{column}__icontains": term})
+        queryset = queryset.filter(condition)
+
+    return queryset
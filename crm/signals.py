@@ -0,0 +1,175 @@
+# crm/signals.py
+import os
+
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
+
+from .assignment import invalidate_roster
+from .blobstore import release, retain
+from .caching import bump_data_version_on_commit
+from .images import make_all_on_commit
+from .metrics import LEAD_FIELDS, STUDENT_FIELDS, bump, lead_bucket, move, student_bucket
+from .models import Country, Lead, SiteConfig, Student, StudentDocument, Tag
+from .refdata import bump_version_on_commit
+from .search import FTS_COLUMNS, index_students, unindex_students
+
+
+# -------------------------------------------------------
+# SEARCH INDEX
+# -------------------------------------------------------
+
+@receiver(post_save, sender=Student)
+def student_saved(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and not set(update_fields) & set(FTS_COLUMNS):
+        return
+    index_students([instance.pk])
+
+
+@receiver(post_delete, sender=Student)
+def student_deleted(sender, instance, **kwargs):
+    unindex_students([instance.pk])
+
+
+# -------------------------------------------------------
+# DAILY METRICS
+# -------------------------------------------------------
+
+# model -> (bucket function, fields it reads, model fields that can move a row)
+METRIC_SOURCES = {
+    Student: (student_bucket, STUDENT_FIELDS, {"created_at", "country", "application_status"}),
+    Lead: (lead_bucket, LEAD_FIELDS, {"created_at", "source"}),
+}
+
+
+def _bucket(sender, instance):
+    bucket, fields, _ = METRIC_SOURCES[sender]
+    return bucket(*(getattr(instance, f) for f in fields))
+
+
+@receiver(pre_save, sender=Student)
+@receiver(pre_save, sender=Lead)
+def metrics_remember_bucket(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Remember which bucket an existing row counted in before it changes."""
+    bucket, fields, tracked = METRIC_SOURCES[sender]
+    if raw or instance._state.adding or instance.pk is None:
+        return
+    if update_fields is not None and not set(update_fields) & tracked:
+        return
+
+    old = sender.objects.filter(pk=instance.pk).values(*fields).first()
+    if old is not None:
+        instance._metrics_bucket = bucket(*(old[f] for f in fields))
+
+
+@receiver(post_save, sender=Student)
+@receiver(post_save, sender=Lead)
+def metrics_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        bump(_bucket(sender, instance), 1)
+        return
+
+    old = instance.__dict__.pop("_metrics_bucket", None)
+    if old is not None:
+        move(old, _bucket(sender, instance))
+
+
+@receiver(post_delete, sender=Student)
+@receiver(post_delete, sender=Lead)
+def metrics_deleted(sender, instance, **kwargs):
+    bump(_bucket(sender, instance), -1)
+
+
+# -------------------------------------------------------
+# DASHBOARD CACHE
+# -------------------------------------------------------
+
+@receiver(post_save, sender=Student)
+@receiver(post_save, sender=Lead)
+@receiver(post_save, sender=Country)
+@receiver(post_delete, sender=Student)
+@receiver(post_delete, sender=Lead)
+@receiver(post_delete, sender=Country)
+def dashboard_data_changed(sender, **kwargs):
+    bump_data_version_on_commit()
+
+
+# -------------------------------------------------------
+# REFERENCE DATA
+# -------------------------------------------------------
+
+@receiver(post_save, sender=Country)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=SiteConfig)
+@receiver(post_delete, sender=Country)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=SiteConfig)
+def reference_data_changed(sender, **kwargs):
+    bump_version_on_commit()
+
+
+# -------------------------------------------------------
+# COUNSELOR ROSTER
+# -------------------------------------------------------
+
+@receiver(post_save, sender=get_user_model())
+def counselor_saved(sender, instance, update_fields=None, **kwargs):
+    # Logins only touch last_login.
+    if update_fields is not None and set(update_fields) <= {"last_login"}:
+        return
+    invalidate_roster()
+
+
+@receiver(post_delete, sender=get_user_model())
+def counselor_deleted(sender, **kwargs):
+    invalidate_roster()
+
+
+# -------------------------------------------------------
+# DOCUMENT BLOBS
+# -------------------------------------------------------
+
+@receiver(post_init, sender=StudentDocument)
+def document_loaded(sender, instance, **kwargs):
+    # The raw value: going through instance.file would load a deferred field.
+    value = instance.__dict__.get("file")
+    instance._stored_file = getattr(value, "name", value) or None
+
+
+@receiver(pre_save, sender=StudentDocument)
+def document_uploading(sender, instance, raw=False, **kwargs):
+    # Before the storage renames the upload after its content hash.
+    if not raw and instance.file and not instance.file._committed and not instance.original_name:
+        instance.original_name = os.path.basename(instance.file.name)
+
+
+@receiver(post_save, sender=StudentDocument)
+def document_saved(sender, instance, created, raw=False, **kwargs):
+    if raw or "file" not in instance.__dict__:
+        return
+    name = instance.file.name or None
+    old = None if created else instance._stored_file
+    if name != old:
+        retain(name)
+        release(old)
+        make_all_on_commit(name)
+    instance._stored_file = name
+
+
+@receiver(post_delete, sender=StudentDocument)
+def document_deleted(sender, instance, **kwargs):
+    release(instance._stored_file)
+
+
+# -------------------------------------------------------
+# IMAGE DERIVATIVES
+# -------------------------------------------------------
+
+@receiver(post_save, sender=Student)
+def passport_image_saved(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and "passport_image" not in update_fields):
+        return
+    if instance.passport_image:
+        make_all_on_commit(instance.passport_image.name)
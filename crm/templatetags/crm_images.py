@@ -0,0 +1,18 @@
+from django import template
+
+from crm.images import derivative_url as _derivative_url
+
+register = template.Library()
+
+
+@register.simple_tag
+def derivative_url(file, size="thumb"):
+    """
+    URL of a resized copy of an uploaded image (crm/images.py), or "" when
+    ``file`` is empty or not an image::
+
+        {% load crm_images %}
+        {% derivative_url student.passport_image "preview" as preview %}
+        {% if preview %}<img src="{{ preview }}">{% endif %}
+    """
+    return _derivative_url(getattr(file, "name", file) or "", size)
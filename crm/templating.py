@@ -0,0 +1,239 @@
+# crm/templating.py
+"""
+Merge fields for broadcast emails.
+
+Broadcast subjects and bodies use a small subset of the Django template
+language::
+
+    Hi {{ first_name }},
+    {% if visa_expiry %}Your visa expires on {{ visa_expiry }}.{% endif %}
+    {% if application_status == "approved" %}Congratulations!{% else %}
+    We are still reviewing your {{ course|default:"application" }}.{% endif %}
+
+``compile_template`` parses a text once, validates every field name against
+``MERGE_FIELDS`` and turns it into a single Python expression, so rendering
+thousands of recipients is a dict lookup per field. Recipients are plain
+``Student.objects.values(*template.lookups)`` rows; ``template.context(row)``
+formats them into the merge data that ``EmailLog`` stores.
+"""
+
+import functools
+import hashlib
+import re
+
+
+class TemplateError(ValueError):
+    pass
+
+
+# -------------------------------------------------------
+# FIELDS
+# -------------------------------------------------------
+
+_status_labels = None
+
+
+def _status_label(value):
+    global _status_labels
+
+    if _status_labels is None:
+        from .models import Student
+        _status_labels = dict(Student.APPLICATION_STATUS_CHOICES)
+    return _status_labels.get(value, value or "")
+
+
+def _date(value):
+    return value.strftime("%d %B %Y") if value else ""
+
+
+def _text(value):
+    return "" if value is None else str(value)
+
+
+# field name -> (values() lookups, formatter taking those lookups' values)
+MERGE_FIELDS = {
+    "first_name": (("first_name",), _text),
+    "last_name": (("last_name",), _text),
+    "full_name": (
+        ("first_name", "last_name"),
+        lambda first, last: " ".join(p for p in (first, last) if p),
+    ),
+    "email": (("email",), _text),
+    "phone": (("phone",), _text),
+    "course": (("course",), _text),
+    "country": (("country__name",), _text),
+    "application_status": (("application_status",), _status_label),
+    "visa_type": (("visa_type",), _text),
+    "visa_expiry": (("visa_expiry",), _date),
+    "enrollment_date": (("enrollment_date",), _date),
+}
+
+FILTERS = {
+    "upper": lambda value, arg: value.upper(),
+    "lower": lambda value, arg: value.lower(),
+    "title": lambda value, arg: value.title(),
+    "default": lambda value, arg: value or arg,
+}
+
+
+# -------------------------------------------------------
+# PARSER
+# -------------------------------------------------------
+
+TOKEN_RE = re.compile(r"({{.*?}}|{%.*?%})", re.S)
+VAR_RE = re.compile(r"^\s*(\w+)\s*(?:\|\s*(\w+)\s*(?::\s*\"([^\"]*)\")?\s*)?$")
+IF_RE = re.compile(r"^\s*if\s+(\w+)\s*(?:(==|!=)\s*\"([^\"]*)\")?\s*$")
+
+
+def _normalise(value):
+    """Compare ``approved`` with ``Approved`` and ``under_review`` with ``Under Review``."""
+    return value.replace("_", " ").strip().lower()
+
+
+class _Compiler:
+
+    def __init__(self, text, validate):
+        self.text = text
+        self.validate = validate
+        self.fields = set()
+        self.unknown = set()
+        self.constants = []
+
+    def constant(self, value):
+        self.constants.append(value)
+        return f"_c[{len(self.constants) - 1}]"
+
+    def field(self, name):
+        if name not in MERGE_FIELDS:
+            self.unknown.add(name)
+        self.fields.add(name)
+        return f"_g({name!r}, '')"
+
+    def compile(self):
+        tokens = TOKEN_RE.split(self.text)
+        expr, _ = self.block(tokens, 0, ())
+        if self.validate and self.unknown:
+            raise TemplateError(
+                "Unknown merge field(s): "
+                + ", ".join(sorted(self.unknown))
+                + ". Available: "
+                + ", ".join(MERGE_FIELDS)
+                + "."
+            )
+        return expr
+
+    def block(self, tokens, pos, until):
+        """Compile tokens from ``pos`` up to a tag in ``until``; return (expr, tag)."""
+        parts = []
+        self.pos = pos
+
+        while self.pos < len(tokens):
+            token = tokens[self.pos]
+            self.pos += 1
+
+            if token.startswith("{{") and token.endswith("}}"):
+                parts.append(self.variable(token[2:-2]))
+            elif token.startswith("{%") and token.endswith("%}"):
+                tag = token[2:-2].strip()
+                if tag in until:
+                    return self.join(parts), tag
+                parts.append(self.if_block(tag, tokens))
+            elif token:
+                parts.append(self.constant(token))
+
+        if until:
+            raise TemplateError(f"Missing {{% {until[-1]} %}}.")
+        return self.join(parts), None
+
+    def variable(self, source):
+        match = VAR_RE.match(source)
+        if not match:
+            raise TemplateError(f"Invalid placeholder {{{{{source}}}}}.")
+
+        name, filter_name, arg = match.groups()
+        expr = self.field(name)
+
+        if filter_name:
+            if filter_name not in FILTERS:
+                raise TemplateError(f"Unknown filter '{filter_name}'.")
+            expr = f"_f[{filter_name!r}]({expr}, {self.constant(arg or '')})"
+        return expr
+
+    def if_block(self, tag, tokens):
+        match = IF_RE.match(tag)
+        if not match:
+            raise TemplateError(f"Invalid tag {{% {tag} %}}.")
+
+        name, op, value = match.groups()
+        cond = self.field(name)
+        if op:
+            cond = f"(_n({cond}) {op} {self.constant(_normalise(value))})"
+
+        then_expr, end = self.block(tokens, self.pos, ("else", "endif"))
+        else_expr = "''"
+        if end == "else":
+            else_expr, _ = self.block(tokens, self.pos, ("endif",))
+
+        return f"({then_expr} if {cond} else {else_expr})"
+
+    def join(self, parts):
+        if not parts:
+            return "''"
+        if len(parts) == 1:
+            return parts[0]
+        return "''.join((" + ", ".join(parts) + ",))"
+
+
+class CompiledTemplate:
+
+    def __init__(self, text, validate=True):
+        compiler = _Compiler(text, validate)
+        expr = compiler.compile()
+
+        self.text = text
+        self.fields = frozenset(compiler.fields & set(MERGE_FIELDS))
+        self._render = eval(
+            f"lambda _g: {expr}",
+            {
+                "__builtins__": {},
+                "_c": compiler.constants,
+                "_f": FILTERS,
+                "_n": _normalise,
+            },
+        )
+
+    @property
+    def lookups(self):
+        """The ``values()`` lookups needed to build this template's context."""
+        return sorted({lookup for name in self.fields for lookup in MERGE_FIELDS[name][0]})
+
+    def context(self, row):
+        """Format a ``values()`` row into the merge data for this template."""
+        context = {}
+        for name in self.fields:
+            lookups, formatter = MERGE_FIELDS[name]
+            context[name] = formatter(*(row.get(lookup) for lookup in lookups))
+        return context
+
+    def render(self, context):
+        return self._render((context or {}).get)
+
+
+@functools.lru_cache(maxsize=256)
+def compile_template(text, validate=True):
+    return CompiledTemplate(text, validate=validate)
+
+
+def compile_message(subject, body):
+    """Compile and validate a broadcast subject/body pair."""
+    return compile_template(subject), compile_template(body)
+
+
+def render_merge(text, merge_data):
+    """Render stored template text with an ``EmailLog``'s merge data."""
+    return compile_template(text, validate=False).render(merge_data)
+
+
+def template_hash(subject, body):
+    """Content key used to store one ``EmailTemplate`` per distinct message."""
+    return hashlib.sha256(f"{subject}\0{body}".encode("utf-8")).hexdigest()
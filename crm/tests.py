@@ -1,3 +1,1787 @@
-from django.test import TestCase
+import base64
+import csv
+import email
+import hashlib
+import importlib
+import json
+import os
+import re
+import smtplib
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail import EmailMessage
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.db.models import Sum
+from django.test import (
+    Client,
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .assignment import LeastLoaded, assign_counselors, reset
+from .blobstore import document_storage
+from .broadcast import (
+    STALE_AFTER,
+    Heartbeat,
+    audience_queryset,
+    claim_next_job,
+    create_job,
+    process_job,
+    requeue_job,
+    retry_due_emails,
+)
+from . import attachments, import_pipeline, refdata, search, uploads
+from .contacts import normalise_email, normalise_phone, upsert_student
+from .fake_smtp import FakeSMTPServer
+from .idempotency import TTLCache, recent_leads
+from .import_pipeline import expand_paths
+from .images import derivative_name, derivative_url
+from .importer import normalise
+from .inbox import claim_batch, inbox_stats, process_batch, requeue_dead
+from .leads import ingest_leads
+from .mailer import PooledSender, SendResult, apply_results
+from .metrics import period_summary, rebuild_daily_metrics
+from .models import (
+    ActivityLog,
+    Blob,
+    BroadcastJob,
+    Counter,
+    Country,
+    DailyMetric,
+    EmailLog,
+    Lead,
+    SiteConfig,
+    Student,
+    StudentDocument,
+    Tag,
+    UploadSession,
+    WebhookInbox,
+)
+from .pagination import paginate_keyset
+from .forms import StudentFilterForm, StudentForm
+from .ratelimit import QuotaExceeded, RateLimited, RateLimiter, classify_error
+from .templating import TemplateError, compile_template
+
+
+def smtp_kwargs(server):
+    return {
+        "backend": "django.core.mail.backends.smtp.EmailBackend",
+        "host": server.host,
+        "port": server.port,
+        "use_tls": False,
+        "use_ssl": False,
+        "username": "",
+        "password": "",
+    }
+
+
+def make_messages(count):
+    return [
+        EmailMessage("Hi", "Body", "crm@example.com", [f"s{i}@example.com"])
+        for i in range(count)
+    ]
+
+
+class PooledSenderTests(SimpleTestCase):
+
+    def test_reuses_bounded_connections(self):
+        with FakeSMTPServer() as server:
+            sender = PooledSender(pool_size=3, batch_size=5, **smtp_kwargs(server))
+            results = sender.send_messages(make_messages(40))
+            sender.close()
+
+        self.assertEqual([r.ok for r in results], [True] * 40)
+        self.assertEqual(len(server.messages), 40)
+        self.assertLessEqual(server.connections, 3)
+
+    def test_reports_per_message_failures_and_reconnects(self):
+        with FakeSMTPServer() as server:
+            server.refuse.add("s1@example.com")
+            server.drop_once.add("s3@example.com")
+
+            sender = PooledSender(pool_size=1, batch_size=10, **smtp_kwargs(server))
+            results = sender.send_messages(make_messages(6))
+            sender.close()
+
+        self.assertEqual([r.ok for r in results], [True, False, True, True, True, True])
+        self.assertIn("Mailbox unavailable", results[1].error)
+        self.assertFalse(results[1].retryable)
+        self.assertEqual(len(server.messages), 5)
+        self.assertEqual(server.connections, 2)
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class RateLimiterTests(SimpleTestCase):
+
+    def make_limiter(self, **kwargs):
+        clock = FakeClock()
+        limiter = RateLimiter(clock=clock, sleep=clock.sleep, today=lambda: "day", **kwargs)
+        return limiter, clock
+
+    def test_refills_at_per_minute_rate(self):
+        limiter, clock = self.make_limiter(per_minute=60)
+        for _ in range(61):
+            limiter.acquire()
+        self.assertAlmostEqual(clock.now, 1.0)
+
+    def test_daily_quota(self):
+        limiter, _ = self.make_limiter(per_minute=60, per_day=3, used_today=2)
+        limiter.acquire()
+        with self.assertRaises(QuotaExceeded):
+            limiter.acquire()
+
+    def test_throttle_pauses_and_slows_down(self):
+        limiter, clock = self.make_limiter(per_minute=60, initial_backoff=30)
+        limiter.throttled()
+        limiter.acquire()
+        self.assertAlmostEqual(clock.now, 32.0)
+        self.assertEqual(limiter.scale, 0.5)
+
+    def test_quota_and_long_waits_are_reported_instead_of_slept(self):
+        limiter, clock = self.make_limiter(per_minute=60, per_day=1, initial_backoff=600)
+        limiter.acquire()
+        with self.assertRaises(QuotaExceeded) as quota:
+            limiter.acquire()
+        self.assertGreater(quota.exception.retry_at, timezone.now())
+
+        limiter, clock = self.make_limiter(per_minute=60, initial_backoff=600)
+        limiter.throttled()
+        with self.assertRaises(RateLimited) as limited:
+            limiter.acquire(max_wait=5)
+        self.assertAlmostEqual(limited.exception.wait, 600)
+        self.assertEqual(clock.now, 0.0)
+
+    def test_held_back_messages_keep_their_attempts(self):
+        clock = FakeClock()
+        limiter = RateLimiter(per_minute=60, clock=clock, sleep=clock.sleep, initial_backoff=900)
+        limiter.throttled()
+        with FakeSMTPServer() as server:
+            sender = PooledSender(pool_size=1, limiter=limiter, **smtp_kwargs(server))
+            [result] = sender.send_messages(make_messages(1), max_wait=5)
+            sender.close()
+        self.assertEqual(server.messages, [])
+        self.assertTrue(result.retryable and result.retry_at > timezone.now())
+
+        log = EmailLog(attempts=settings.EMAIL_MAX_ATTEMPTS)
+        apply_results([log], [result])
+        self.assertEqual(log.next_retry_at, result.retry_at)
+        self.assertEqual(log.attempts, settings.EMAIL_MAX_ATTEMPTS - 1)
+
+    def test_classifies_provider_errors(self):
+        quota = smtplib.SMTPSenderRefused(550, b"5.4.5 Daily user sending quota exceeded.", "a@b.c")
+        unknown = smtplib.SMTPRecipientsRefused({"x@y.z": (550, b"5.1.1 No such user")})
+        busy = smtplib.SMTPDataError(421, b"Service not available")
+
+        self.assertEqual(classify_error(quota), (True, True))
+        self.assertEqual(classify_error(busy), (True, True))
+        self.assertEqual(classify_error(unknown), (False, False))
+
+
+class RecordingSender:
+    """Stands in for ``PooledSender``; raises on call number ``fail_on``."""
+
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.calls = 0
+        self.sent = []
+
+    def send_messages(self, messages):
+        self.calls += 1
+        if self.calls == self.fail_on:
+            raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+        self.sent.extend(message.to[0] for message in messages)
+        return [SendResult(True, "", False) for _ in messages]
+
+
+class BroadcastJobTests(TestCase):
+
+    def setUp(self):
+        for i in range(5):
+            Student.objects.create(first_name=f"S{i}", email=f"s{i}@example.com")
+
+    def make_job(self, subject="News"):
+        return create_job(subject, "Hi {{ first_name }}", audience_queryset("all"))
+
+    def test_claims_each_job_once_and_reclaims_stale_ones(self):
+        first, second = self.make_job("First"), self.make_job("Second")
+
+        claimed = claim_next_job()
+        self.assertEqual((claimed.pk, claimed.status), (first.pk, "running"))
+        started_at = claimed.started_at
+        self.assertEqual(claim_next_job().pk, second.pk)
+        self.assertIsNone(claim_next_job())
+
+        # The first worker stopped checking in.
+        BroadcastJob.objects.filter(pk=first.pk).update(
+            heartbeat_at=timezone.now() - STALE_AFTER - timedelta(seconds=1)
+        )
+        reclaimed = claim_next_job()
+        self.assertEqual(reclaimed.pk, first.pk)
+        self.assertEqual(reclaimed.started_at, started_at)
+        self.assertIsNone(claim_next_job())
+
+    def test_checkpoints_chunks_and_resumes_after_a_failure(self):
+        job = self.make_job()
+        broken = RecordingSender(fail_on=2)
+        job = process_job(claim_next_job(), chunk_size=2, sender=broken)
+
+        self.assertEqual((job.status, job.cursor, job.sent_count), ("failed", 2, 2))
+        self.assertIn("unexpectedly closed", job.last_error)
+        self.assertEqual(EmailLog.objects.filter(broadcast=job).count(), 2)
+
+        requeue_job(job)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.cursor, job.last_error), ("queued", 2, ""))
+
+        working = RecordingSender()
+        job = process_job(claim_next_job(), chunk_size=2, sender=working)
+        self.assertEqual((job.status, job.cursor, job.sent_count), ("completed", 5, 5))
+        self.assertEqual(working.calls, 2)
+        self.assertEqual(
+            sorted(broken.sent + working.sent), [f"s{i}@example.com" for i in range(5)]
+        )
+        logs = EmailLog.objects.filter(broadcast=job)
+        self.assertEqual(logs.count(), 5)
+        self.assertEqual(logs.get(to_email="s3@example.com").rendered_body, "Hi S3")
+
+    def test_quota_reschedules_rows_without_using_up_attempts(self):
+        tomorrow = timezone.now() + timedelta(hours=8)
+
+        class QuotaSender:
+            def send_messages(self, messages):
+                return [SendResult(False, "Daily sending quota reached.", True, tomorrow)] * len(messages)
+
+        self.make_job()
+        job = process_job(claim_next_job(), sender=QuotaSender())
+        self.assertEqual((job.status, job.failed_count), ("completed", 5))
+        logs = EmailLog.objects.filter(broadcast=job)
+        self.assertEqual(set(logs.values_list("attempts", "next_retry_at")), {(0, tomorrow)})
+
+        for _ in range(settings.EMAIL_MAX_ATTEMPTS + 1):
+            logs.update(next_retry_at=timezone.now())
+            retry_due_emails(sender=QuotaSender())
+        self.assertEqual(set(logs.values_list("attempts", "next_retry_at")), {(0, tomorrow)})
+
+
+class BroadcastHeartbeatTests(TransactionTestCase):
+
+    def test_running_job_keeps_checking_in_while_a_chunk_is_slow(self):
+        stale = timezone.now() - STALE_AFTER - timedelta(seconds=1)
+        job = BroadcastJob.objects.create(subject="S", body="B", status="running", heartbeat_at=stale)
+
+        with Heartbeat(job.pk, interval=timedelta(seconds=0.05)):
+            time.sleep(0.3)  # a chunk held up by the rate limiter
+        self.assertIsNone(claim_next_job())
+        job.refresh_from_db()
+        self.assertGreater(job.heartbeat_at, stale + STALE_AFTER)
+
+
+class MergeTemplateTests(SimpleTestCase):
+
+    def test_renders_fields_filters_and_conditionals(self):
+        template = compile_template(
+            'Hi {{ first_name }}, {{ course|default:"your course" }}'
+            '{% if application_status == "under_review" %} is under review{% else %}!{% endif %}'
+        )
+        self.assertEqual(template.lookups, ["application_status", "course", "first_name"])
+
+        row = {"first_name": "Ali", "course": None, "application_status": "under_review"}
+        self.assertEqual(
+            template.render(template.context(row)),
+            "Hi Ali, your course is under review",
+        )
+
+    def test_rejects_unknown_fields_and_bad_tags(self):
+        for text in ("{{ nickname }}", "{% if course %}open", "{{ course|reverse }}"):
+            with self.assertRaises(TemplateError):
+                compile_template(text)
+
+
+class EmailLogCompactionTests(TestCase):
+
+    def setUp(self):
+        self.ali = Student.objects.create(first_name="Ali", email="ali@example.com")
+        self.sara = Student.objects.create(first_name="Sara", email="sara@example.com")
+
+    def log(self, student, subject, body):
+        return EmailLog.objects.create(
+            student=student, to_email=student.email, from_email="crm@example.com",
+            subject=subject, body=body,
+        )
+
+    def texts(self):
+        return {
+            log.pk: (log.rendered_subject, log.rendered_body)
+            for log in EmailLog.objects.select_related("template")
+        }
+
+    def test_migration_round_trip_keeps_every_rendered_email(self):
+        migration = importlib.import_module("crm.migrations.0010_compact_emaillog")
+        for student in (self.ali, self.sara, self.ali):
+            self.log(student, "Intake news", f"Hi {student.first_name}, the intake is open.")
+        self.log(self.sara, "Braces", "Use {% if %} literally, Sara.")
+        self.log(self.sara, "Braces", "Use {% if %} literally, Sara.")
+        self.log(self.ali, "One-off", "Only once, Ali.")
+        before = self.texts()
+
+        migration.compact(django_apps, None)
+        self.assertEqual(self.texts(), before)
+        compacted = EmailLog.objects.filter(template__isnull=False)
+        self.assertEqual(compacted.count(), 3)
+        self.assertEqual(
+            compacted.values("template__body").distinct().get()["template__body"],
+            "Hi {{ first_name }}, the intake is open.",
+        )
+        self.assertEqual(EmailLog.objects.get(subject="One-off").body, "Only once, Ali.")
+
+        migration.expand(django_apps, None)
+        self.assertFalse(EmailLog.objects.filter(template__isnull=False).exists())
+        self.assertEqual(
+            {log.pk: (log.subject, log.body) for log in EmailLog.objects.all()}, before
+        )
+
+        out = StringIO()
+        call_command("compact_email_logs", stdout=out)
+        self.assertIn("Compacted 3 of 6 email logs", out.getvalue())
+        self.assertEqual(self.texts(), before)
+
+
+@skipUnless(search.trigram_supported(), "needs SQLite 3.34+ (FTS5 trigram tokenizer)")
+class SearchIndexTests(TestCase):
+
+    def indexed(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT rowid, first_name FROM {search.FTS_TABLE} ORDER BY rowid")
+            return cursor.fetchall()
+
+    def found(self, q, columns=search.STUDENT_SEARCH_COLUMNS):
+        return list(
+            search.search_students(Student.objects.all(), q, columns).values_list("first_name", flat=True)
+        )
+
+    def test_index_follows_saves_and_deletes(self):
+        student = Student.objects.create(first_name="Zainab", last_name="Qureshi", course="Nursing")
+        self.assertEqual(self.indexed(), [(student.pk, "Zainab")])
+        self.assertEqual(self.found("AINA qures"), ["Zainab"])
+
+        student.first_name = "Mariam"
+        student.save()
+        self.assertEqual(self.found("ainab"), [])
+        self.assertEqual(self.found("riam"), ["Mariam"])
+
+        student.notes = "called back"
+        student.save(update_fields=["notes"])
+        self.assertEqual(self.indexed(), [(student.pk, "Mariam")])
+
+        student.delete()
+        self.assertEqual(self.indexed(), [])
+
+    def test_bulk_ingested_students_are_indexed(self):
+        ingest_leads(
+            [
+                {"full_name": "Farhan Akhtar", "phone": "03001234567", "course": "Data Science"},
+                {"full_name": "Hina Baig", "email": "hina@example.com", "course": "Law"},
+            ]
+        )
+        self.assertEqual([name for _, name in self.indexed()], ["Farhan", "Hina"])
+        self.assertEqual(self.found("scien", search.APPLICATION_SEARCH_COLUMNS), ["Farhan"])
+        self.assertEqual(self.found("scien"), [])  # course is not a students-list column
+
+    def test_list_pages_and_admin_search_through_the_index(self):
+        Student.objects.create(first_name="Zainab", email="zainab@example.com")
+        Student.objects.create(first_name="Bilal", course="Zoology")
+        self.client.force_login(get_user_model().objects.create_superuser("admin", "a@example.com", "pw"))
+
+        page = self.client.get(reverse("students_list"), {"q": "zain"})
+        self.assertEqual([s.first_name for s in page.context["students"]], ["Zainab"])
+
+        page = self.client.get(reverse("applications_list"), {"q": "zool"})
+        self.assertEqual([s.first_name for s in page.context["applications"]], ["Bilal"])
+
+        page = self.client.get(reverse("admin:crm_student_changelist"), {"q": "example.com"})
+        self.assertEqual([s.first_name for s in page.context["cl"].result_list], ["Zainab"])
+
+    def test_short_terms_and_missing_index_fall_back_to_like(self):
+        Student.objects.create(first_name="Al", last_name="Noor")
+        self.assertEqual(self.found("al noo"), ["Al"])
+
+        with mock.patch("crm.search.index_available", return_value=False):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.found("noor"), ["Al"])
+        self.assertNotIn(search.FTS_TABLE, queries[0]["sql"])
+        self.assertIn("LIKE", queries[0]["sql"])
+
+    def test_old_sqlite_gets_no_index(self):
+        old = mock.Mock(vendor="sqlite", Database=mock.Mock(sqlite_version_info=(3, 31, 1)))
+        self.assertFalse(search.trigram_supported(old))
+
+        migration = importlib.import_module("crm.migrations.0012_student_search_index")
+        schema_editor = mock.Mock(connection=old)
+        migration.create_index(django_apps, schema_editor)
+        schema_editor.execute.assert_not_called()
+
+
+class KeysetPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Lead.objects.bulk_create(
+            [Lead(source="facebook" if i % 2 else "manual", payload={}) for i in range(23)]
+        )
+        # Several rows share a timestamp, so the id tie-breaker matters.
+        Lead.objects.filter(id__lte=Lead.objects.order_by("id")[10].id).update(
+            created_at=Lead.objects.order_by("id")[0].created_at
+        )
+
+    def page(self, query=""):
+        request = RequestFactory().get("/leads/?" + query)
+        return paginate_keyset(request, Lead.objects.all(), per_page=5, with_total=True)
+
+    def test_walks_every_row_forwards_and_back(self):
+        expected = list(Lead.objects.order_by("-created_at", "-id").values_list("id", flat=True))
+
+        pages = [self.page()]
+        while pages[-1].has_next:
+            pages.append(self.page(pages[-1].next_query))
+        self.assertEqual([lead.id for page in pages for lead in page], expected)
+        self.assertFalse(pages[0].has_previous)
+        self.assertEqual(pages[0].total, 23)
+
+        back = self.page(pages[-1].previous_query)
+        self.assertEqual([lead.id for lead in back], [lead.id for lead in pages[-2]])
+        first = self.page(pages[1].previous_query)
+        self.assertEqual([lead.id for lead in first], expected[:5])
+        self.assertFalse(first.has_previous)
+
+    def test_keeps_filters_and_ignores_bad_tokens(self):
+        page = self.page("q=smith&page=3")
+        self.assertIn("q=smith", page.next_query)
+        self.assertNotIn("page=", page.next_query)
+
+        tampered = self.page("cursor=" + page.next_token[:-2] + "xx")
+        self.assertEqual([lead.id for lead in tampered], [lead.id for lead in page])
+
+
+class ApplicationsListQueryTests(TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        media = override_settings(MEDIA_ROOT=tmp.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.country = Country.objects.create(name="Nepal")
+
+    def add_applications(self, count):
+        for i in range(count):
+            student = Student.objects.create(
+                first_name=f"Student{i}", last_name="Test", country=self.country
+            )
+            for n in range(2):
+                StudentDocument.objects.create(
+                    student=student, file=ContentFile(b"x", name=f"doc{n}.pdf")
+                )
+
+    def queries_for_page(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("applications_list"))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response
+
+    def test_query_count_does_not_grow_with_rows(self):
+        self.add_applications(2)
+        few, response = self.queries_for_page()
+        self.assertContains(response, "Documents (2 documents)")
+
+        self.add_applications(18)
+        many, response = self.queries_for_page()
+        self.assertEqual(len(response.context["applications"]), 20)
+        self.assertEqual(response.context["total_apps"], 20)
+        self.assertEqual(few, many)
+
+
+@override_settings(EXPORT_CHUNK_SIZE=2)
+class ExportTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_superuser("admin", "admin@example.com", "pw")
+        self.client.force_login(self.user)
+        nepal = Country.objects.create(name="Nepal")
+        india = Country.objects.create(name="India")
+        for i in range(5):
+            Student.objects.create(
+                first_name=f"Ali{i}", last_name="Khan", email=f"ali{i}@example.com",
+                country=nepal, application_status="approved" if i % 2 else "pending",
+            )
+        Student.objects.create(first_name="Sara", country=india)
+        Student.objects.create(first_name="Gone", country=nepal, archived=True)
+
+    def download(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        with CaptureQueriesContext(connection) as queries:
+            content = b"".join(response.streaming_content)
+        return response, content, len(queries)
+
+    def test_csv_export_of_the_current_students_filter(self):
+        url = reverse("students_list") + "?country={}&archived=0&cursor=x".format(
+            Country.objects.get(name="Nepal").pk
+        )
+        page = self.client.get(url)
+        self.assertContains(page, "export=csv")
+        self.assertNotIn("cursor=", page.context["export_query"])
+
+        response, content, queries = self.download(url + "&export=csv")
+        self.assertIn(".csv", response["Content-Disposition"])
+        self.assertTrue(content.startswith("\ufeff".encode()))
+        rows = list(csv.DictReader(StringIO(content.decode("utf-8-sig"))))
+        self.assertEqual([row["first_name"] for row in rows], [f"Ali{i}" for i in range(5)])
+        self.assertEqual({row["country"] for row in rows}, {"Nepal"})
+        self.assertEqual(rows[0]["archived"], "False")
+        # One query for all rows: no per-row country lookups.
+        self.assertEqual(queries, 1)
+
+    def test_xlsx_export_of_the_current_applications_filter(self):
+        from openpyxl import load_workbook
+
+        url = reverse("applications_list") + "?status=approved&export=xlsx"
+        response, content, _ = self.download(url)
+        sheet = load_workbook(BytesIO(content)).active
+        values = list(sheet.values)
+        self.assertEqual(values[0][:3], ("id", "first_name", "last_name"))
+        self.assertEqual([row[1] for row in values[1:]], ["Ali1", "Ali3"])
+        self.assertIsInstance(values[1][-1], datetime)
+
+    def test_xlsx_splits_sheets_at_the_row_limit(self):
+        from openpyxl import load_workbook
+
+        from .exports import write_xlsx
+
+        rows = [(i, f"name\x01{i}") for i in range(5)]
+        with mock.patch("crm.exports.XLSX_MAX_ROWS", 3):
+            workbook = load_workbook(write_xlsx(iter(rows), ["id", "name"]))
+        self.assertEqual(workbook.sheetnames, ["Students", "Students 2", "Students 3"])
+        values = [list(sheet.values) for sheet in workbook.worksheets]
+        self.assertEqual(values[0], [("id", "name"), (0, "name0"), (1, "name1")])
+        self.assertEqual(values[2], [("id", "name"), (4, "name4")])
+
+        empty = load_workbook(write_xlsx(iter([]), ["id", "name"]))
+        self.assertEqual(list(empty.active.values), [("id", "name")])
+
+    def test_export_needs_login_and_a_known_format(self):
+        self.assertEqual(self.client.get(reverse("students_list") + "?export=pdf").status_code, 400)
+        self.client.logout()
+        response = self.client.get(reverse("students_list") + "?export=csv")
+        self.assertEqual(response.status_code, 302)
+        self.assertIn("login", response["Location"])
+
+    def test_admin_action_streams_the_selection(self):
+        ids = list(Student.objects.filter(first_name__in=["Ali0", "Sara"]).values_list("id", flat=True))
+        response = self.client.post(
+            reverse("admin:crm_student_changelist"),
+            {"action": "export_selected", "_selected_action": ids},
+        )
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(StringIO(b"".join(response.streaming_content).decode("utf-8-sig"))))
+        self.assertEqual([row[1] for row in rows], ["first_name", "Ali0", "Sara"])
+
+
+class AttachmentTests(SimpleTestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        cache_dir = override_settings(
+            EMAIL_ATTACHMENT_CACHE_DIR=os.path.join(tmp.name, "cache"),
+            EMAIL_ATTACHMENT_CACHE_MAX_BYTES=3000,
+        )
+        cache_dir.enable()
+        self.addCleanup(cache_dir.disable)
+        self.tmp = tmp.name
+
+    def write(self, name, content):
+        path = os.path.join(self.tmp, name)
+        with open(path, "wb") as fh:
+            fh.write(content)
+        return path
+
+    def attachment(self, message):
+        raw = message.message().as_bytes()
+        parsed = email.message_from_bytes(raw)
+        return next(part for part in parsed.walk() if part.get_filename())
+
+    def test_parts_are_read_from_the_cache_when_the_message_is_sent(self):
+        content = os.urandom(1000)
+        path = self.write("scan.pdf", content)
+        message = EmailMessage(subject="Docs", body="Attached", to=["a@example.com"])
+        part = attachments.mime_part(path, "scan.pdf")
+        message.attach(part)
+
+        self.assertNotIn("_payload", vars(part))
+        sent = self.attachment(message)
+        self.assertEqual(sent.get_content_type(), "application/pdf")
+        self.assertEqual(sent.get_payload(decode=True), content)
+        self.assertTrue(all(len(line) <= 76 for line in sent.get_payload().splitlines()))
+
+    def test_cache_evicts_least_recently_used_parts_and_re_encodes_them(self):
+        paths = [self.write(f"doc{i}.bin", os.urandom(1000)) for i in range(3)]
+        parts = []
+        for i, path in enumerate(paths):
+            parts.append(attachments.encoded_part_path(path))
+            os.utime(parts[-1], (i, i))  # older to newer
+
+        # 1000 bytes encode to ~1.4 KB: a fourth file pushes the oldest out.
+        attachments.encoded_part_path(self.write("doc3.bin", os.urandom(1000)))
+        parts_dir = os.path.join(settings.EMAIL_ATTACHMENT_CACHE_DIR, "parts")
+        total = sum(entry.stat().st_size for entry in os.scandir(parts_dir))
+        self.assertLessEqual(total, settings.EMAIL_ATTACHMENT_CACHE_MAX_BYTES)
+        self.assertFalse(os.path.exists(parts[0]))
+
+        part = attachments.mime_part(paths[0], "doc0.bin")
+        with open(paths[0], "rb") as fh:
+            self.assertEqual(base64.b64decode(part.get_payload()), fh.read())
+
+
+class BlobStoreTests(TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        media = override_settings(MEDIA_ROOT=tmp.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.media = tmp.name
+        self.student = Student.objects.create(first_name="Ali")
+
+    def stored_files(self):
+        return sorted(
+            os.path.relpath(os.path.join(root, name), self.media)
+            for root, _, names in os.walk(self.media)
+            for name in names
+        )
+
+    def test_identical_uploads_share_one_counted_blob(self):
+        scan = b"%PDF passport scan"
+        for name, content in [("Passport.PDF", scan), ("transcript.pdf", b"grades")]:
+            StudentDocument.objects.create(
+                student=self.student, file=SimpleUploadedFile(name, content)
+            )
+        self.client.post(
+            reverse("student_detail", args=[self.student.pk]),
+            {"title": "Again", "file": SimpleUploadedFile("copy.pdf", scan)},
+        )
+
+        documents = list(StudentDocument.objects.order_by("id"))
+        self.assertEqual(len(documents), 3)
+        passport, transcript, again = documents
+        self.assertEqual(passport.file.name, again.file.name)
+        self.assertTrue(passport.file.name.startswith("blobs/") and passport.file.name.endswith(".pdf"))
+        self.assertEqual((passport.filename, again.filename), ("Passport.PDF", "copy.pdf"))
+        self.assertEqual(len([f for f in self.stored_files() if not f.startswith("blobs/tmp")]), 2)
+        self.assertEqual(Blob.objects.get(name=passport.file.name).ref_count, 2)
+        with passport.file.open("rb") as handle:
+            self.assertEqual(handle.read(), scan)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            passport.delete()
+        self.assertTrue(os.path.exists(again.file.path))
+        self.assertEqual(Blob.objects.get(name=again.file.name).ref_count, 1)
+
+        path = again.file.path
+        with self.captureOnCommitCallbacks(execute=True):
+            self.student.delete()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(Blob.objects.exists())
+
+    def test_blob_reused_by_an_upload_is_not_collected_before_it_is_counted(self):
+        scan = b"%PDF shared scan"
+        with self.captureOnCommitCallbacks(execute=True):
+            first = StudentDocument.objects.create(
+                student=self.student, file=SimpleUploadedFile("a.pdf", scan)
+            )
+        name = first.file.name
+
+        # A second upload of the same file has stored it, but its document
+        # is not saved yet when the first document is deleted.
+        self.assertEqual(document_storage().save("b.pdf", ContentFile(scan)), name)
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(document_storage().exists(name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second = StudentDocument.objects.create(student=self.student, file=name)
+        self.assertEqual(Blob.objects.get(name=name).ref_count, 1)
+        self.assertFalse(os.path.exists(document_storage().pin_path(name)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(document_storage().exists(name))
+        self.assertFalse(Blob.objects.exists())
+
+    def test_dedupe_command_moves_old_files_and_reports_reclaimed_bytes(self):
+        def legacy(name, content):
+            path = os.path.join(self.media, "student_documents", name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as handle:
+                handle.write(content)
+            return StudentDocument.objects.create(
+                student=self.student, file=f"student_documents/{name}"
+            )
+
+        first = legacy("2024/01/passport.pdf", b"x" * 100)
+        second = legacy("2024/02/passport_a1b2.pdf", b"x" * 100)
+        other = legacy("2024/02/sop.docx", b"y" * 10)
+        StudentDocument.objects.create(student=self.student, file="student_documents/gone.pdf")
+
+        out, err = StringIO(), StringIO()
+        call_command("dedupe_documents", "--dry-run", stdout=out, stderr=err)
+        self.assertIn("100 bytes reclaimed", out.getvalue())
+        self.assertTrue(os.path.exists(os.path.join(self.media, first.file.name)))
+
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("dedupe_documents", stdout=out, stderr=err)
+        self.assertIn("Moved 3 files (3 documents) into 2 new blobs; 1 files missing.", out.getvalue())
+        self.assertIn("210 -> 110 bytes (100 bytes reclaimed)", out.getvalue())
+        self.assertIn("missing: student_documents/gone.pdf", err.getvalue())
+
+        for document in (first, second, other):
+            document.refresh_from_db()
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertEqual(second.filename, "passport_a1b2.pdf")
+        self.assertEqual(Blob.objects.get(name=first.file.name).ref_count, 2)
+        self.assertEqual(Blob.objects.get(name=other.file.name).ref_count, 1)
+        self.assertEqual(
+            [f for f in self.stored_files() if f.startswith("student_documents")], []
+        )
+
+
+class ImageDerivativeTests(TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        media = override_settings(MEDIA_ROOT=tmp.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.media = tmp.name
+        self.student = Student.objects.create(first_name="Ali")
+
+    def jpeg(self, size=(400, 200)):
+        from PIL import Image
+
+        exif = Image.Exif()
+        exif[0x0112] = 6  # orientation: rotate 90 degrees clockwise
+        exif[0x010F] = "PhoneMaker"
+        buffer = BytesIO()
+        Image.new("RGB", size, "red").save(buffer, "JPEG", exif=exif.tobytes())
+        return buffer.getvalue()
+
+    def write(self, name, content):
+        path = os.path.join(self.media, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as handle:
+            handle.write(content)
+        return name
+
+    def test_upload_makes_rotated_exif_free_derivatives(self):
+        from PIL import Image
+
+        with self.captureOnCommitCallbacks(execute=True):
+            document = StudentDocument.objects.create(
+                student=self.student, file=SimpleUploadedFile("scan.jpg", self.jpeg())
+            )
+            StudentDocument.objects.create(
+                student=self.student, file=SimpleUploadedFile("notes.pdf", b"%PDF")
+            )
+
+        self.assertTrue(derivative_url(document.file.name, "thumb").startswith("/images/"))
+        with Image.open(default_storage.path(derivative_name(document.file.name, "thumb"))) as thumb:
+            self.assertEqual(thumb.format, "WEBP")
+            self.assertEqual(thumb.size, (80, 160))
+            self.assertEqual(dict(thumb.getexif()), {})
+        self.assertTrue(default_storage.exists(derivative_name(document.file.name, "preview")))
+        self.assertEqual(derivative_url("student_documents/notes.pdf", "thumb"), "")
+
+    def test_missing_derivative_is_made_on_first_request(self):
+        name = self.write("passports/2025/01/scan.png", self.jpeg())
+        Student.objects.filter(pk=self.student.pk).update(passport_image=name)
+
+        def preview_src():
+            page = self.client.get(reverse("student_detail", args=[self.student.pk]))
+            return re.search(r'<img src="([^"]+)"', page.content.decode()).group(1)
+
+        url = preview_src()
+        self.assertTrue(url.startswith("/images/"))
+        self.assertEqual(self.client.get(url).status_code, 302)  # to the login page
+
+        self.client.force_login(get_user_model().objects.create_user("manager", is_staff=True))
+        response = self.client.get(url)
+        self.assertEqual((response.status_code, response["Content-Type"]), (200, "image/webp"))
+        self.assertIn('filename="scan-preview.webp"', response["Content-Disposition"])
+        self.assertTrue(default_storage.exists(derivative_name(name, "preview")))
+        self.assertEqual(preview_src(), url)
+
+        self.assertEqual(self.client.get(url[:-3] + "xx/").status_code, 404)
+
+    def test_backfill_command_makes_missing_derivatives_and_prunes(self):
+        name = self.write("passports/2025/01/scan.jpg", self.jpeg())
+        Student.objects.filter(pk=self.student.pk).update(passport_image=name)
+        self.write("passports/2025/01/broken.jpg", b"not an image")
+        Student.objects.create(first_name="Sara", passport_image="passports/2025/01/broken.jpg")
+        stray = self.write("derivatives/ab/stale.webp", b"old")
+
+        out, err = StringIO(), StringIO()
+        call_command("build_image_derivatives", "--workers", "1", "--prune", stdout=out, stderr=err)
+        self.assertIn("2 images: 4 derivatives to make, 0 present", out.getvalue())
+        self.assertIn("Made 2 derivatives; 2 failed.", out.getvalue())
+        self.assertIn("broken.jpg", err.getvalue())
+        self.assertFalse(os.path.exists(os.path.join(self.media, stray)))
+        self.assertTrue(default_storage.exists(derivative_name(name, "preview")))
+
+        out = StringIO()
+        call_command("build_image_derivatives", "--workers", "1", stdout=out, stderr=err)
+        self.assertIn("2 images: 2 derivatives to make, 2 present", out.getvalue())
+
+
+@override_settings(UPLOAD_CHUNK_SIZE=4, UPLOAD_CHUNK_MAX_BYTES=8)
+class UploadSessionTests(TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        paths = override_settings(
+            MEDIA_ROOT=os.path.join(tmp.name, "media"),
+            UPLOAD_SESSION_DIR=os.path.join(tmp.name, "uploads"),
+        )
+        paths.enable()
+        self.addCleanup(paths.disable)
+        self.user = get_user_model().objects.create_user("counselor", password="pw")
+        self.client.force_login(self.user)
+        self.student = Student.objects.create(first_name="Ali")
+
+    def start(self, content, **extra):
+        response = self.client.post(
+            reverse("upload_start"),
+            json.dumps({"filename": "C:\\scans\\passport.pdf", "size": len(content), **extra}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def put(self, url, offset, chunk, checksum=None):
+        headers = {"HTTP_UPLOAD_OFFSET": str(offset)}
+        if checksum is not None:
+            headers["HTTP_UPLOAD_CHECKSUM"] = checksum
+        return self.client.put(url, chunk, content_type="application/offset+octet-stream", **headers)
+
+    def test_chunks_resume_from_the_acknowledged_offset(self):
+        content = b"%PDF-passport"
+        session = self.start(content, sha256=hashlib.sha256(content).hexdigest())
+        self.assertEqual((session["offset"], session["chunk_size"]), (0, 4))
+        url = session["url"]
+
+        ok = self.put(url, 0, content[:4], hashlib.sha256(content[:4]).hexdigest())
+        self.assertEqual(ok.json(), {**ok.json(), "offset": 4, "status": "open"})
+
+        # A retried chunk, or one sent after a lost acknowledgement.
+        stale = self.put(url, 0, content[:4])
+        self.assertEqual((stale.status_code, stale.json()["offset"]), (409, 4))
+
+        damaged = self.put(url, 4, b"XXXX", hashlib.sha256(content[4:8]).hexdigest())
+        self.assertEqual((damaged.status_code, damaged.json()["offset"]), (400, 4))
+        self.assertEqual(self.client.get(url).json()["offset"], 4)
+        self.assertEqual(os.path.getsize(uploads.part_path(session["id"])), 4)
+
+        for offset in range(4, len(content), 4):
+            response = self.put(url, offset, content[offset:offset + 4])
+        self.assertEqual(response.json()["status"], "complete")
+        self.assertEqual(self.put(url, len(content), b"!").status_code, 409)
+
+        too_big = self.put(self.start(b"x" * 20)["url"], 0, b"x" * 9)
+        self.assertEqual(too_big.status_code, 413)
+
+    def test_finished_upload_is_attached_once(self):
+        content = b"transcript pages"
+        session = self.start(content)
+        url = session["url"]
+        self.put(url, 0, content[:8])
+
+        attach_url = reverse("upload_attach", args=[session["id"]])
+        early = self.client.post(attach_url, {"student": self.student.pk, "title": "Transcript"})
+        self.assertEqual(early.status_code, 409)
+        self.assertFalse(StudentDocument.objects.exists())
+
+        self.put(url, 8, content[8:])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(attach_url, {"student": self.student.pk, "title": "Transcript"})
+        self.assertEqual(response.status_code, 201)
+        document = StudentDocument.objects.get()
+        self.assertEqual((document.title, document.filename), ("Transcript", "passport.pdf"))
+        self.assertTrue(document.file.name.startswith("blobs/"))
+        with document.file.open("rb") as handle:
+            self.assertEqual(handle.read(), content)
+        self.assertFalse(os.path.exists(uploads.part_path(session["id"])))
+        self.assertEqual(Blob.objects.get(name=document.file.name).ref_count, 1)
+        self.assertTrue(
+            ActivityLog.objects.filter(student=self.student, action="uploaded_document").exists()
+        )
+
+        again = uploads.attach(session["id"], self.student, title="Transcript")
+        self.assertEqual(again.pk, document.pk)
+        self.assertEqual(StudentDocument.objects.count(), 1)
+
+    def test_idle_sessions_expire_with_their_part_files(self):
+        session = self.start(b"12345")
+        self.put(session["url"], 0, b"12")
+        UploadSession.objects.update(updated_at=timezone.now() - timedelta(days=2))
+
+        self.start(b"other")
+        self.assertFalse(UploadSession.objects.filter(pk=session["id"]).exists())
+        self.assertFalse(os.path.exists(uploads.part_path(session["id"])))
+        self.assertEqual(self.put(session["url"], 2, b"345").status_code, 404)
+
+    @override_settings(UPLOAD_MAX_SESSIONS_PER_USER=2, UPLOAD_MAX_PENDING_BYTES_PER_USER=10)
+    def test_sessions_are_private_and_capped_per_user(self):
+        session = self.start(b"12345")
+        self.start(b"123")
+
+        other = get_user_model().objects.create_user("other")
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(session["url"]).status_code, 404)
+        self.assertEqual(self.put(session["url"], 0, b"12").status_code, 404)
+        self.start(b"other")
+
+        self.client.logout()
+        self.assertEqual(self.client.get(session["url"]).status_code, 302)
+        self.assertEqual(self.put(session["url"], 0, b"12").status_code, 302)
+        response = self.client.post(
+            reverse("upload_start"), json.dumps({"filename": "a.pdf", "size": 1}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(UploadSession.objects.count(), 3)
+
+        self.client.force_login(self.user)
+        too_many = self.client.post(
+            reverse("upload_start"), json.dumps({"filename": "a.pdf", "size": 1}),
+            content_type="application/json",
+        )
+        self.assertEqual(too_many.status_code, 429)
+
+        # Attached uploads no longer count; the byte total still applies.
+        self.put(session["url"], 0, b"12345")
+        with self.assertRaises(uploads.UploadError) as error:
+            uploads.attach(session["id"], self.student, user=other)
+        self.assertEqual(error.exception.status, 404)
+        self.client.force_login(other)
+        response = self.client.post(
+            reverse("upload_attach", args=[session["id"]]), {"student": self.student.pk}
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(StudentDocument.objects.exists())
+        self.client.force_login(self.user)
+        uploads.attach(session["id"], self.student, user=self.user)
+        too_large = self.client.post(
+            reverse("upload_start"), json.dumps({"filename": "a.pdf", "size": 8}),
+            content_type="application/json",
+        )
+        self.assertEqual(too_large.status_code, 429)
+        self.start(b"1234567")
+
+
+class ProtectedMediaTests(TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        media = override_settings(MEDIA_ROOT=tmp.name)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        users = get_user_model().objects
+        self.owner = users.create_user("owner")
+        self.counselor = users.create_user("counselor")
+        self.student = Student.objects.create(first_name="Ali", created_by=self.owner)
+        self.document = StudentDocument.objects.create(
+            student=self.student,
+            file=SimpleUploadedFile("Bank Statement.pdf", b"0123456789" * 10),
+        )
+        self.url = self.document.file.url
+
+    def get(self, user, **headers):
+        self.client.force_login(user)
+        return self.client.get(self.url, **headers)
+
+    def test_users_who_see_the_student_page_get_the_file(self):
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+
+        # The counselor neither added the student nor holds one of their leads.
+        self.client.force_login(self.counselor)
+        self.assertEqual(self.client.get("/media/blobs/tmp/../../x").status_code, 404)
+        page = self.client.get(reverse("student_detail", args=[self.student.pk]))
+        self.assertEqual(page.status_code, 200)
+        for user in (self.owner, self.counselor):
+            response = self.get(user)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b"".join(response.streaming_content), b"0123456789" * 10)
+        self.assertEqual(response["Content-Type"], "application/pdf")
+        self.assertIn('inline; filename="Bank Statement.pdf"', response["Content-Disposition"])
+        self.assertIn("private", response["Cache-Control"])
+
+        # A public application has no created_by.
+        applicant = Student.objects.create(
+            first_name="Sara", passport_image=SimpleUploadedFile("passport.jpg", b"scan")
+        )
+        response = self.client.get(applicant.passport_image.url)
+        self.assertEqual(b"".join(response.streaming_content), b"scan")
+
+        stray = default_storage.save("blobs/stray.pdf", ContentFile(b"x"))
+        self.assertEqual(self.client.get(settings.MEDIA_URL + stray).status_code, 404)
+
+    def test_ranges_and_etags_without_a_front_server(self):
+        full = self.get(self.owner)
+        etag = full["ETag"]
+        self.assertEqual(full["Accept-Ranges"], "bytes")
+        self.assertEqual(self.get(self.owner, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        part = self.get(self.owner, HTTP_RANGE="bytes=10-14")
+        self.assertEqual(part.status_code, 206)
+        self.assertEqual((part["Content-Range"], part["Content-Length"]), ("bytes 10-14/100", "5"))
+        self.assertEqual(b"".join(part.streaming_content), b"01234")
+
+        tail = self.get(self.owner, HTTP_RANGE="bytes=-3", HTTP_IF_RANGE=etag)
+        self.assertEqual(b"".join(tail.streaming_content), b"789")
+        stale = self.get(self.owner, HTTP_RANGE="bytes=-3", HTTP_IF_RANGE='"old"')
+        self.assertEqual(stale.status_code, 200)
+
+        outside = self.get(self.owner, HTTP_RANGE="bytes=100-")
+        self.assertEqual((outside.status_code, outside["Content-Range"]), (416, "bytes */100"))
+
+    def test_transfer_is_handed_to_the_front_server(self):
+        name = self.document.file.name
+        with self.settings(MEDIA_SENDFILE_HEADER="X-Accel-Redirect"):
+            response = self.get(self.counselor)
+        self.assertEqual(response["X-Accel-Redirect"], "/protected-media/" + name)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["Content-Type"], "application/pdf")
+
+        with self.settings(MEDIA_SENDFILE_HEADER="X-Sendfile"):
+            response = self.get(self.counselor)
+        self.assertEqual(response["X-Sendfile"], default_storage.path(name))
+
+        self.counselor.is_active = False
+        self.counselor.save()
+        with self.settings(MEDIA_SENDFILE_HEADER="X-Sendfile"):
+            self.assertEqual(self.get(self.counselor).status_code, 302)
+
+
+class DailyMetricsTests(TestCase):
+
+    def buckets(self):
+        return sorted(
+            DailyMetric.objects.values("date", "kind", "country", "source", "status")
+            .annotate(n=Sum("count"))
+            .filter(n__gt=0)
+            .values_list("date", "kind", "country", "source", "status", "n")
+        )
+
+    def test_signals_match_a_full_rebuild(self):
+        nepal = Country.objects.create(name="Nepal")
+        india = Country.objects.create(name="India")
+        students = [Student.objects.create(first_name=f"S{i}", country=nepal) for i in range(4)]
+        lead = Lead.objects.create(source="manual", payload={})
+        Lead.objects.create(source="facebook", payload={})
+
+        students[0].application_status = "approved"
+        students[0].save(update_fields=["application_status"])
+        students[1].country = india
+        students[1].save()
+        students[2].delete()
+        lead.source = "other"
+        lead.save()
+
+        incremental = self.buckets()
+        rebuild_daily_metrics(Student, Lead, DailyMetric)
+        self.assertEqual(incremental, self.buckets())
+
+        summary = period_summary("student")
+        self.assertEqual((summary["total"], summary["recent"]), (3, 3))
+        self.assertIsNone(summary["growth_rate"])
+
+
+class DashboardCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_stats_are_cached_until_data_changes(self):
+        url = reverse("dashboard_stats")
+        response = self.client.get(url)
+        etag = response["ETag"]
+        self.assertIn("Last-Modified", response)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, headers={"if-none-match": etag}).status_code, 304)
+            self.assertEqual(self.client.get(url).json()["total_students"], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Student.objects.create(first_name="New")
+
+        response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["total_students"], 1)
+        self.assertNotEqual(response["ETag"], etag)
+
+
+class WebhookBatchTests(TestCase):
+
+    def post(self, payload):
+        return self.client.post(
+            reverse("webhook_lead"), data=json.dumps(payload), content_type="application/json"
+        )
+
+    def leads(self, start, count):
+        return [
+            {
+                "full_name": f"Lead {i}",
+                "phone": f"0300{i:07d}",
+                "country": "Pakistan" if i % 2 else "Nepal",
+                "facebook": {"lead_id": str(i), "campaign_name": "Sep"},
+            }
+            for i in range(start, start + count)
+        ]
+
+    def test_batch_matches_existing_students_and_reports_per_item(self):
+        existing = Student.objects.create(first_name="Ali", email="ali@example.com")
+        payload = [
+            {"full_name": "Ali Khan", "email": "ali@example.com"},
+            {"full_name": "Sara Ahmed", "phone": "0300111"},
+            {"first_name": "Sara", "phone": "0300111"},
+            "not a lead",
+        ]
+        results = self.post(payload).json()["results"]
+
+        self.assertEqual(results[0]["student_id"], existing.id)
+        self.assertFalse(results[0]["new_student"])
+        self.assertTrue(results[1]["new_student"])
+        self.assertEqual(results[2]["student_id"], results[1]["student_id"])
+        self.assertFalse(results[2]["new_student"])
+        self.assertEqual(results[3]["status"], "error")
+
+        sara = Student.objects.get(pk=results[1]["student_id"])
+        self.assertEqual((sara.first_name, sara.last_name), ("Sara", "Ahmed"))
+        self.assertEqual(sara.tags.get().name, "Facebook Lead")
+        self.assertEqual(Lead.objects.count(), 3)
+        self.assertEqual(ActivityLog.objects.filter(action="lead_created").count(), 3)
+        self.assertEqual(
+            DailyMetric.objects.filter(kind="lead").aggregate(n=Sum("count"))["n"], 3
+        )
+
+    def test_queries_do_not_scale_per_lead(self):
+        self.post(self.leads(0, 2))  # create the countries and tag first
+
+        with CaptureQueriesContext(connection) as small:
+            self.post(self.leads(100, 5))
+        with CaptureQueriesContext(connection) as large:
+            self.post(self.leads(200, 200))
+        # Only bulk_create batching (SQLite's parameter limit) adds queries.
+        self.assertLess(len(large), len(small) + 200 // 10)
+        self.assertEqual(Lead.objects.count(), 207)
+
+    def test_single_object_keeps_its_response(self):
+        body = self.post({"full_name": "Omar", "email": "omar@example.com"}).json()
+        self.assertEqual(
+            set(body), {"status", "lead_id", "student_id", "new_student", "duplicate"}
+        )
+        self.assertTrue(body["new_student"])
+
+
+class AssignmentTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        reset()
+        User = get_user_model()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.counselors = [
+                User.objects.create(username=f"c{i}", is_staff=True) for i in range(3)
+            ]
+            User.objects.create(username="staff")  # not staff: never assigned
+        self.ids = [u.id for u in self.counselors]
+
+    def post(self, payload):
+        return self.client.post(
+            reverse("webhook_lead"), data=json.dumps(payload), content_type="application/json"
+        ).json()
+
+    def test_round_robin_rotates_without_querying_users(self):
+        self.assertEqual(assign_counselors(4, "round_robin"), self.ids + self.ids[:1])
+
+        with CaptureQueriesContext(connection) as queries:
+            results = self.post(
+                [{"full_name": f"L{i}", "phone": f"0300{i:07d}"} for i in range(5)]
+            )["results"]
+        self.assertFalse([q for q in queries if "auth_user" in q["sql"]])
+        assigned = [Lead.objects.get(pk=r["lead_id"]).assigned_to_id for r in results]
+        self.assertEqual(assigned, self.ids[1:] + self.ids)
+
+    @override_settings(LEAD_ASSIGNMENT_BLOCK_SIZE=4)
+    def test_round_robin_position_and_roster_outlive_a_process_cache(self):
+        self.assertEqual(assign_counselors(2, "round_robin"), self.ids[:2])
+        self.assertEqual(Counter.objects.get().value, 4)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(assign_counselors(1, "round_robin"), self.ids[2:])
+        self.assertEqual(len(queries), 0)
+
+        cache.clear()  # another worker, or a restart: the rest of the block is skipped
+        reset()
+        self.assertEqual(assign_counselors(2, "round_robin"), self.ids[1:])
+        self.assertEqual(assign_counselors(3, "round_robin"), self.ids)  # spans two blocks
+        self.assertEqual(Counter.objects.get().value, 12)
+
+        with override_settings(LEAD_ASSIGNMENT_ROSTER_TTL=0):
+            cache.clear()
+            assign_counselors(1, "round_robin")
+            get_user_model().objects.filter(username="staff").update(is_staff=True)  # no signals
+            self.assertEqual(len(set(assign_counselors(4, "round_robin"))), 4)
+
+    @override_settings(LEAD_ASSIGNMENT_STRATEGY="least_open")
+    def test_least_open_fills_up_the_least_loaded_first(self):
+        Lead.objects.bulk_create(
+            [Lead(payload={}, assigned_to_id=self.ids[0]) for _ in range(3)]
+            + [Lead(payload={}, assigned_to_id=self.ids[1])]
+            + [Lead(payload={}, assigned_to_id=self.ids[2], processed=True) for _ in range(5)]
+        )
+        picks = assign_counselors(5)
+        self.assertEqual(picks, [self.ids[2], self.ids[1], self.ids[2], self.ids[1], self.ids[2]])
+
+    def test_roster_follows_user_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.counselors[0].is_active = False
+            self.counselors[0].save()
+        self.assertNotIn(self.ids[0], assign_counselors(6))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            get_user_model().objects.filter(is_staff=True).delete()
+        self.assertEqual(assign_counselors(2), [None, None])
+
+    def test_least_loaded_ties_take_turns(self):
+        balancer = LeastLoaded({1: 0, 2: 0, 3: 2})
+        self.assertEqual([balancer.take() for _ in range(6)], [1, 2, 1, 2, 3, 1])
+        self.assertEqual(balancer.load(1), 3)
+
+
+class ReferenceDataTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        refdata.clear()
+        self.addCleanup(refdata.clear)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.nepal = Country.objects.create(name="Nepal")
+            Tag.objects.create(name="VIP")
+
+    def warm(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return StudentFilterForm().as_p()
+
+    def test_forms_render_and_validate_from_memory(self):
+        self.warm()
+        with self.assertNumQueries(0):
+            html = StudentFilterForm().as_p()
+            form = StudentFilterForm({"country": str(self.nepal.pk)})
+            self.assertTrue(form.is_valid())
+        self.assertIn("Nepal", html)
+        self.assertEqual(form.cleaned_data["country"].pk, self.nepal.pk)
+        self.assertFalse(StudentFilterForm({"country": "999"}).is_valid())
+
+    def test_changes_bump_the_version(self):
+        self.warm()
+        with self.captureOnCommitCallbacks(execute=True):
+            Country.objects.create(name="India")
+        self.assertEqual([c.name for c in refdata.rows(Country)], ["India", "Nepal"])
+
+    def test_unsignalled_changes_are_picked_up_after_the_max_age(self):
+        self.warm()
+        Country.objects.filter(pk=self.nepal.pk).update(name="Nepal (NP)")  # no signals
+        self.assertEqual([c.name for c in refdata.rows(Country)], ["Nepal"])
+
+        later = time.monotonic() + settings.REFDATA_MAX_AGE
+        with mock.patch("crm.refdata.time.monotonic", return_value=later):
+            self.assertEqual([c.name for c in refdata.rows(Country)], ["Nepal (NP)"])
+
+    def test_rows_read_in_a_rolled_back_transaction_are_not_kept(self):
+        self.warm()
+        refdata.clear()
+        try:
+            with transaction.atomic():
+                Country.objects.create(name="Atlantis")
+                self.assertIn("Atlantis", [c.name for c in refdata.rows(Country)])
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertNotIn("Atlantis", [c.name for c in refdata.rows(Country)])
+
+    def test_webhook_resolves_country_and_tag_without_queries(self):
+        post = lambda i: self.client.post(
+            reverse("webhook_lead"),
+            data=json.dumps({"full_name": f"L{i}", "phone": f"0300{i:07d}", "country": "Nepal"}),
+            content_type="application/json",
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            post(1)  # creates the "Facebook Lead" tag, which bumps the version
+        with self.captureOnCommitCallbacks(execute=True):
+            post(2)
+        with CaptureQueriesContext(connection) as queries:
+            post(3)
+        tables = " ".join(q["sql"] for q in queries)
+        self.assertNotIn('"crm_country"', tables)
+        self.assertNotIn('"crm_tag"', tables)
+        self.assertEqual(Student.objects.filter(country=self.nepal).count(), 3)
+
+    def test_site_config_get_is_typed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            SiteConfig.objects.bulk_create([
+                SiteConfig(key="per_page", value="25"),
+                SiteConfig(key="enabled", value="Yes"),
+                SiteConfig(key="sources", value='["facebook", "manual"]'),
+            ])
+        refdata.bump_version()
+        self.assertEqual(SiteConfig.get("per_page", 10), 25)
+        self.assertIs(SiteConfig.get("enabled", cast=bool), True)
+        self.assertEqual(SiteConfig.get("sources", cast=list), ["facebook", "manual"])
+        self.assertEqual(SiteConfig.get("per_page"), "25")
+        self.assertEqual(SiteConfig.get("sources", 0), 0)
+        self.assertIsNone(SiteConfig.get("missing"))
+
+
+class ImportStudentsTests(TestCase):
+
+    HEADER = ["Name", "Country", "Age", "Phone", "Email", "Course", "Enrollment Date"]
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+
+    def write_csv(self, rows, header=HEADER):
+        path = os.path.join(self.dir, "students.csv")
+        with open(path, "w", newline="") as handle:
+            writer = csv.writer(handle)
+            writer.writerow(header)
+            writer.writerows(rows)
+        return path
+
+    def run_import(self, path, *args):
+        out = StringIO()
+        call_command("import_students", path, *args, stdout=out)
+        return out.getvalue()
+
+    def test_imports_in_chunks_skipping_known_contacts_and_reporting_rejects(self):
+        Student.objects.create(first_name="Known", phone="0092 300 1111111")
+        path = self.write_csv([
+            ["Ali Khan", "Nepal", "23", "+92 300 2222222", "Ali@Example.com", "IELTS", "2025-1-2"],
+            ["Old Friend", "", "", "923001111111", "", "", ""],
+            ["Ali Again", "", "", "", "ali@example.com", "", ""],
+            ["", "Nepal", "", "0300", "", "", ""],
+            ["Sara", "India", "x", "", "sara@example.com", "", ""],
+            ["Omar", "", "", "", "not-an-email", "", "yesterday"],
+            ["Zara Ali", "India", "", "", "zara@example.com", "PTE", ""],
+        ])
+
+        out = self.run_import(path, "--chunk-size", "2")
+
+        self.assertIn(
+            "7 rows: 2 created, 0 updated, 0 unchanged, 2 skipped, 0 conflicts, 3 rejected", out
+        )
+        ali = Student.objects.get(email_key="ali@example.com")
+        self.assertEqual((ali.first_name, ali.last_name, ali.age), ("Ali", "Khan", 23))
+        self.assertEqual(ali.country.name, "Nepal")
+        self.assertEqual(ali.enrollment_date.isoformat(), "2025-01-02")
+        self.assertEqual(ali.phone_key, "923002222222")
+        self.assertEqual(Student.objects.filter(country__name="India").count(), 1)
+
+        with open(os.path.join(self.dir, "students.rejects.csv")) as handle:
+            rejects = list(csv.reader(handle))
+        self.assertEqual(rejects[0][:3], ["row", "reason", "Name"])
+        self.assertEqual(
+            [row[:2] for row in rejects[1:]],
+            [["5", "Missing name"], ["6", "Invalid age"], ["7", "Invalid email"]],
+        )
+
+        # Running it again creates nothing new.
+        self.assertIn("7 rows: 0 created, 0 updated, 0 unchanged, 4 skipped", self.run_import(path))
+
+    def test_update_mode_writes_only_changed_rows(self):
+        nepal = Country.objects.create(name="Nepal")
+        ali = Student.objects.create(
+            first_name="Ali", last_name="Khan", phone="+92 300 1111111",
+            course="IELTS", country=nepal,
+        )
+        sara = Student.objects.create(first_name="Sara", email="sara@example.com", course="PTE")
+        omar = Student.objects.create(first_name="Omar", passport_number="AB123")
+        Student.objects.create(first_name="Zed", email="zed@example.com")
+        path = self.write_csv(
+            [
+                # same number, other formatting; course and country changed
+                ["Ali Khan", "India", "", "0092 300 1111111", "", "TOEFL", "", ""],
+                # unchanged: email differs in case only, empty cells keep stored values
+                ["Sara", "", "", "", "SARA@example.com", "", "", ""],
+                # matched on passport number, gets an age and a phone
+                ["Omar", "", "30", "0300 5555555", "", "", "", "AB123"],
+                # phone of Ali, email of Zed
+                ["Who", "", "", "923001111111", "zed@example.com", "", "", ""],
+                ["New Person", "", "", "", "new@example.com", "", "", ""],
+            ],
+            header=self.HEADER + ["Passport Number"],
+        )
+
+        out = self.run_import(path, "--update", "--dry-run")
+        self.assertIn("Dry run", out)
+        self.assertIn("1 created, 2 updated, 1 unchanged, 0 skipped, 1 conflicts", out)
+        self.assertEqual(Student.objects.count(), 4)
+        self.assertEqual(Student.objects.get(pk=ali.pk).course, "IELTS")
+
+        with CaptureQueriesContext(connection) as queries:
+            out = self.run_import(path, "--update")
+        self.assertIn("1 created, 2 updated, 1 unchanged, 0 skipped, 1 conflicts", out)
+        self.assertIn("course 1", out)
+        updates = [q["sql"] for q in queries if q["sql"].startswith("UPDATE \"crm_student\"")]
+        self.assertEqual(len(updates), 1)
+
+        ali.refresh_from_db()
+        self.assertEqual((ali.course, ali.country.name), ("TOEFL", "India"))
+        self.assertEqual(ali.phone, "+92 300 1111111")
+        sara_before = sara.updated_at
+        sara.refresh_from_db()
+        self.assertEqual((sara.email, sara.course), ("sara@example.com", "PTE"))
+        self.assertEqual(sara.updated_at, sara_before)
+        omar.refresh_from_db()
+        self.assertEqual((omar.age, omar.phone_key), (30, "03005555555"))
+        india = DailyMetric.objects.filter(kind="student", country__name="India")
+        self.assertEqual(india.aggregate(n=Sum("count"))["n"], 1)
+
+        out = self.run_import(path, "--update")
+        self.assertIn("0 created, 0 updated, 4 unchanged, 0 skipped, 1 conflicts", out)
+
+    def test_dry_run_holds_no_transaction_between_batches(self):
+        path = self.write_csv(
+            [[f"Person {i}", "", "", f"0300 {i:07d}", "", "", ""] for i in range(3)]
+        )
+        depth = len(connection.atomic_blocks)
+        depths = []
+        results = import_pipeline.run(
+            [path], workers=0, chunk_size=1, dry_run=True,
+            on_progress=lambda result: depths.append(len(connection.atomic_blocks)),
+        )
+        self.assertEqual(depths, [depth] * 3)
+        self.assertEqual(results[0].stats.created, 3)
+        self.assertEqual(Student.objects.count(), 0)
+
+    def test_dry_run_counts_a_person_repeated_across_batches_like_a_real_run(self):
+        path = self.write_csv([
+            ["Ali Khan", "Atlantis", "", "0300 1234567", "", "", ""],
+            ["Ali Khan", "Atlantis", "", "0300 1234567", "ali@example.com", "", ""],
+            ["Ali Khan", "Atlantis", "", "0300 1234567", "ali@example.com", "", ""],
+        ])
+        for args, summary in [
+            ((), "1 created, 0 updated, 0 unchanged, 2 skipped"),
+            (("--update",), "1 created, 1 updated, 1 unchanged, 0 skipped"),
+        ]:
+            dry = self.run_import(path, "--chunk-size", "1", "--dry-run", *args)
+            self.assertIn(summary, dry)
+            self.assertFalse(Student.objects.exists())
+            self.assertFalse(Country.objects.filter(name="Atlantis").exists())
+            self.assertIn(summary, self.run_import(path, "--chunk-size", "1", *args))
+            Student.objects.all().delete()
+            Country.objects.filter(name="Atlantis").delete()
+
+    def test_reads_xlsx(self):
+        from openpyxl import Workbook
+
+        path = os.path.join(self.dir, "students.xlsx")
+        workbook = Workbook()
+        workbook.active.append(["Name", "Phone", "Email"])
+        workbook.active.append(["Ali Khan", 3001234567.0, "ali@example.com"])
+        workbook.save(path)
+
+        self.assertIn("1 rows: 1 created", self.run_import(path))
+        self.assertEqual(Student.objects.get().phone, "3001234567")
+
+    def test_imports_a_directory_in_parallel_and_isolates_failed_files(self):
+        for name, rows in [
+            ("a.csv", [["Ali Khan", "", "", "", "ali@example.com", "", ""]]),
+            ("b.csv", [["Sara", "", "", "", "sara@example.com", "", ""], ["", "", "", "", "", "", ""]]),
+        ]:
+            with open(os.path.join(self.dir, name), "w", newline="") as handle:
+                csv.writer(handle).writerows([self.HEADER, *rows])
+        with open(os.path.join(self.dir, "c.csv"), "w", newline="") as handle:
+            csv.writer(handle).writerows([["Phone"], ["0300 1234567"]])
+        with open(os.path.join(self.dir, "notes.txt"), "w") as handle:
+            handle.write("not a spreadsheet")
+
+        for workers in ("0", "2"):
+            Student.objects.all().delete()
+            out, err = StringIO(), StringIO()
+            with self.assertRaisesMessage(CommandError, "1 of 3 files failed."):
+                call_command(
+                    "import_students", self.dir, "--workers", workers, stdout=out, stderr=err
+                )
+            self.assertIn("Done a.csv: 1 rows: 1 created", out.getvalue())
+            self.assertIn("Done b.csv: 2 rows: 1 created", out.getvalue())
+            self.assertIn("3 files, 3 rows: 2 created", out.getvalue())
+            self.assertIn("FAILED c.csv after 0 rows: ValueError", err.getvalue())
+            self.assertEqual(Student.objects.count(), 2)
+
+        # The rejects file written next to b.csv is not picked up as input.
+        self.assertTrue(os.path.exists(os.path.join(self.dir, "b.rejects.csv")))
+        self.assertEqual(
+            [os.path.basename(p) for p in expand_paths([self.dir])], ["a.csv", "b.csv", "c.csv"]
+        )
+
+    def test_vectorised_keys_match_contacts(self):
+        values = ["+92 (300) 123-4567", "0092 3001234567", "12345", "", "Ali@X.com", "nope"]
+        frame = normalise([[v, v] for v in values], {"phone": 0, "email": 1})
+        for value, phone_key, email_key in zip(values, frame["phone_key"], frame["email_key"]):
+            phone_key = phone_key if isinstance(phone_key, str) else None
+            email_key = email_key if isinstance(email_key, str) else None
+            self.assertEqual(phone_key, normalise_phone(value))
+            self.assertEqual(email_key, normalise_email(value))
+
+
+@override_settings(WEBHOOK_ASYNC=True, WEBHOOK_INBOX_MAX_ATTEMPTS=2)
+class WebhookInboxTests(TestCase):
+
+    def post(self, payload):
+        return self.client.post(
+            reverse("webhook_lead"), data=json.dumps(payload), content_type="application/json"
+        )
+
+    def test_accepts_then_worker_ingests_in_order(self):
+        response = self.post([{"full_name": "Ali Khan", "phone": "1"}, "bad", {"email": "b@x.com"}])
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(Lead.objects.count(), 0)
+        self.assertEqual(inbox_stats()["due"], 3)
+
+        call_command("run_webhook_inbox", "--once", stdout=StringIO(), stderr=StringIO())
+
+        rows = list(WebhookInbox.objects.order_by("id"))
+        self.assertEqual([r.status for r in rows], ["done", "dead", "done"])
+        self.assertEqual(rows[0].result["lead_id"], Lead.objects.order_by("id").first().id)
+        self.assertEqual(inbox_stats()["pending"], 0)
+
+    def test_failures_back_off_then_dead_letter(self):
+        self.post({"full_name": "Ali"})
+        with mock.patch("crm.inbox.ingest_leads", side_effect=RuntimeError("db down")):
+            self.assertEqual(process_batch(claim_batch()), (0, 1, 0))
+            row = WebhookInbox.objects.get()
+            self.assertEqual((row.status, row.attempts), ("pending", 1))
+            self.assertGreater(row.next_attempt_at, timezone.now())
+            self.assertEqual(claim_batch(), [])
+
+            WebhookInbox.objects.update(next_attempt_at=timezone.now())
+            self.assertEqual(process_batch(claim_batch()), (0, 0, 1))
+
+        self.assertEqual(requeue_dead(), 1)
+        self.assertEqual(process_batch(claim_batch()), (1, 0, 0))
+        self.assertEqual(Lead.objects.count(), 1)
+
+
+class IdempotencyTests(TestCase):
+
+    def setUp(self):
+        recent_leads().clear()
+
+    def post(self, payload, **headers):
+        return self.client.post(
+            reverse("webhook_lead"),
+            data=json.dumps(payload),
+            content_type="application/json",
+            headers=headers,
+        ).json()
+
+    def test_redelivery_returns_the_original_lead(self):
+        payload = {"full_name": "Ali Khan", "facebook": {"lead_id": "fb-1"}}
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.post(payload)
+
+        with self.assertNumQueries(0):
+            again = self.post(payload)
+        self.assertEqual((again["lead_id"], again["student_id"]), (first["lead_id"], first["student_id"]))
+        self.assertTrue(again["duplicate"])
+
+        recent_leads().clear()
+        batch = self.post([payload, {"full_name": "Sara", "facebook": {"lead_id": "fb-2"}}])
+        self.assertEqual(batch["results"][0]["lead_id"], first["lead_id"])
+        self.assertFalse(batch["results"][1]["duplicate"])
+        self.assertEqual(Lead.objects.count(), 2)
+        self.assertEqual(ActivityLog.objects.count(), 2)
+
+    def test_idempotency_key_header_and_repeats_within_a_batch(self):
+        first = self.post({"full_name": "Omar"}, idempotency_key="abc")
+        again = self.post({"full_name": "Omar"}, idempotency_key="abc")
+        self.assertEqual(again["lead_id"], first["lead_id"])
+
+        results = self.post(
+            [{"facebook": {"lead_id": "x"}}, {"facebook": {"lead_id": "x"}}]
+        )["results"]
+        self.assertEqual(results[0]["lead_id"], results[1]["lead_id"])
+        self.assertEqual(Lead.objects.count(), 2)
+
+
+class TTLCacheTests(SimpleTestCase):
+
+    def test_evicts_least_recently_used_and_expired_entries(self):
+        clock = FakeClock()
+        cache = TTLCache(maxsize=2, ttl=10, clock=clock)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual((cache.get("a"), cache.get("b"), cache.get("c")), (1, None, 3))
+
+        clock.now += 10
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 1)
+
+
+class ContactKeyTests(TestCase):
+
+    def setUp(self):
+        self.ali = Student.objects.create(first_name="Ali", phone="0300 1234567", email="ali@example.com")
+        # A duplicate from before the unique keys: migration 0017 left it unkeyed.
+        self.copy = Student.objects.create(first_name="Ali K", phone="0399 7654321")
+        Student.objects.filter(pk=self.copy.pk).update(
+            phone="+0300-1234567", email="ALI@example.com", phone_key=None, email_key=None
+        )
+
+    def form_data(self, student, **changes):
+        data = {
+            "first_name": student.first_name, "phone": student.phone, "email": student.email,
+            "application_status": student.application_status,
+        }
+        data.update(changes)
+        return data
+
+    def test_legacy_duplicates_can_still_be_saved_and_edited(self):
+        copy = Student.objects.get(pk=self.copy.pk)
+        copy.notes = "called"
+        copy.save()
+        copy.phone = "0300-1234567"  # same number, other format: still unkeyed
+        copy.save(update_fields=["phone"])
+        copy.refresh_from_db()
+        self.assertEqual((copy.phone_key, copy.email_key), (None, None))
+
+        form = StudentForm(self.form_data(copy, notes="edited"), instance=copy)
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+
+        form = StudentForm(self.form_data(copy, phone="0311 5550000"), instance=copy)
+        self.assertTrue(form.is_valid(), form.errors)
+        copy = form.save()
+        copy.refresh_from_db()
+        self.assertEqual((copy.phone_key, copy.email_key), ("03115550000", None))
+
+    def test_taken_contacts_are_refused_without_naming_the_owner(self):
+        form = StudentForm(
+            self.form_data(Student(), first_name="Eve", phone="03001234567", email="Ali@Example.com")
+        )
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors["phone"], ["This phone number is already registered."])
+        self.assertEqual(form.errors["email"], ["This email is already registered."])
+
+
+class ConcurrentUpsertTests(TransactionTestCase):
+    """Hundreds of parallel deliveries for a few people must not duplicate anyone."""
+
+    PEOPLE = 10
+
+    def setUp(self):
+        recent_leads().clear()
+
+    def run_parallel(self, func, count):
+        def call(i):
+            try:
+                return func(i)
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            return list(pool.map(call, range(count)))
+
+    def person(self, i):
+        n = i % self.PEOPLE
+        # Same person, differently formatted phone and email case.
+        phone = f"+92 300 000{n:04d}" if i % 2 else f"0092300000{n:04d}"
+        email = f"P{n}@Example.com" if i % 3 else f"p{n}@example.com"
+        return {"full_name": f"Person {n}", "phone": phone, "email": email}
+
+    def assert_one_student_per_person(self):
+        self.assertEqual(Student.objects.count(), self.PEOPLE)
+        self.assertEqual(
+            Student.objects.values("phone_key").distinct().count(), self.PEOPLE
+        )
+
+    def test_parallel_webhook_posts(self):
+        def post(i):
+            return Client().post(
+                reverse("webhook_lead"),
+                data=json.dumps(self.person(i)),
+                content_type="application/json",
+            ).status_code
+
+        codes = self.run_parallel(post, 300)
+
+        self.assertEqual(set(codes), {200})
+        self.assertEqual(Lead.objects.count(), 300)
+        self.assert_one_student_per_person()
+
+    def test_parallel_upserts(self):
+        def upsert(i):
+            person = self.person(i)
+            student, created = upsert_student(
+                phone=person["phone"], email=person["email"], first_name=person["full_name"]
+            )
+            return student.id, created
+
+        results = self.run_parallel(upsert, 200)
+
+        self.assertEqual(sum(created for _, created in results), self.PEOPLE)
+        self.assertEqual(len({student_id for student_id, _ in results}), self.PEOPLE)
+        self.assert_one_student_per_person()
+
+    def test_keys_are_normalised(self):
+        self.assertEqual(normalise_phone("+92 (300) 000-0001"), normalise_phone("0092300 0000001"))
+        self.assertIsNone(normalise_phone("123"))
@@ -0,0 +1,278 @@
+# crm/uploads.py
+"""
+Chunked, resumable document uploads.
+
+A large file posted in one multipart request holds a worker for as long as
+the client takes to send it, and a dropped connection loses all of it.
+Instead the browser (``student_create.html``) opens an ``UploadSession``
+and sends the file in chunks of ``UPLOAD_CHUNK_SIZE``:
+
+1. ``start``: the file's name, size and optionally its SHA-256.
+2. ``write_chunk`` for each chunk, at the offset the server acknowledged
+   last, with the chunk's SHA-256. The chunk is streamed to
+   ``UPLOAD_SESSION_DIR/<id>.part`` and synced to disk before the new
+   offset is acknowledged, so after a drop the client asks for the offset
+   and resumes there. A chunk at any other offset is refused (409) with the
+   acknowledged one; a chunk failing its checksum is discarded.
+3. ``attach``: the finished file becomes a ``StudentDocument`` in one
+   transaction, the part file moving into the document storage
+   (``crm/blobstore.py``) without a copy.
+
+Each request handles at most ``UPLOAD_CHUNK_MAX_BYTES``, so no worker is
+tied to one slow client for long. Sessions idle for ``UPLOAD_SESSION_TTL``
+are removed with their part files.
+
+A session belongs to the user who opened it; nobody else can see or write
+it. Each user may hold at most ``UPLOAD_MAX_SESSIONS_PER_USER`` unattached
+sessions totalling ``UPLOAD_MAX_PENDING_BYTES_PER_USER``, which bounds the
+disk one account can fill with part files.
+"""
+
+import fcntl
+import hashlib
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from .models import ActivityLog, StudentDocument, UploadSession
+
+READ_BLOCK_BYTES = 64 * 1024
+
+
+class UploadError(Exception):
+    """A refused upload request; ``status`` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400, session=None):
+        super().__init__(message)
+        self.status = status
+        self.session = session
+
+
+def part_path(session_id):
+    return os.path.join(settings.UPLOAD_SESSION_DIR, f"{session_id}.part")
+
+
+def get_session(session_id, user=None):
+    """The session ``session_id``; with ``user``, only if that user opened it."""
+    sessions = UploadSession.objects.all()
+    if user is not None:
+        sessions = sessions.filter(created_by=user)
+    try:
+        return sessions.get(pk=session_id)
+    except (UploadSession.DoesNotExist, ValidationError, ValueError):
+        raise UploadError("Unknown upload.", status=404)
+
+
+def _check_sha256(value, what):
+    value = (value or "").strip().lower()
+    if value and (len(value) != 64 or any(c not in "0123456789abcdef" for c in value)):
+        raise UploadError(f"Invalid {what} SHA-256.")
+    return value
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        while block := handle.read(READ_BLOCK_BYTES * 16):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# -------------------------------------------------------
+# SESSIONS
+# -------------------------------------------------------
+
+def start(filename, size, sha256="", user=None):
+    """Open an upload session for a file of ``size`` bytes."""
+    filename = os.path.basename(str(filename or "").replace("\\", "/")).strip()
+    if not filename:
+        raise UploadError("A file name is required.")
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        raise UploadError("The file size must be a number of bytes.")
+    if size < 1:
+        raise UploadError("The file is empty.")
+    if size > settings.UPLOAD_MAX_BYTES:
+        raise UploadError(
+            f"The file is larger than {settings.UPLOAD_MAX_BYTES // 2**20} MB.", status=413
+        )
+
+    sha256 = _check_sha256(sha256, "file")
+    user = user if user is not None and user.is_authenticated else None
+
+    purge_expired()
+    with transaction.atomic():
+        if user is not None:
+            _check_quota(user, size)
+        session = UploadSession.objects.create(
+            filename=filename[:255], size=size, sha256=sha256, created_by=user
+        )
+    os.makedirs(settings.UPLOAD_SESSION_DIR, exist_ok=True)
+    open(part_path(session.pk), "wb").close()
+    return session
+
+
+def _check_quota(user, size):
+    pending = (
+        UploadSession.objects.filter(created_by=user)
+        .exclude(status="attached")
+        .aggregate(count=Count("pk"), size=Sum("size"))
+    )
+    if pending["count"] >= settings.UPLOAD_MAX_SESSIONS_PER_USER:
+        raise UploadError(
+            "Too many unfinished uploads; finish or cancel some first.", status=429
+        )
+    if (pending["size"] or 0) + size > settings.UPLOAD_MAX_PENDING_BYTES_PER_USER:
+        raise UploadError(
+            f"Unfinished uploads may total at most "
+            f"{settings.UPLOAD_MAX_PENDING_BYTES_PER_USER // 2**20} MB.",
+            status=429,
+        )
+
+
+def write_chunk(session_id, offset, stream, length, sha256="", user=None):
+    """
+    Append ``length`` bytes read from ``stream`` at ``offset`` and return
+    the updated session. The chunk is checked against ``sha256`` when given;
+    with ``user``, only that user's sessions can be written.
+    """
+    sha256 = _check_sha256(sha256, "chunk")
+    try:
+        offset, length = int(offset), int(length)
+    except (TypeError, ValueError):
+        raise UploadError("Upload-Offset and Content-Length are required.")
+    if not 0 < length <= settings.UPLOAD_CHUNK_MAX_BYTES:
+        raise UploadError(
+            f"Chunks must be 1 to {settings.UPLOAD_CHUNK_MAX_BYTES} bytes.", status=413
+        )
+
+    session = get_session(session_id, user)
+    try:
+        handle = open(part_path(session.pk), "r+b")
+    except FileNotFoundError:
+        raise UploadError("This upload has expired; start again.", status=410)
+
+    with handle:
+        # One writer per session: a retried chunk racing its original waits
+        # here, then finds the offset already acknowledged.
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        session.refresh_from_db()
+        if session.status != "open":
+            raise UploadError("This upload is already complete.", status=409, session=session)
+        if offset != session.received:
+            raise UploadError(
+                f"Expected offset {session.received}.", status=409, session=session
+            )
+        if offset + length > session.size:
+            raise UploadError("The chunk runs past the declared file size.")
+
+        digest = hashlib.sha256()
+        handle.seek(offset)
+        remaining = length
+        while remaining:
+            block = stream.read(min(READ_BLOCK_BYTES, remaining))
+            if not block:
+                break
+            digest.update(block)
+            handle.write(block)
+            remaining -= len(block)
+
+        if remaining or (sha256 and digest.hexdigest() != sha256):
+            handle.truncate(offset)
+            message = "The chunk arrived incomplete." if remaining else "Chunk checksum mismatch."
+            raise UploadError(message, session=session)
+
+        handle.truncate(offset + length)
+        handle.flush()
+        os.fsync(handle.fileno())
+
+        session.received = offset + length
+        if session.received == session.size:
+            if session.sha256 and _hash_file(part_path(session.pk)) != session.sha256:
+                handle.truncate(0)
+                session.received = 0
+                session.save(update_fields=["received", "updated_at"])
+                raise UploadError(
+                    "File checksum mismatch; the upload starts over.", session=session
+                )
+            session.status = "complete"
+        session.save(update_fields=["received", "status", "updated_at"])
+    return session
+
+
+class _PartFile(File):
+    # Has a temporary_file_path, like Django's TemporaryUploadedFile, so the
+    # storage moves the part file into place instead of copying it.
+    def __init__(self, path, name):
+        super().__init__(open(path, "rb"), name)
+        self._path = path
+
+    def temporary_file_path(self):
+        return self._path
+
+
+def attach(session_id, student, title="", note="", user=None):
+    """
+    The ``StudentDocument`` made from a complete upload. Attaching an
+    upload twice returns the document made the first time. With ``user``,
+    only an upload that user opened can be attached.
+    """
+    with transaction.atomic():
+        session = get_session(session_id, user)
+        session = UploadSession.objects.select_for_update().get(pk=session.pk)
+        if session.status == "attached" and session.document_id:
+            return session.document
+        if session.status != "complete":
+            raise UploadError(
+                f"{session.filename} is not fully uploaded "
+                f"({session.received} of {session.size} bytes).",
+                status=409,
+                session=session,
+            )
+
+        document = StudentDocument(
+            student=student, title=title[:128], note=note, original_name=session.filename
+        )
+        path = part_path(session.pk)
+        try:
+            part = _PartFile(path, session.filename)
+        except FileNotFoundError:
+            raise UploadError("This upload has expired; start again.", status=410)
+        with part:
+            document.file.save(session.filename, part, save=False)
+        document.save()
+
+        session.status = "attached"
+        session.document = document
+        session.save(update_fields=["status", "document", "updated_at"])
+        ActivityLog.objects.create(
+            user=user if user is not None and user.is_authenticated else None,
+            student=student,
+            action="uploaded_document",
+            data={"document_id": document.id, "upload": str(session.pk)},
+        )
+
+    # Left behind when the content was already stored (the blob is shared).
+    if os.path.exists(path):
+        os.unlink(path)
+    return document
+
+
+def purge_expired():
+    """Delete sessions idle for longer than ``UPLOAD_SESSION_TTL`` and their files."""
+    cutoff = timezone.now() - timedelta(seconds=settings.UPLOAD_SESSION_TTL)
+    expired = list(UploadSession.objects.filter(updated_at__lt=cutoff).values_list("pk", flat=True))
+    for session_id in expired:
+        try:
+            os.unlink(part_path(session_id))
+        except FileNotFoundError:
+            pass
+    UploadSession.objects.filter(pk__in=expired).delete()
+    return len(expired)
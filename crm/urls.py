@@ -21,11 +21,20 @@ urlpatterns = [
     path("students/<int:pk>/", views.student_detail, name="student_detail"),
     path("students/<int:pk>/edit/", views.student_edit, name="student_edit"),
 
+    # Chunked, resumable document uploads (crm/uploads.py)
+    path("uploads/", views.upload_start, name="upload_start"),
+    path("uploads/<uuid:pk>/", views.upload_session, name="upload_session"),
+    path("uploads/<uuid:pk>/attach/", views.upload_attach, name="upload_attach"),
+
+    # Resized uploaded images, made on first request
+    path("images/<str:token>/", views.image_derivative, name="image_derivative"),
+
     # Leads
     path("leads/", views.leads_list, name="leads_list"),
 
     # Webhook for Facebook / other sources to create leads
     path("webhook/lead/", views.webhook_lead, name="webhook_lead"),
+    path("webhook/inbox/stats/", views.webhook_inbox_stats, name="webhook_inbox_stats"),
 
     # Users
     path("users/", views.manage_users, name="manage_users"),
@@ -44,6 +53,11 @@ urlpatterns = [
     # Email integration
     path("email/", views.email_integration, name="email_integration"),
     path("email/broadcast/", views.email_broadcast, name="email_broadcast"),
+    path(
+        "email/broadcast/<int:pk>/progress/",
+        views.email_broadcast_progress,
+        name="email_broadcast_progress",
+    ),
     path("email/send/<int:pk>/", views.student_send_email, name="student_send_email"),
 
     # Facebook integration page
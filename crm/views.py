@@ -3,35 +3,48 @@ from django.contrib.auth import get_user_model
 User = get_user_model()
 
 from django.urls import reverse
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.db.models import Count, Q
+from django.db.models import Count, Prefetch, Q
 from django.contrib import messages
 from django.utils import timezone
-from django.views.decorators.http import require_http_methods, require_GET
+from django.views.decorators.http import condition, require_http_methods, require_GET, require_safe
 from django.views.decorators.csrf import csrf_exempt
-from django.http import JsonResponse, HttpResponseBadRequest
+from django.http import Http404, JsonResponse, HttpResponseBadRequest
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
 from django.views.decorators.http import require_POST
 
 from django.core.mail import EmailMessage
 from django.conf import settings
 import json
+import os
 
 from .models import (
     Student,
     Lead,
     Country,
-    Tag,
     StudentDocument,
     ActivityLog,
     EmailLog,
+    BroadcastJob,
 )
+from . import media, refdata, uploads
+from .attachments import attach_documents
+from .broadcast import audience_queryset, create_job
+from .caching import cached_dashboard, dashboard_key, data_modified
+from .exports import FORMATS as EXPORT_FORMATS, export_query, export_response
+from .inbox import enqueue, inbox_stats
+from .idempotency import request_keys
+from .images import make_derivative, read_token
+from .leads import cached_replays, ingest_leads
+from .mailer import SendResult, apply_results, get_sender
+from .metrics import breakdown, daily_series, format_growth, period_summary
+from .pagination import paginate_keyset
+from .search import APPLICATION_SEARCH_COLUMNS, STUDENT_SEARCH_COLUMNS, search_students
 
 from .forms import (
     StudentForm,
     DocumentForm,
     StudentFilterForm,
-    LeadForm,
     UserEditForm,
     EmailSendForm,
     EmailBroadcastForm,
@@ -56,6 +69,25 @@ DOC_FIELDS = [
 ]
 
 
+def _save_documents(request, student):
+    """
+    Attach the ``DOC_FIELDS`` files of a student form: posted with it, or
+    uploaded beforehand in chunks (crm/uploads.py), whose session ids come
+    in ``<field>_upload``.
+    """
+    for field_name, label in DOC_FIELDS:
+        uploaded = request.FILES.get(field_name)
+        if uploaded:
+            StudentDocument.objects.create(student=student, title=label, file=uploaded)
+
+        upload_id = request.POST.get(f"{field_name}_upload")
+        if upload_id:
+            try:
+                uploads.attach(upload_id, student, title=label, user=request.user)
+            except uploads.UploadError as e:
+                messages.error(request, f"{label}: {e}")
+
+
 # -------------------------------------------------------
 # SEND EMAIL TO SINGLE STUDENT
 # -------------------------------------------------------
@@ -83,34 +115,51 @@ def student_send_email(request, pk):
             )
 
             if include_docs:
-                for doc in student.documents.all():
-                    if doc.file:
-                        try:
-                            email.attach_file(doc.file.path)
-                        except Exception:
-                            # ignore missing files
-                            pass
-
-            status = "sent"
-            error = ""
+                skipped = attach_documents(email, student.documents.all())
+                if skipped:
+                    ActivityLog.objects.create(
+                        user=request.user,
+                        student=student,
+                        action="email_attachments_skipped",
+                        data={"subject": subject, "skipped": skipped},
+                    )
+                    messages.warning(
+                        request,
+                        "Some documents were not attached: "
+                        + ", ".join(f"{d['title']} ({d['reason'].replace('_', ' ')})" for d in skipped),
+                    )
 
             try:
-                email.send()
-                messages.success(request, "Email sent successfully.")
+                # Never sleep on the rate limiter inside a request: past a few
+                # seconds the email is held back and sent by run_broadcasts.
+                [result] = get_sender().send_messages(
+                    [email], max_wait=settings.EMAIL_INTERACTIVE_MAX_WAIT
+                )
             except Exception as e:
-                status = "failed"
-                error = str(e)
-                messages.error(request, "Failed to send email. Please check email settings.")
+                result = SendResult(False, str(e), True)
 
-            EmailLog.objects.create(
+            log = EmailLog(
                 student=student,
                 to_email=student.email,
                 from_email=settings.DEFAULT_FROM_EMAIL,
                 subject=subject,
                 body=body,
-                status=status,
-                error_message=error,
             )
+            apply_results([log], [result])
+            if include_docs:
+                # Attachments are not stored, so this email cannot be re-sent later.
+                log.next_retry_at = None
+            log.save()
+
+            if result.ok:
+                messages.success(request, "Email sent successfully.")
+            elif result.retry_at is not None and log.next_retry_at:
+                messages.warning(
+                    request,
+                    "Sending is paused by the mail rate limit; the email will be sent automatically.",
+                )
+            else:
+                messages.error(request, "Failed to send email. Please check email settings.")
 
             return redirect("student_detail", pk=pk)
     else:
@@ -133,7 +182,20 @@ def student_send_email(request, pk):
 @login_required
 def email_integration(request):
     broadcast_form = EmailBroadcastForm()
-    recent_emails = EmailLog.objects.select_related("student", "lead")[:30]
+    recent_emails = (
+        EmailLog.objects.select_related("student", "lead", "template")
+        .defer("body", "template__body")[:30]
+    )
+    broadcast_jobs = BroadcastJob.objects.defer("recipient_ids")[:10]
+
+    today = timezone.localdate()
+    email_stats = EmailLog.objects.aggregate(
+        sent_today=Count("id", filter=Q(status="sent", sent_at__date=today)),
+        retried_ok=Count("id", filter=Q(status="sent", attempts__gt=1)),
+        retry_pending=Count("id", filter=Q(status="failed", next_retry_at__isnull=False)),
+        failed_final=Count("id", filter=Q(status="failed", next_retry_at__isnull=True)),
+    )
+    email_stats["daily_quota"] = settings.EMAIL_RATE_PER_DAY
 
     return render(
         request,
@@ -141,6 +203,8 @@ def email_integration(request):
         {
             "broadcast_form": broadcast_form,
             "recent_emails": recent_emails,
+            "broadcast_jobs": broadcast_jobs,
+            "email_stats": email_stats,
         },
     )
 
@@ -154,7 +218,8 @@ def email_broadcast(request):
     form = EmailBroadcastForm(request.POST)
 
     if not form.is_valid():
-        messages.error(request, "Please fix the errors in the form.")
+        errors = " ".join(e for field_errors in form.errors.values() for e in field_errors)
+        messages.error(request, f"Please fix the errors in the form. {errors}")
         return redirect("email_integration")
 
     audience = form.cleaned_data["audience"]
@@ -164,65 +229,48 @@ def email_broadcast(request):
     country = form.cleaned_data["country"]
     status = form.cleaned_data["status"]
 
-    qs = Student.objects.filter(archived=False).exclude(email="")
-
-    if audience == "course" and course:
-        qs = qs.filter(course__icontains=course)
-    elif audience == "country" and country:
-        qs = qs.filter(country=country)
-    elif audience == "status" and status:
-        qs = qs.filter(application_status=status)
+    qs = audience_queryset(audience, course=course, country=country, status=status)
+
+    job = create_job(
+        subject,
+        body,
+        qs,
+        filters={
+            "audience": audience,
+            "course": course,
+            "country": country.id if country else None,
+            "status": status,
+        },
+        user=request.user,
+    )
 
-    total = qs.count()
-    if total == 0:
+    if job.total == 0:
+        job.delete()
         messages.warning(request, "No students matched your filters.")
         return redirect("email_integration")
 
-    sent_count = 0
-
-    for student in qs:
-        personalized_body = body.replace("{{ first_name }}", student.first_name or "")
-
-        email = EmailMessage(
-            subject=subject,
-            body=personalized_body,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            to=[student.email],
-        )
-
-        status_flag = "sent"
-        error_msg = ""
-
-        try:
-            email.send()
-            sent_count += 1
-        except Exception as e:
-            status_flag = "failed"
-            error_msg = str(e)
-
-        EmailLog.objects.create(
-            student=student,
-            to_email=student.email,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            subject=subject,
-            body=personalized_body,
-            status=status_flag,
-            error_message=error_msg,
-        )
-
     messages.success(
         request,
-        f"Broadcast finished. Sent {sent_count} emails out of {total} students.",
+        f"Broadcast queued for {job.total} students. Progress is shown below.",
     )
     return redirect("email_integration")
 
+
+@login_required
+@require_GET
+def email_broadcast_progress(request, pk):
+    job = get_object_or_404(BroadcastJob, pk=pk)
+    return JsonResponse(job.progress())
+
 # -------------------------------------------------------
 # STUDENTS LIST
 # -------------------------------------------------------
 
 def students_list(request):
-    qs = Student.objects.select_related("country").prefetch_related("tags")
-    form = StudentFilterForm(request.GET or None)
+    params = request.GET.copy()
+    export = params.pop("export", [None])[-1]
+    qs = Student.objects.all()
+    form = StudentFilterForm(params or None)
 
     if form.is_valid():
         q = form.cleaned_data.get("q")
@@ -231,13 +279,7 @@ def students_list(request):
         archived = form.cleaned_data.get("archived")
 
         if q:
-            qs = qs.filter(
-                Q(first_name__icontains=q)
-                | Q(last_name__icontains=q)
-                | Q(email__icontains=q)
-                | Q(phone__icontains=q)
-                | Q(passport_number__icontains=q)
-            )
+            qs = search_students(qs, q, STUDENT_SEARCH_COLUMNS)
 
         if country:
             qs = qs.filter(country=country)
@@ -251,25 +293,28 @@ def students_list(request):
         else:
             qs = qs.filter(archived=False)
 
-    # ordering & pagination
-    qs = qs.order_by("-created_at")
-    page = request.GET.get("page", 1)
-    paginator = Paginator(qs, 12)
+    if export:
+        return _export(request, qs, export, "students")
 
-    try:
-        students = paginator.page(page)
-    except PageNotAnInteger:
-        students = paginator.page(1)
-    except EmptyPage:
-        students = paginator.page(paginator.num_pages)
+    qs = qs.select_related("country").prefetch_related("tags")
+    students = paginate_keyset(request, qs, per_page=12, with_total=True)
 
     return render(
         request,
         "crm/students_list.html",
-        {"students": students, "filter_form": form},
+        {"students": students, "filter_form": form, "export_query": export_query(request)},
     )
 
 
+def _export(request, queryset, fmt, filename):
+    """The filtered list as a CSV/XLSX download; exports need a signed-in user."""
+    if not request.user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+    if fmt not in EXPORT_FORMATS:
+        return HttpResponseBadRequest("Unknown export format.")
+    return export_response(queryset, fmt, filename)
+
+
 # -------------------------------------------------------
 # MANAGE USERS
 # -------------------------------------------------------
@@ -385,20 +430,14 @@ def user_delete(request, pk):
 # -------------------------------------------------------
 
 def applications_list(request):
-    base_qs = Student.objects.select_related("country").prefetch_related("documents")
+    qs = Student.objects.all()
 
     search_q = request.GET.get("q", "").strip()
     filter_status = request.GET.get("status", "").strip()
     filter_country = request.GET.get("country", "").strip()
 
-    qs = base_qs
-
     if search_q:
-        qs = qs.filter(
-            Q(first_name__icontains=search_q)
-            | Q(last_name__icontains=search_q)
-            | Q(course__icontains=search_q)
-        )
+        qs = search_students(qs, search_q, APPLICATION_SEARCH_COLUMNS)
 
     if filter_status:
         qs = qs.filter(application_status=filter_status)
@@ -406,18 +445,38 @@ def applications_list(request):
     if filter_country:
         qs = qs.filter(country_id=filter_country)
 
+    if request.GET.get("export"):
+        return _export(request, qs, request.GET["export"], "applications")
+
+    documents = StudentDocument.objects.only("id", "student_id", "file", "original_name").order_by("id")
+    qs = (
+        qs.select_related("country")
+        .only(
+            "id", "first_name", "last_name", "course", "notes",
+            "application_status", "created_at", "country__name",
+        )
+        .annotate(document_count=Count("documents"))
+        .prefetch_related(Prefetch("documents", queryset=documents))
+    )
+
+    # All status cards from one conditional-aggregation query
+    counts = Student.objects.aggregate(
+        total_apps=Count("id"),
+        pending_count=Count("id", filter=Q(application_status="pending")),
+        under_review_count=Count("id", filter=Q(application_status="under_review")),
+        approved_count=Count("id", filter=Q(application_status="approved")),
+        rejected_count=Count("id", filter=Q(application_status="rejected")),
+    )
+
     context = {
-        "applications": qs,
-        "total_apps": base_qs.count(),
-        "pending_count": base_qs.filter(application_status="pending").count(),
-        "under_review_count": base_qs.filter(application_status="under_review").count(),
-        "approved_count": base_qs.filter(application_status="approved").count(),
-        "rejected_count": base_qs.filter(application_status="rejected").count(),
+        "applications": paginate_keyset(request, qs, per_page=20),
+        **counts,
         "search_q": search_q,
         "filter_status": filter_status,
         "filter_country": filter_country,
         "status_choices": Student.APPLICATION_STATUS_CHOICES,
-        "countries": Country.objects.all(),
+        "countries": refdata.rows(Country),
+        "export_query": export_query(request),
     }
 
     return render(request, "crm/applications_list.html", context)
@@ -470,10 +529,7 @@ def student_create(request):
             student.save()
             form.save_m2m()
 
-            for field_name, label in DOC_FIELDS:
-                uploaded = request.FILES.get(field_name)
-                if uploaded:
-                    StudentDocument.objects.create(student=student, title=label, file=uploaded)
+            _save_documents(request, student)
 
             messages.success(request, "Student added successfully.")
             return redirect("student_detail", pk=student.pk)
@@ -499,10 +555,7 @@ def student_edit(request, pk):
             student.save()
             form.save_m2m()
 
-            for field_name, label in DOC_FIELDS:
-                uploaded = request.FILES.get(field_name)
-                if uploaded:
-                    StudentDocument.objects.create(student=student, title=label, file=uploaded)
+            _save_documents(request, student)
 
             messages.success(request, "Student updated successfully.")
             return redirect("students_list")
@@ -542,18 +595,134 @@ def student_detail(request, pk):
 
 
 # -------------------------------------------------------
-# LEADS LIST
+# IMAGE DERIVATIVES
 # -------------------------------------------------------
 
-def leads_list(request):
-    qs = Lead.objects.select_related("student").order_by("-created_at")
-    paginator = Paginator(qs, 25)
-    page = request.GET.get("page")
+@require_safe
+def image_derivative(request, token):
+    """A thumbnail/preview (crm/images.py), made if missing, for users who may see the image."""
+    if not request.user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+    found = read_token(token)
+    filename = found and media.find(request.user, found[0])
+    derivative = make_derivative(*found) if filename else None
+    if derivative is None:
+        raise Http404("No such image.")
+    stem = os.path.splitext(filename)[0]
+    return media.serve(request, derivative, f"{stem}-{found[1]}{os.path.splitext(derivative)[1]}")
 
+
+# -------------------------------------------------------
+# PROTECTED MEDIA
+# -------------------------------------------------------
+
+@require_safe
+def protected_media(request, name):
+    """An uploaded file (``MEDIA_URL``), for users who may see its student (crm/media.py)."""
+    if not request.user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+    filename = media.find(request.user, name)
+    if filename is None:
+        raise Http404("No such file.")
+    return media.serve(request, name, filename)
+
+
+# -------------------------------------------------------
+# CHUNKED UPLOADS
+# -------------------------------------------------------
+
+def _upload_state(session):
+    return {
+        "id": str(session.pk),
+        "offset": session.received,
+        "size": session.size,
+        "status": session.status,
+    }
+
+
+def _upload_error(error):
+    data = {"error": str(error)}
+    if error.session is not None:
+        data.update(_upload_state(error.session))
+    return JsonResponse(data, status=error.status)
+
+
+@login_required
+@require_POST
+def upload_start(request):
+    """Open an upload session: JSON ``{"filename", "size", "sha256"?}``."""
     try:
-        leads = paginator.page(page)
-    except:
-        leads = paginator.page(1)
+        data = json.loads(request.body or b"{}")
+    except ValueError:
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+    if not isinstance(data, dict):
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+
+    try:
+        session = uploads.start(
+            data.get("filename"), data.get("size"), data.get("sha256"), user=request.user
+        )
+    except uploads.UploadError as e:
+        return _upload_error(e)
+
+    url = reverse("upload_session", args=[session.pk])
+    response = JsonResponse(
+        {**_upload_state(session), "chunk_size": settings.UPLOAD_CHUNK_SIZE, "url": url},
+        status=201,
+    )
+    response["Location"] = url
+    return response
+
+
+@login_required
+@require_http_methods(["GET", "PUT"])
+def upload_session(request, pk):
+    """
+    GET: the acknowledged offset, to resume from.
+    PUT: the chunk at ``Upload-Offset`` as the raw body, with its SHA-256
+    in ``Upload-Checksum`` (hex). 409 with the offset when it is not the
+    acknowledged one.
+    """
+    try:
+        if request.method == "GET":
+            session = uploads.get_session(pk, request.user)
+        else:
+            # Read from the stream in blocks: request.body would hold the
+            # whole chunk in memory.
+            session = uploads.write_chunk(
+                pk,
+                request.headers.get("Upload-Offset"),
+                request,
+                request.headers.get("Content-Length"),
+                request.headers.get("Upload-Checksum", ""),
+                user=request.user,
+            )
+    except uploads.UploadError as e:
+        return _upload_error(e)
+    return JsonResponse(_upload_state(session))
+
+
+@login_required
+@require_POST
+def upload_attach(request, pk):
+    """Attach a finished upload to student ``student`` (POST field), with ``title``."""
+    student = get_object_or_404(Student, pk=request.POST.get("student") or 0)
+    try:
+        document = uploads.attach(
+            pk, student, title=request.POST.get("title", ""), user=request.user
+        )
+    except uploads.UploadError as e:
+        return _upload_error(e)
+    return JsonResponse({"document_id": document.id, "filename": document.filename}, status=201)
+
+
+# -------------------------------------------------------
+# LEADS LIST
+# -------------------------------------------------------
+
+def leads_list(request):
+    qs = Lead.objects.select_related("student")
+    leads = paginate_keyset(request, qs, per_page=25, with_total=True)
 
     return render(request, "crm/leads_list.html", {"leads": leads})
 
@@ -562,41 +731,53 @@ def leads_list(request):
 # DASHBOARD
 # -------------------------------------------------------
 
-def dashboard(request):
-    context = {
-        "total_students": Student.objects.count(),
-        "new_this_month": Student.objects.filter(
-            created_at__gte=timezone.now() - timezone.timedelta(days=30)
-        ).count(),
-        "total_applications": Student.objects.count(),
-        "growth_rate": "+12%",
+def _dashboard_context():
+    students = period_summary("student")
+    return {
+        "total_students": students["total"],
+        "new_this_month": students["recent"],
+        "total_applications": students["total"],
+        "growth_rate": format_growth(students["growth_rate"]),
     }
-    return render(request, "crm/dashboard.html", context)
 
 
-@require_GET
-def dashboard_stats(request):
-    country_qs = (
-        Student.objects.values("country__name")
-        .annotate(count=Count("id"))
-        .order_by("-count")
-    )
+def dashboard(request):
+    context = cached_dashboard("context", _dashboard_context)
+    return render(request, "crm/dashboard.html", context)
 
-    lead_qs = Lead.objects.values("source").annotate(count=Count("id"))
 
-    data = {
-        "countries": [c["country__name"] or "Unknown" for c in country_qs],
-        "country_counts": [c["count"] for c in country_qs],
-        "lead_labels": [l["source"] for l in lead_qs],
-        "lead_counts": [l["count"] for l in lead_qs],
-        "recent_students": Student.objects.filter(
-            created_at__gte=timezone.now() - timezone.timedelta(days=30)
-        ).count(),
-        "total_students": Student.objects.count(),
-        "total_leads": Lead.objects.count(),
+def _dashboard_stats():
+    students = period_summary("student")
+    leads = period_summary("lead")
+    countries = breakdown("student", "country__name")
+    sources = breakdown("lead", "source")
+    days, student_series = daily_series("student")
+    _, lead_series = daily_series("lead")
+
+    return {
+        "countries": [name or "Unknown" for name, _ in countries],
+        "country_counts": [count for _, count in countries],
+        "lead_labels": [source for source, _ in sources],
+        "lead_counts": [count for _, count in sources],
+        "recent_students": students["recent"],
+        "total_students": students["total"],
+        "total_leads": leads["total"],
+        "student_growth_rate": students["growth_rate"],
+        "lead_growth_rate": leads["growth_rate"],
+        "days": days,
+        "daily_students": student_series,
+        "daily_leads": lead_series,
     }
 
-    return JsonResponse(data)
+
+# Polled by the dashboard charts: unchanged data answers 304 Not Modified.
+@require_GET
+@condition(
+    etag_func=lambda request: dashboard_key("stats"),
+    last_modified_func=lambda request: data_modified(),
+)
+def dashboard_stats(request):
+    return JsonResponse(cached_dashboard("stats", _dashboard_stats))
 
     # views.py
 from django.views.decorators.http import require_http_methods
@@ -641,7 +822,11 @@ def webhook_lead(request):
     """
     Generic lead webhook.
 
-    Expected JSON payload (example from Zapier/Make/Facebook):
+    Expected JSON payload (example from Zapier/Make/Facebook), or a JSON
+    array of them, which returns {"status": "ok", "results": [...]} with one
+    entry per lead (see crm/leads.py). Redeliveries (same facebook.lead_id
+    or Idempotency-Key header) return the original lead with
+    "duplicate": true:
     {
         "source": "facebook",
         "full_name": "Ali Khan",
@@ -668,104 +853,49 @@ def webhook_lead(request):
             status=400,
         )
 
-    # --- 1) Extract core fields from payload ---
-    source = data.get("source", "facebook")
-
-    phone = data.get("phone") or data.get("phone_number")
-    email = data.get("email")
-
-    full_name = data.get("full_name", "") or ""
-    first_name = data.get("first_name") or ""
-    last_name = data.get("last_name") or ""
-
-    # If only full_name provided, split it
-    if not first_name and full_name:
-        parts = full_name.strip().split(" ", 1)
-        first_name = parts[0]
-        if len(parts) > 1:
-            last_name = parts[1]
-
-    course = data.get("course") or data.get("interested_course")
-    country_name = data.get("country")  # e.g. "Pakistan"
-
-    # --- 2) Try to find existing student by phone/email ---
-    student = None
+    # A JSON array is a batch (e.g. a Zapier/Make replay): one result per item.
+    if isinstance(data, list):
+        if len(data) > settings.WEBHOOK_MAX_BATCH:
+            return JsonResponse(
+                {
+                    "status": "error",
+                    "message": f"At most {settings.WEBHOOK_MAX_BATCH} leads per request",
+                },
+                status=400,
+            )
+    elif not isinstance(data, dict):
+        return JsonResponse(
+            {"status": "error", "message": "Expected a JSON object or array"},
+            status=400,
+        )
 
-    if phone:
-        student = Student.objects.filter(phone=phone).first()
+    items = data if isinstance(data, list) else [data]
+    keys = request_keys(
+        request.headers.get("Idempotency-Key", "").strip(), len(items), isinstance(data, list)
+    )
 
-    if not student and email:
-        student = Student.objects.filter(email=email).first()
+    # Redeliveries seen recently by this process are answered from memory.
+    results = cached_replays(items, keys)
 
-    # --- 3) If no student exists, create one from this lead ---
-    new_student = False
-    if not student:
-        student = Student(
-            first_name=first_name or "Facebook",
-            last_name=last_name or "Lead",
-            phone=phone or "",
-            email=email or "",
-            course=course or "",
-        )
+    if results is None and settings.WEBHOOK_ASYNC:
+        inbox_ids = enqueue(items, keys)
+        return JsonResponse({"status": "accepted", "inbox_ids": inbox_ids}, status=202)
 
-        # set country if given
-        if country_name:
-            country_obj, _ = Country.objects.get_or_create(name=country_name)
-            student.country = country_obj
+    if results is None:
+        results = ingest_leads(items, keys)
 
-        student.save()
-        new_student = True
+    if isinstance(data, list):
+        return JsonResponse({"status": "ok", "results": results})
 
-        # Tag as "Facebook Lead"
-        fb_tag, _ = Tag.objects.get_or_create(name="Facebook Lead")
-        student.tags.add(fb_tag)
+    return JsonResponse(results[0])
 
-    # --- 4) Choose counselor to assign this lead to (optional but useful) ---
-    counselor = (
-        User.objects.filter(is_active=True, is_staff=True)
-        .order_by("id")
-        .first()
-    )
 
-    # --- 5) Create Lead record ---
-    # If you added extra fields in Lead (campaign_name, adset_name, ad_name, fb_lead_id),
-    # this will populate them from the nested "facebook" object.
-    facebook_data = data.get("facebook", {}) or {}
-
-    lead = Lead.objects.create(
-        source=source or "facebook",
-        phone=phone,
-        email=email,
-        student=student,
-        payload=data,   # store raw JSON for later analysis
-        assigned_to=counselor,
-        # 🔻 these four lines require the fields to exist on Lead model
-        campaign_name=facebook_data.get("campaign_name", ""),
-        adset_name=facebook_data.get("adset_name", ""),
-        ad_name=facebook_data.get("ad_name", ""),
-        fb_lead_id=facebook_data.get("lead_id", ""),
-    )
+@login_required
+@require_GET
+def webhook_inbox_stats(request):
+    return JsonResponse(inbox_stats())
 
-    # --- 6) Activity Log (optional but nice) ---
-    ActivityLog.objects.create(
-        user=None,
-        student=student,
-        action="lead_created",
-        data={
-            "source": source,
-            "lead_id": lead.id,
-            "new_student_created": new_student,
-        },
-    )
 
-    return JsonResponse(
-        {
-            "status": "ok",
-            "lead_id": lead.id,
-            "student_id": student.id,
-            "new_student": new_student,
-        }
-    )
 @login_required
 def facebook_integration(request):
     """
@@ -776,14 +906,12 @@ def facebook_integration(request):
     webhook_url = request.build_absolute_uri(reverse("webhook_lead"))
 
     # All leads with source="facebook"
-    fb_leads_qs = (
-        Lead.objects.filter(source="facebook")
-        .select_related("student")
-        .order_by("-created_at")
-    )
+    fb_leads_qs = Lead.objects.filter(source="facebook").select_related("student")
+    fb_leads = paginate_keyset(request, fb_leads_qs, per_page=50, with_total=True)
 
     stats = {
-        "total_fb_leads": fb_leads_qs.count(),
+        "inbox": inbox_stats(),
+        "total_fb_leads": fb_leads.total,
         "last_30_days": fb_leads_qs.filter(
             created_at__gte=timezone.now() - timezone.timedelta(days=30)
         ).count(),
@@ -794,7 +922,7 @@ def facebook_integration(request):
         "crm/facebook_integration.html",
         {
             "webhook_url": webhook_url,
-            "fb_leads": fb_leads_qs,
+            "fb_leads": fb_leads,
             "stats": stats,
         },
     )